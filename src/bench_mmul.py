@@ -0,0 +1,43 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Compare the matrix product of naive_algebra against the previous
+implementation, which built a row and a column Vector for every output cell.
+
+Usage: bench_mmul.py [repeat]
+"""
+
+import sys, timeit
+from naive_algebra import Matrix, dot_prod, mmul
+
+# (rows of left, inner size, columns of right)
+SHAPES = [(10, 784, 10), (100, 100, 100), (500, 500, 500)]
+
+def reference_mul(one, other):
+    return Matrix.fromIterable(one.row_num, other.col_num,
+            (dot_prod(one.row(row_id), other.col(col_id))
+                for row_id in xrange(one.row_num)
+                for col_id in xrange(other.col_num)))
+
+def best_of(func, repeat):
+    return min(timeit.repeat(func, number = 1, repeat = repeat))
+
+def main(repeat):
+    print "%-16s %12s %12s %12s %8s" % ('shape', 'reference', 'mmul', 'mmul(out)', 'speedup')
+    for (n, k, m) in SHAPES:
+        one = Matrix.fromRandom(n, k)
+        other = Matrix.fromRandom(k, m)
+        out = Matrix(n, m)
+
+        if not reference_mul(one, other).equalTo(mmul(one, other), 1e-9):
+            raise ValueError('mmul disagrees with the reference for %dx%dx%d' % (n, k, m))
+
+        t_ref = best_of(lambda: reference_mul(one, other), repeat)
+        t_new = best_of(lambda: mmul(one, other), repeat)
+        t_out = best_of(lambda: mmul(one, other, out), repeat)
+        print "%-16s %11.4fs %11.4fs %11.4fs %7.2fx" % ('%dx%d * %dx%d' % (n, k, k, m),
+                t_ref, t_new, t_out, t_ref / min(t_new, t_out))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Benchmark suite of the algebra kernels and the network.
+
+Micro benchmarks time the Vector operators, dot_prod, vmul, Matrix.mul and
+vsigmoid across sizes, and expressions evaluated eagerly against lazily.
+Macro benchmarks time training in samples per second, the inference latency
+and the loading of MNIST files, on a synthetic dataset made by
+synthetic_mnist so no real one is needed.
+
+Every result is the best time of one unit of work, a call or a sample,
+over several rounds, thus lower is always better. Results are written as
+JSON, and compared against a stored baseline to flag regressions:
+
+    benchmark.py run [-o current.json] [-b baseline.json] [-k filter]
+    benchmark.py compare baseline.json current.json
+"""
+
+import sys, time, json, random, platform, tempfile, shutil, argparse
+
+import naive_algebra
+from naive_algebra import Vector, Matrix, dot_prod, mmul, vmul
+from feedforward_network import FeedForwardNetwork, sample_wrapper, vsigmoid
+
+# relative slowdown above which a benchmark is flagged as a regression
+THRESHOLD = 0.15
+
+def measure(func, repeat = 5, min_time = 0.05):
+    """
+    Best seconds per call of func over repeat rounds, every round calling
+    it enough times to last at least min_time.
+    """
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else min(10, max(2, int(min_time / elapsed) + 1))
+
+    best = elapsed / number
+    for i in xrange(repeat - 1):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        best = min(best, (time.time() - start) / number)
+    return best
+
+def micro_benchmarks():
+    """ (name, unit, function) of every kernel benchmark """
+    random.seed(0)
+    cases = []
+    for n in (100, 1000, 10000):
+        a, b = Vector.fromRandom(n), Vector.fromRandom(n)
+        cases.append(('vector_add/%d' % n, 'call', lambda a = a, b = b: a + b))
+        cases.append(('vector_scale/%d' % n, 'call', lambda a = a: a * 0.5))
+        cases.append(('dot_prod/%d' % n, 'call', lambda a = a, b = b: dot_prod(a, b)))
+        cases.append(('vsigmoid/%d' % n, 'call', lambda a = a: vsigmoid(a)))
+
+    for (rows, cols) in ((10, 784), (30, 784), (100, 100)):
+        m, x = Matrix.fromRandom(rows, cols), Vector.fromRandom(cols)
+        cases.append(('vmul/%dx%d' % (rows, cols), 'call', lambda m = m, x = x: vmul(m, x)))
+
+    # the same expressions evaluated eagerly and lazily, as fused kernels
+    m, x, b = Matrix.fromRandom(30, 784), Vector.fromRandom(784), Vector.fromRandom(30)
+    w, g = Matrix.fromRandom(30, 784), Matrix.fromRandom(30, 784)
+    y, z = Vector.fromRandom(10000), Vector.fromRandom(10000)
+    for lazy in (False, True):
+        mode = 'lazy' if lazy else 'eager'
+        def expression(build, out, lazy = lazy):
+            def run():
+                with naive_algebra.lazy(lazy):
+                    out.assign(build())
+            return run
+        cases.append(('expr_affine/%s' % mode, 'call', expression(
+            lambda: naive_algebra.activate('tanh', (vmul(m, x) + b) * 0.5), Vector.fromZeros(30))))
+        cases.append(('expr_update/%s' % mode, 'call', expression(
+            lambda: w - g * 0.01, w)))
+        cases.append(('expr_chain/%s' % mode, 'call', expression(
+            lambda: (y - z * 0.3) * 0.5 + z, Vector.fromZeros(10000))))
+
+    for (n, k, c) in ((10, 784, 10), (50, 50, 50), (100, 100, 100)):
+        one, other = Matrix.fromRandom(n, k), Matrix.fromRandom(k, c)
+        cases.append(('mmul/%dx%dx%d' % (n, k, c), 'call',
+            lambda one = one, other = other: mmul(one, other)))
+
+    return cases
+
+def macro_benchmarks(data_dir, samples = 100):
+    """
+    (name, unit, function, count) of the network and loading benchmarks,
+    where a call of function handles count units
+    """
+    import mnist_adapter
+
+    training = mnist_adapter.MNIST(data_dir, mapped = True).load_training()
+    dim_list = [len(training[0][0]), 30, 10]
+    random.seed(0)
+    network = FeedForwardNetwork(dim_list)
+    inputs = Matrix.fromRows(training[0][:100])
+    x = Vector(training[0][0])
+
+    def train(batch_size):
+        def run():
+            network.train(sample_wrapper(training), None, limit = samples,
+                    batch_size = batch_size)
+        return run
+
+    def load(mapped):
+        def run():
+            mnist_adapter.MNIST(data_dir, mapped = mapped).load_training()
+        return run
+
+    return [
+            ('train/batch1', 'sample', train(1), samples),
+            ('train/batch20', 'sample', train(20), samples),
+            ('inference/single', 'sample', lambda: network.inference(x), 1),
+            ('inference/batch100', 'sample', lambda: network.predict_batch(inputs), 100),
+            ('mnist_load/eager', 'call', load(False), 1),
+            ('mnist_load/mapped', 'call', load(True), 1),
+            ]
+
+def run(name_filter = None, train_size = 2000, repeat = 5):
+    """
+    Run the benchmarks whose name contains name_filter, all by default,
+    and return the report as a dict ready for JSON.
+    """
+    data_dir = tempfile.mkdtemp(prefix = 'benchmark-')
+    try:
+        import synthetic_mnist
+        synthetic_mnist.generate(data_dir, train_size, 100)
+
+        cases = [(name, unit, func, 1) for (name, unit, func) in micro_benchmarks()]
+        cases += macro_benchmarks(data_dir)
+        results = {}
+        for (name, unit, func, count) in cases:
+            if name_filter and name_filter not in name:
+                continue
+            seconds = measure(func, repeat) / count
+            results[name] = {'seconds': seconds, 'unit': unit}
+            print "%-24s %12.3fus/%s %14.1f/s" % (name, seconds * 1e6, unit, 1.0 / seconds)
+    finally:
+        shutil.rmtree(data_dir)
+
+    return {
+            'meta': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'backend': naive_algebra.get_backend().name,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                },
+            'results': results,
+            }
+
+def compare(baseline, current, threshold = THRESHOLD, out = sys.stdout):
+    """
+    Print every benchmark of current against baseline, and return the names
+    of those slower by more than threshold, relatively.
+    """
+    regressions = []
+    out.write("%-24s %12s %12s %8s\n" % ('benchmark', 'baseline', 'current', 'change'))
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['seconds']
+        new = current['results'][name]['seconds']
+        change = new / old - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        out.write("%-24s %10.3fus %10.3fus %+7.1f%%%s\n" % (name, old * 1e6, new * 1e6,
+            change * 100, flag))
+
+    if baseline['meta'].get('backend') != current['meta'].get('backend'):
+        out.write("warning: backends differ, %s against %s\n" % (
+            baseline['meta'].get('backend'), current['meta'].get('backend')))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'benchmark naive_algebra and the network')
+    commands = parser.add_subparsers(dest = 'command')
+    run_parser = commands.add_parser('run', help = 'run the benchmarks')
+    run_parser.add_argument('-o', '--output', help = 'write the results into this JSON file')
+    run_parser.add_argument('-b', '--baseline', help = 'compare against this JSON file')
+    run_parser.add_argument('-k', '--filter', help = 'only benchmarks with this in the name')
+    run_parser.add_argument('-r', '--repeat', type = int, default = 5)
+    run_parser.add_argument('-t', '--threshold', type = float, default = THRESHOLD)
+    compare_parser = commands.add_parser('compare', help = 'compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('-t', '--threshold', type = float, default = THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        current = run(args.filter, repeat = args.repeat)
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(current, file, indent = 2, sort_keys = True)
+        if not args.baseline:
+            return 0
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print "%d regression(s) above %.0f%%" % (len(regressions), args.threshold * 100)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Training of a FeedForwardNetwork under a time and accuracy budget.
+
+BudgetedTrainer trains in rounds of a fixed number of samples, drawn from
+a seeded shuffle of the training set epoch after epoch, and evaluates the
+network on a held-out split after every round. It keeps a snapshot of the
+best weights and stops as soon as
+
+    - the validation accuracy reaches the target,
+    - it did not improve for patience rounds in a row,
+    - or the next round would not fit in the wall clock budget,
+
+then restores the best weights. Every round is recorded with its time,
+samples, throughput and accuracy:
+
+    trainer = BudgetedTrainer(network, seconds = 600, target = 0.95)
+    result = trainer.train(training_data)
+    report(result)
+"""
+
+import sys, time, random
+from itertools import imap
+
+from data_pipeline import permutation
+from feedforward_network import sample_wrapper
+
+class Subset(object):
+    """
+    A read-only sequence over the items of another one at the given
+    indices, every item being read from it only when indexed or iterated.
+    """
+
+    def __init__(self, items, indices):
+        self.items = items
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Subset(self.items, self.indices[key])
+        return self.items[self.indices[key]]
+
+    def __iter__(self):
+        return imap(self.items.__getitem__, self.indices)
+
+def holdout_split(data, fraction = 0.1, seed = 0):
+    """
+    Split a tuple of images and labels into a training and a held-out one,
+    the held-out one getting the given fraction of a seeded shuffle. The
+    images are not copied, both sides read them through a Subset.
+    """
+    images, labels = data
+    order = range(len(labels))
+    random.Random(seed).shuffle(order)
+    cut = len(order) - int(len(order) * fraction)
+    take = lambda indices: (Subset(images, indices), [labels[i] for i in indices])
+    return take(order[:cut]), take(order[cut:])
+
+class BudgetedTrainer(object):
+    """
+    Train a network until a budget is spent or training stops helping.
+
+    seconds: wall clock budget of the whole run, evaluations included,
+        None for no limit
+    target: validation accuracy to stop at, None to train on
+    patience: rounds without an improvement of more than min_delta before
+        giving up, None to never give up
+    every: samples trained between two evaluations
+    limit: most samples trained in all, None for no limit
+    """
+
+    def __init__(self, network, seconds = None, target = None, patience = 5,
+            every = 1000, batch_size = 1, min_delta = 0.0, limit = None, seed = 0):
+        self.network = network
+        self.seconds = seconds
+        self.target = target
+        self.patience = patience
+        self.every = every
+        self.batch_size = batch_size
+        self.min_delta = min_delta
+        self.limit = limit
+        self.seed = seed
+
+    def _samples(self, data):
+        """ the (x, y) samples of data in a new seeded order every epoch, endlessly """
+        images, labels = data
+        epoch = 0
+        while True:
+            order = permutation(len(labels), self.seed, epoch)
+            for sample in sample_wrapper((imap(images.__getitem__, order),
+                    imap(labels.__getitem__, order))):
+                yield sample
+            epoch += 1
+
+    def train(self, data, validation = None, holdout = 0.1, logger = None):
+        """
+        Train on data, a tuple of images and labels as returned by the MNIST
+        loader, evaluating on validation, or on a holdout fraction of data
+        kept out of training when not given. The network is left with the
+        best weights seen. Returns a dict with the best accuracy, why
+        training stopped and the history of the rounds, as (seconds,
+        samples, samples per second, accuracy) tuples.
+        """
+        if validation is None:
+            data, validation = holdout_split(data, holdout, self.seed)
+        if not len(data[1]) or not len(validation[1]):
+            raise ValueError('no sample to train or to validate on')
+
+        network = self.network
+        samples = self._samples(data)
+        started = time.time()
+        history = []
+        best, best_weights, stale = network.evaluate(*validation)[0], network.snapshot(), 0
+        trained, train_seconds, round_seconds = 0, 0.0, 0.0
+        reason = None
+        while reason is None:
+            if self.limit is not None and trained >= self.limit:
+                reason = 'limit'
+                break
+            if self.seconds is not None and time.time() - started + round_seconds > self.seconds:
+                reason = 'budget'
+                break
+
+            began = time.time()
+            count = self.every if self.limit is None else min(self.every, self.limit - trained)
+            network.train(samples, limit = count, batch_size = self.batch_size)
+            train_seconds += time.time() - began
+            trained += count
+
+            accuracy = network.evaluate(*validation)[0]
+            round_seconds = time.time() - began
+            elapsed = time.time() - started
+            history.append((elapsed, trained, trained / train_seconds, accuracy))
+            if logger != None:
+                logger("%d samples, %.1f samples/s, accuracy %.4f" % history[-1][1:])
+
+            if accuracy > best + self.min_delta:
+                best, best_weights, stale = accuracy, network.snapshot(), 0
+            else:
+                stale += 1
+            if self.target is not None and accuracy >= self.target:
+                reason = 'target'
+            elif self.patience is not None and stale >= self.patience:
+                reason = 'patience'
+
+        network.restore(best_weights)
+        return {
+                'accuracy': best,
+                'reason': reason,
+                'samples': trained,
+                'seconds': time.time() - started,
+                'history': history,
+                }
+
+def report(result, out = sys.stdout):
+    out.write("seconds  samples  samples/s  accuracy\n")
+    for (seconds, samples, rate, accuracy) in result['history']:
+        out.write("%7.1f  %7d  %9.1f  %8.4f\n" % (seconds, samples, rate, accuracy))
+    out.write("stopped on %s after %d samples in %.1fs, best accuracy %.4f\n" % (
+        result['reason'], result['samples'], result['seconds'], result['accuracy']))
+
+if __name__ == '__main__':
+    import mnist_adapter
+    from feedforward_network import FeedForwardNetwork
+
+    if len(sys.argv) not in (2, 3, 4):
+        print "Usage: %s mnist_path [seconds [target]]" % sys.argv[0]
+        sys.exit(1)
+
+    loader = mnist_adapter.MNIST(sys.argv[1], mapped = True, sparse = True)
+    data = loader.load_training()
+    network = FeedForwardNetwork([len(data[0][0]), 30, 10], eta = 0.01, activation = 'tanh',
+            normalize = False)
+    trainer = BudgetedTrainer(network, *[float(arg) for arg in sys.argv[2:]])
+    report(trainer.train(data))
+    print "test accuracy %.4f" % network.evaluate(
+            *mnist_adapter.MNIST(sys.argv[1], mapped = True).load_testing())[0]
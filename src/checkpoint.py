@@ -0,0 +1,254 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Binary checkpoints of a FeedForwardNetwork.
+
+A checkpoint is one file: a fixed header with the format version, the byte
+order and typecode of the numbers, the depth, whether the network
+normalizes and the learning rate, then the dimension of every layer and the
+activation of every layer but the input one, then the weight and the bias
+of every layer as raw contiguous blocks of numbers, aligned on 8 bytes, in
+the order of the parameter arena of the network. Version 1 files, without
+normalization flag nor activations, are still read.
+
+Blocks of doubles need no padding, then the blocks are the very bytes of the
+arena and are written and read back in one piece.
+
+Loading with mapped=True makes a copy-on-write memory map of the file the
+parameter arena of the network, nothing is read nor copied up front. The
+pages come from the page cache, shared by every process loading the same
+checkpoint, until a process writes into them, by training, and gets its
+own copy of the pages it changed. The file itself is never written, and
+save replaces a checkpoint by renaming, thus a mapped network can be saved
+over its own file. The map lives as long as the arena. Blocks of floats
+with padding between them can't be one arena, they are copied out of the
+map instead.
+"""
+
+import sys, os, struct, mmap
+from array import array
+
+from naive_algebra import view_type
+
+CHECKPOINT_MAGIC = 'FFNNCHECKP'
+CHECKPOINT_VERSION = 2
+# magic, version, byte order, typecode, depth, normalize and eta
+CHECKPOINT_HEADER = '<10sIccIBd'
+# the header of version 1, without normalize
+CHECKPOINT_HEADER_V1 = '<10sIccId'
+# activations are stored as their index in this list
+ACTIVATION_CODES = [None, 'sigmoid', 'sigmoid_lut', 'tanh', 'relu']
+ALIGNMENT = 8
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _blocks(dim_list, itemsize, offset):
+    """
+    The (offset, length) of the weight and bias blocks of every layer, the
+    blocks following each other without padding merged into one.
+    """
+    blocks = []
+    for (rows, cols) in zip(dim_list[1:], dim_list[:-1]):
+        for length in (rows * cols, rows):
+            if blocks and blocks[-1][0] + blocks[-1][1] * itemsize == offset:
+                blocks[-1] = (blocks[-1][0], blocks[-1][1] + length)
+            else:
+                blocks.append((offset, length))
+            offset = _aligned(offset + length * itemsize)
+    return blocks, offset
+
+def save(network, path):
+    """
+    Write the network into a checkpoint file. The file is written aside and
+    renamed, so that a reader never sees half a checkpoint.
+    """
+    parameters = network.parameters
+    typecode, itemsize = parameters.typecode, parameters.itemsize
+    dim_list = list(network.dim_list)
+    activations = [ACTIVATION_CODES.index(a) for a in network.activations()]
+    head = (struct.pack(CHECKPOINT_HEADER, CHECKPOINT_MAGIC, CHECKPOINT_VERSION,
+        sys.byteorder[0], typecode, len(dim_list), network.normalize, network.eta)
+        + struct.pack('<%dI' % len(dim_list), *dim_list)
+        + struct.pack('<%dB' % len(activations), *activations))
+    blocks, end = _blocks(dim_list, itemsize, _aligned(len(head)))
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(head)
+        start = 0
+        for (offset, length) in blocks:
+            file.write('\0' * (offset - file.tell()))
+            file.write(buffer(parameters, start * itemsize, length * itemsize))
+            start += length
+        file.write('\0' * (end - file.tell()))
+    os.rename(temp_path, path)
+
+def _header(read):
+    """ parse the header with read(offset, size), returns the settings and layout """
+    try:
+        magic, version = struct.unpack('<10sI', read(0, 14))
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError('not a checkpoint file')
+
+        if version == 1:
+            size = struct.calcsize(CHECKPOINT_HEADER_V1)
+            magic, version, byteorder, typecode, depth, eta = struct.unpack(
+                    CHECKPOINT_HEADER_V1, read(0, size))
+            normalize = True
+        elif version == CHECKPOINT_VERSION:
+            size = struct.calcsize(CHECKPOINT_HEADER)
+            magic, version, byteorder, typecode, depth, normalize, eta = struct.unpack(
+                    CHECKPOINT_HEADER, read(0, size))
+        else:
+            raise ValueError('unsupported checkpoint version %d' % version)
+
+        if byteorder != sys.byteorder[0]:
+            raise ValueError('checkpoint written with another byte order')
+        dim_list = list(struct.unpack('<%dI' % depth, read(size, depth * 4)))
+        size += depth * 4
+
+        if version == 1:
+            activations = ['sigmoid'] * (depth - 1)
+        else:
+            activations = [ACTIVATION_CODES[code] for code in
+                    struct.unpack('<%dB' % (depth - 1), read(size, depth - 1))]
+            size += depth - 1
+    except struct.error:
+        raise ValueError('truncated checkpoint file')
+    except IndexError:
+        raise ValueError('unknown activation in checkpoint file')
+
+    settings = {'eta': eta, 'typecode': typecode, 'activation': activations,
+            'normalize': bool(normalize)}
+    itemsize = array(typecode).itemsize
+    blocks, end = _blocks(dim_list, itemsize, _aligned(size))
+    return dim_list, settings, itemsize, blocks, end
+
+def load(path, mapped = False):
+    """
+    Build a FeedForwardNetwork from a checkpoint file, ValueError is raised
+    if the file is not a valid checkpoint. With mapped=True the parameters
+    are a memory map of the file, see above.
+    """
+    from feedforward_network import FeedForwardNetwork
+
+    with open(path, 'rb') as file:
+        if mapped:
+            dim_list, settings, parameters = _load_mapped(file)
+        else:
+            def read(offset, size):
+                file.seek(offset)
+                return file.read(size)
+
+            dim_list, settings, itemsize, blocks, end = _header(read)
+            if os.fstat(file.fileno()).st_size < end:
+                raise ValueError('truncated checkpoint file')
+
+            parameters = array(settings['typecode'])
+            for (offset, length) in blocks:
+                # straight into the arena, without an intermediate string
+                file.seek(offset)
+                parameters.fromfile(file, length)
+
+    return FeedForwardNetwork(dim_list, parameters = parameters, **settings)
+
+def _load_mapped(file):
+    """ the layout, settings and parameters of a checkpoint from a copy-on-write map """
+    source = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_COPY)
+    try:
+        dim_list, settings, itemsize, blocks, end = _header(
+                lambda offset, size: buffer(source, offset, size))
+        if len(source) < end:
+            raise ValueError('truncated checkpoint file')
+
+        if len(blocks) == 1:
+            # the view holds the map, which must stay open as long as it
+            # lives, and is unmapped with it
+            offset, length = blocks[0]
+            parameters = view_type(settings['typecode'], length).from_buffer(source, offset)
+        else:
+            parameters = array(settings['typecode'])
+            for (offset, length) in blocks:
+                parameters.fromstring(buffer(source, offset, length * itemsize))
+            source.close()
+    except:
+        source.close()
+        raise
+    return dim_list, settings, parameters
+
+def check_round_trip(path, dim_list = (20, 8, 3)):
+    """
+    Save a network, load it back both ways and compare every parameter
+    and the predictions, raise AssertionError on the first mismatch. The
+    float network with an odd layer has padded blocks, copied out of the
+    map. A mapped network is then trained, which must leave its file as
+    it is, and saved over it.
+    """
+    from naive_algebra import Matrix, Vector, ArenaView, _array
+    from feedforward_network import FeedForwardNetwork
+
+    odd_list = [dim | 1 for dim in dim_list]
+    for (typecode, dims, activation, normalize) in (('d', dim_list, 'sigmoid', True),
+            ('f', dim_list, 'relu', False), ('f', odd_list, 'tanh', False)):
+        network = FeedForwardNetwork(list(dims), eta = 0.3, typecode = typecode,
+                activation = ['tanh'] * (len(dims) - 2) + [activation],
+                normalize = normalize)
+        save(network, path)
+        samples = Matrix.fromRandom(5, dims[0], typecode)
+        for mapped in (False, True):
+            loaded = load(path, mapped)
+            if ((loaded.dim_list, loaded.eta, loaded.normalize, loaded.activations())
+                    != (network.dim_list, network.eta, network.normalize, network.activations())):
+                raise AssertionError('network settings differ after loading')
+            if _array(loaded.parameters) != network.parameters:
+                raise AssertionError('parameters differ after loading')
+            if loaded.predict_batch(samples) != network.predict_batch(samples):
+                raise AssertionError('predictions differ after loading')
+        print "%-10s ok" % ('round trip %s %s' % (typecode,
+            'mapped' if isinstance(loaded.parameters, ArenaView) else 'copied'))
+
+    save(FeedForwardNetwork(list(dim_list)), path)
+    with open(path, 'rb') as file:
+        content = file.read()
+    loaded = load(path, True)
+    if not isinstance(loaded.parameters, ArenaView):
+        raise AssertionError('the parameters of a mapped network are not the map')
+    loaded.train(iter([(Vector.fromRandom(dim_list[0]), Vector.fromZeros(dim_list[-1]))] * 3))
+    with open(path, 'rb') as file:
+        if file.read() != content:
+            raise AssertionError('training a mapped network wrote into its file')
+    trained = loaded.snapshot()
+    save(loaded, path)
+    if _array(load(path, True).parameters) != trained:
+        raise AssertionError('a mapped network was not saved over its own file')
+    print "%-10s ok" % 'mapped training'
+    os.remove(path)
+
+def benchmark(path, dim_list = (784, 300, 100, 10), repeat = 20):
+    """ time saving and loading a network of the given shape """
+    import time, random
+    from feedforward_network import FeedForwardNetwork
+
+    start = time.time()
+    network = FeedForwardNetwork(list(dim_list))
+    print "random init: %8.2fms" % ((time.time() - start) * 1000)
+
+    start = time.time()
+    save(network, path)
+    print "save:        %8.2fms, %d bytes" % ((time.time() - start) * 1000, os.path.getsize(path))
+
+    for mapped in (False, True):
+        start = time.time()
+        for i in xrange(repeat):
+            load(path, mapped)
+        print "load%s %8.2fms" % (' mapped:' if mapped else ':       ',
+                (time.time() - start) * 1000 / repeat)
+    os.remove(path)
+
+if __name__ == '__main__':
+    import tempfile
+    path = os.path.join(tempfile.gettempdir(), 'checkpoint-%d.bin' % os.getpid())
+    check_round_trip(path)
+    benchmark(path)
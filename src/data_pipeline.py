@@ -0,0 +1,210 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Streaming input pipeline for training.
+
+A producer, a background thread or process, walks the dataset in a seeded
+random order every epoch, decodes the samples and stacks them into ready
+input and one-hot target matrices. The batches wait in a bounded queue, so
+the next ones are built while the network trains on the current one.
+
+prefetch does the same for any iterator, on a thread: the network trains
+through it on the batches it stacks from a generator of samples.
+"""
+
+import sys, random, threading, Queue
+import multiprocessing
+from array import array
+
+from naive_algebra import Matrix
+
+def permutation(size, seed, epoch):
+    """ the seeded sample order of an epoch, the same for the same seed """
+    order = range(size)
+    random.Random(hash((seed, epoch))).shuffle(order)
+    return order
+
+def make_batch(images, labels, indices, class_num = 10, typecode = 'd'):
+    """
+    Stack the given samples into an inputs matrix and a one-hot targets
+    matrix, one sample per row.
+    """
+    data = array(typecode)
+    for i in indices:
+        image = images[i]
+        if not isinstance(image, array) or image.typecode != typecode:
+            image = array(typecode, image)
+        data.extend(image)
+
+    targets = Matrix(len(indices), class_num, typecode = typecode)
+    for (row_id, i) in enumerate(indices):
+        targets.data[row_id * class_num + labels[i]] = 1
+
+    return Matrix(len(indices), len(data) / len(indices), data), targets
+
+def _pack(batch):
+    """ matrices as raw bytes, much cheaper to send between processes """
+    return [(m.row_num, m.col_num, m.typecode, m.data.tostring()) for m in batch]
+
+def _unpack(packed):
+    batch = []
+    for (row_num, col_num, typecode, raw) in packed:
+        data = array(typecode)
+        data.fromstring(raw)
+        batch.append(Matrix(row_num, col_num, data))
+    return tuple(batch)
+
+def _put(queue, stop, item, packed):
+    """
+    Wait for room to put item, but give up once the consumer has stopped.
+    Returns whether it was put.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout = 0.1)
+            return True
+        except Queue.Full:
+            pass
+
+    if packed:
+        # don't wait for items nobody will read to be flushed
+        queue.cancel_join_thread()
+    return False
+
+def _produce(pipeline, epoch, queue, stop, packed):
+    try:
+        order = pipeline.order(epoch)
+        for start in xrange(0, len(order), pipeline.batch_size):
+            batch = make_batch(pipeline.images, pipeline.labels,
+                    order[start:start + pipeline.batch_size],
+                    pipeline.class_num, pipeline.typecode)
+            if not _put(queue, stop, ('batch', _pack(batch) if packed else batch), packed):
+                return
+        _put(queue, stop, ('end', None), packed)
+    except Exception as e:
+        _put(queue, stop, ('error', '%s: %s' % (e.__class__.__name__, e)), packed)
+
+def prefetch(iterable, buffer_size = 4):
+    """
+    Iterate iterable, while a background thread keeps up to buffer_size
+    items ready ahead of the consumer. Stopping early consumes at most
+    buffer_size + 1 items of iterable more than were yielded.
+    """
+    queue = Queue.Queue(buffer_size)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                # a blocking put, a timeout would poll with sleeps of up to
+                # 50ms, the consumer makes room when it stops early
+                queue.put(('item', item))
+                if stop.is_set():
+                    return
+            queue.put(('end', None))
+        except Exception as e:
+            queue.put(('error', '%s: %s' % (e.__class__.__name__, e)))
+
+    producer = threading.Thread(target = produce)
+    producer.daemon = True
+    producer.start()
+
+    try:
+        while True:
+            kind, item = queue.get()
+            if kind == 'end':
+                break
+            if kind == 'error':
+                raise RuntimeError('prefetch producer failed, ' + item)
+            yield item
+    finally:
+        stop.set()
+        while producer.is_alive():
+            try:
+                queue.get_nowait()
+            except Queue.Empty:
+                producer.join(0.01)
+
+class BatchPipeline(object):
+    """
+    Produce shuffled training batches ahead of the consumer.
+
+    data: a tuple of images and labels, as returned by the MNIST loader
+    batch_size: samples in a batch, the last batch of an epoch may be shorter
+    seed: seed of the per-epoch permutations, shuffle=False keeps file order
+    buffer_size: most batches waiting to be consumed
+    process: produce in a separate process instead of a thread, worth it
+        when decoding would compete with training for the interpreter
+    """
+
+    def __init__(self, data, batch_size = 100, seed = 0, shuffle = True,
+            buffer_size = 4, class_num = 10, typecode = 'd', process = False):
+        self.images, self.labels = data
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.class_num = class_num
+        self.typecode = typecode
+        self.process = process
+
+    def order(self, epoch):
+        if not self.shuffle:
+            return range(len(self.labels))
+        return permutation(len(self.labels), self.seed, epoch)
+
+    def epoch(self, epoch = 0):
+        """
+        Iterate the (inputs, targets) batches of one epoch, while the
+        producer keeps up to buffer_size batches ready.
+        """
+        if self.process:
+            queue = multiprocessing.Queue(self.buffer_size)
+            stop = multiprocessing.Event()
+            producer = multiprocessing.Process(target = _produce,
+                    args = (self, epoch, queue, stop, True))
+        else:
+            queue = Queue.Queue(self.buffer_size)
+            stop = threading.Event()
+            producer = threading.Thread(target = _produce,
+                    args = (self, epoch, queue, stop, False))
+        producer.daemon = True
+        producer.start()
+
+        try:
+            while True:
+                kind, item = queue.get()
+                if kind == 'end':
+                    break
+                if kind == 'error':
+                    raise RuntimeError('batch producer failed, ' + item)
+                yield _unpack(item) if self.process else item
+        finally:
+            # the producer notices within one put timeout, there is no need
+            # to drain the queue, which could hold half a message anyway
+            stop.set()
+            producer.join()
+
+    def epochs(self, count):
+        for epoch in xrange(count):
+            for batch in self.epoch(epoch):
+                yield batch
+
+if __name__ == '__main__':
+    import time
+    import mnist_adapter
+    from feedforward_network import FeedForwardNetwork
+
+    if len(sys.argv) != 2:
+        print "Usage: %s mnist_path" % sys.argv[0]
+        sys.exit(1)
+
+    data = mnist_adapter.MNIST(sys.argv[1], mapped = True).load_training()
+    for process in (False, True):
+        network = FeedForwardNetwork([len(data[0][0]), 30, 10])
+        pipeline = BatchPipeline(data, batch_size = 50, process = process)
+        start = time.time()
+        count = network.train_batches(pipeline.epoch(0), limit = 2000)
+        print "%s producer: %d samples in %.2fs" % (
+                'process' if process else 'thread', count, time.time() - start)
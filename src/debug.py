@@ -26,10 +26,10 @@ def main(mnist_path):
             eta = 0.5
             )
 
-    network.layers[0]['weight'] = Matrix(2, 2, [.15, .20, .25, .30])
-    network.layers[0]['bias'] = Vector.fromList([.35, .35])
-    network.layers[1]['weight'] = Matrix(2, 2, [.40, .45, .50, .55])
-    network.layers[1]['bias'] = Vector.fromList([.60, .60])
+    network.layers[0].weight = Matrix(2, 2, [.15, .20, .25, .30])
+    network.layers[0].bias = Vector.fromList([.35, .35])
+    network.layers[1].weight = Matrix(2, 2, [.40, .45, .50, .55])
+    network.layers[1].bias = Vector.fromList([.60, .60])
 
     x = Vector([.05, .10])
     y = Vector([.01, .99])
@@ -1,89 +1,297 @@
 #!/usr/bin/env python2
 # coding: utf-8
 
-import random, math
+import random, math, time
 from copy import copy
-from naive_algebra import Vector, Matrix, dot_prod, mmul, vmul
-from itertools import izip
+from array import array
+from naive_algebra import Vector, Matrix, dot_prod, mmul, mmul_tn, vmul, get_backend
+from naive_algebra import vaffine, maffine_nt, activate_grad, axpy, vmul_transposed, ger, outer
+from naive_algebra import SparseVector, ArenaView, arena_view, _array, _buffer, _zeros
+from naive_algebra import DEFAULT_TYPECODE
+from itertools import izip, islice
+from data_pipeline import prefetch
+
+class Layer(object):
+    """
+    A layer of the network: its output and the partial derivative of the
+    loss by it. But for the output layer, also the weight and bias leading
+    to the next layer, views into the parameter arena of the network, their
+    gradients, views into the gradient arena, and the delta buffer of the
+    single sample backward pass.
+
+    Activation and scale tell how the next layer is computed from this one:
+    activation((weight * output + bias) * scale).
+
+    The weight and bias are bound once to their views, then setting them
+    copies the values into the arena: rebinding them would detach the
+    layer from the parameters the network trains.
+    """
+    __slots__ = ('output', 'partial_output', '_weight', '_bias', 'weight_grad', 'bias_grad',
+            'delta', 'activation', 'scale')
+
+    def __init__(self, dim, typecode = None):
+        self.output = Vector.fromZeros(dim, typecode)
+        self.partial_output = Vector.fromZeros(dim, typecode)
+        self._weight = self._bias = self.weight_grad = self.bias_grad = None
+        self.delta = self.activation = self.scale = None
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @weight.setter
+    def weight(self, weight):
+        if self._weight is None:
+            self._weight = weight
+        else:
+            self._weight.assign(weight)
+
+    @property
+    def bias(self):
+        return self._bias
+
+    @bias.setter
+    def bias(self, bias):
+        if self._bias is None:
+            self._bias = bias
+        else:
+            self._bias.assign(bias)
 
 class FeedForwardNetwork:
     """
     The basic feedforward network with basic back-propagation algorithm.
     """
 
-    def __init__(self, dim_list, eta = 0.1):
+    def __init__(self, dim_list, eta = 0.1, typecode = None, parameters = None,
+            activation = 'sigmoid', normalize = True, optimizer = None):
         """
         Constructor for network.
         Params:
         dim_list: a list of the number of dimension for each layer.
         eta: learning rate for each gradient descent step
+        typecode: storage type of the parameters, 'd' (default) or 'f'
+        parameters: optional parameters instead of random ones, either the
+            (weight, bias) buffers of every layer or a flat typed array laid
+            out as the parameter arena, taken over as it is, as done by load.
+            It may be an arena view over a memory map, as load(mapped=True)
+            gives
+        activation: the activation of every layer but the input one, by
+            name: 'sigmoid', 'sigmoid_lut', 'tanh' or 'relu', or a list of
+            them, one per layer
+        normalize: divide the input of every activation by the size of the
+            previous layer plus one, with weights and biases drawn from
+            [0, 1). Otherwise the weights are drawn from the Glorot uniform
+            range and the biases start at zero, which suits deep stacks and
+            the tanh and relu activations much better.
+        optimizer: how the gradients update the parameters, one of the
+            optimizers module. By default plain gradient descent with eta,
+            fused into back-propagation: the single sample path then applies
+            every partial weight as a rank-1 update, never building it.
         """
         depth = len(dim_list)
         self.depth = depth
         self.dim_list = dim_list
         self.eta = eta
+        self.normalize = normalize
+        self.optimizer = optimizer
 
-        # 1. Initiate each layer: output, partial_output and weight,
-        #    although partial_output is useless for the input layer, similarly
-        #    weight and bias are useless for the output layer.
-        #
-        # 2. Partial_weight is an internal variable and will not be stored in
-        #    a layer.
-        #
-        self.layers = [ {'output':Vector.fromIterable(0 for i in xrange(dim_list[l])),
-            'partial_output':Vector.fromIterable(0 for i in xrange(dim_list[l])),
-            'weight':Matrix.fromRandom(dim_list[l + 1], dim_list[l]),
-            'bias':Vector.fromRandom(dim_list[l + 1])}
-            for l in xrange(depth - 1) ]
-        
-        # output layer
-        self.layers.append({'output':Vector.fromList([0] * dim_list[depth - 1]),
-            'partial_output':Vector.fromList([0] * dim_list[depth - 1]),
-            'weight': None, 'bias': None})
+        if activation is None or isinstance(activation, basestring):
+            activation = [activation] * (depth - 1)
+        if len(activation) != depth - 1:
+            raise ValueError('one activation is needed for every layer but the input one')
+        for name in activation:
+            if name not in ACTIVATIONS:
+                raise ValueError('Unknown activation %r' % name)
+
+        # The parameters live in one contiguous arena, the weight then the
+        # bias of every layer, and the gradients of the batch path in an
+        # arena of the same layout, see _gradient_arena. Whole-model
+        # operations, the gradient step, snapshots, checkpoints and the sync
+        # of parallel training, run as one pass over a single buffer. The
+        # arenas must never be resized nor rebound, the layers hold views
+        # into them.
+        shapes = zip(dim_list[1:], dim_list[:-1])
+        if parameters is None:
+            parameters = array(typecode or DEFAULT_TYPECODE)
+            for (row_num, col_num) in shapes:
+                parameters.extend(_initial_weight(row_num, col_num, typecode, normalize).data)
+                parameters.extend(Vector.fromRandom(row_num, typecode).data if normalize
+                        else _zeros(row_num, typecode))
+        elif isinstance(parameters, (array, ArenaView)):
+            parameters = _buffer(parameters, typecode)
+        else:
+            parameters = _buffer([x for pair in parameters for buf in pair for x in buf],
+                    typecode or getattr(parameters[0][0], 'typecode', None))
+        if len(parameters) != sum(r * c + r for (r, c) in shapes):
+            raise ValueError('the parameters do not fit the dimensions of the network')
+        self.parameters = parameters
+        self.gradients = None
+
+        typecode = parameters.typecode
+        self.layers = [Layer(dim, typecode) for dim in dim_list]
+        offset = 0
+        for (layer, (row_num, col_num), name) in zip(self.layers, shapes, activation):
+            size = row_num * col_num
+            layer.weight = Matrix(row_num, col_num, arena_view(parameters, offset, size))
+            layer.bias = Vector(arena_view(parameters, offset + size, row_num))
+            offset += size + row_num
+
+            # the delta of the single sample backward pass, overwritten by
+            # every step, the partial weight is never built but applied as
+            # a rank-1 update
+            layer.delta = Vector.fromZeros(row_num, typecode)
+            layer.activation = name
+            layer.scale = 1.0 / (col_num + 1.0) if normalize else 1.0
+
+        # buffers of the batch path, by batch size, see _batch_buffers
+        self._buffers = {}
+
+        # an instrumentation.Metrics collecting the timings, None if disabled
+        self.metrics = None
+
+        # the input of the last single sample forward pass, the output of
+        # the input layer or a sparse vector
+        self._input = self.layers[0].output
+
+    def activations(self):
+        """ the activation of every layer but the input one """
+        return [layer.activation for layer in self.layers[:-1]]
+
+    def _gradient_arena(self):
+        """
+        The gradient arena, allocated with the gradient views of the layers
+        on first use, since inference never needs it.
+        """
+        if self.gradients is None:
+            self.gradients = _zeros(len(self.parameters), self.parameters.typecode)
+            offset = 0
+            for layer in self.layers[:-1]:
+                row_num, col_num = layer.weight.row_num, layer.weight.col_num
+                size = row_num * col_num
+                layer.weight_grad = Matrix(row_num, col_num,
+                        arena_view(self.gradients, offset, size))
+                layer.bias_grad = Vector(arena_view(self.gradients, offset + size, row_num))
+                offset += size + row_num
+        return self.gradients
+
+    def snapshot(self):
+        """ a copy of all the parameters, to be given back to restore """
+        if isinstance(self.parameters, array):
+            return self.parameters[:]
+        return _array(self.parameters)
+
+    def restore(self, snapshot):
+        """ overwrite all the parameters with a snapshot, in place """
+        if len(snapshot) != len(self.parameters) or snapshot.typecode != self.parameters.typecode:
+            raise ValueError('the snapshot does not fit the network')
+        # the same length, thus copied in place without any resize
+        if isinstance(self.parameters, array):
+            self.parameters[:] = snapshot
+        else:
+            self.parameters.assign(snapshot)
+
+    def save(self, path):
+        """ write the network into a binary checkpoint file """
+        # imported on demand, checkpoint builds networks itself
+        import checkpoint
+        checkpoint.save(self, path)
+
+    @classmethod
+    def load(cls, path, mapped = False):
+        """
+        Read a network back from a checkpoint file, its parameters living in
+        a memory map of the file if mapped is True, see checkpoint.
+        """
+        import checkpoint
+        return checkpoint.load(path, mapped)
+
+    def quantize(self, precision = 'int8'):
+        """ an inference only model of the network in reduced precision, see quantization """
+        import quantization
+        return quantization.quantize(self, precision)
 
     def inference(self, vector):
         self._forward(vector)
-        output = self.layers[self.depth - 1]['output']
-        maxpos, maxval = 0, 0
-        for i in xrange(len(output)):
-            if maxval < output[i]:
-                maxpos, maxval = i, output[i]
-        rtn = Vector.fromList([0] * len(output))
-        rtn[maxpos] = 1
+        output = self.layers[self.depth - 1].output
+        rtn = Vector.fromZeros(len(output))
+        rtn[argmax(output)] = 1
         return rtn
 
+    def predict_batch(self, samples):
+        """
+        Predict the classes of a block of samples, given as a matrix with
+        one sample per row or as a sequence of vectors. Returns the argmax
+        position of the output for every sample.
+        """
+        if not isinstance(samples, Matrix):
+            samples = Matrix.fromRows(samples, self.parameters.typecode)
+
+        output = self._forward_batch(samples)[-1]
+        return [argmax(output.row_view(row_id)) for row_id in xrange(output.row_num)]
+
+    def evaluate(self, images, labels, batch_size = 100):
+        """
+        Evaluate the network on a whole labelled set, batch by batch.
+        Returns the accuracy and the confusion matrix as a list of lists,
+        confusion[label][prediction] counting the samples.
+        """
+        class_num = self.dim_list[-1]
+        confusion = [[0] * class_num for i in xrange(class_num)]
+        correct, total = 0, 0
+        for batch in batches(izip(images, labels), batch_size):
+            predictions = self.predict_batch([img for (img, label) in batch])
+            for ((img, label), pred) in izip(batch, predictions):
+                confusion[label][pred] += 1
+                correct += (1 if label == pred else 0)
+            total += len(batch)
+
+        return (correct * 1.0 / total if total else 0.0), confusion
+
     def _forward(self, x):
-        # input layer
-        self.layers[0]['output'].assign(x)
+        # input layer, a sparse input is kept as it is, so that the first
+        # layer only reads and updates the weights of its non-zero items
+        if isinstance(x, SparseVector):
+            self._input = x
+        else:
+            self.layers[0].output.assign(x)
+            self._input = self.layers[0].output
 
-        # hidden layers and output layer
+        # hidden layers and output layer, computed in place into the output
+        # buffer of every layer
+        metrics = self.metrics
         for layer_id in xrange(1, self.depth):
-            weight = self.layers[layer_id - 1]['weight']
-            indata = self.layers[layer_id - 1]['output']
-            bias = self.layers[layer_id - 1]['bias']
-            output = (vmul(weight, indata) + bias)
-            # normalize with the amount of neurons in last layer
-            output = vsigmoid(output / (self.dim_list[layer_id - 1] + 1.0))
-            self.layers[layer_id]['output'] = output
+            if metrics is not None:
+                began = time.time()
+            layer = self.layers[layer_id - 1]
+            vaffine(layer.weight, layer.output if layer_id > 1 else self._input,
+                    layer.bias, layer.scale, layer.activation, self.layers[layer_id].output)
+            if metrics is not None:
+                metrics.forward(layer_id - 1, time.time() - began)
 
     def _backward(self, x, y):
         # output layer
         layer_id = self.depth - 1
-        output = self.layers[layer_id]['output']
-        self.layers[layer_id]['partial_output'].assign(Vector.fromIterable(
-            output[i] - y[i] for i in xrange(self.dim_list[layer_id])
-            ))
-
-        loss = sum((output[i] - y[i]) ** 2 for i in xrange(self.dim_list[layer_id]))
+        backend = get_backend()
+        optimizer = self.optimizer
+        if optimizer is not None:
+            self._gradient_arena()
+        partial = self.layers[layer_id].partial_output
+        backend.sub(self.layers[layer_id].output.data, y._items(), partial.data)
+        loss = backend.dot(partial.data, partial.data)
 
         # hidden layer and input layer
+        metrics = self.metrics
         for layer_id in xrange(self.depth - 2, -1, -1):
-            weight = self.layers[layer_id]['weight']
-            bias = self.layers[layer_id]['bias']
-            partial_output = self.layers[layer_id]['partial_output']
-            output = self.layers[layer_id]['output']
-            last_output = self.layers[layer_id + 1]['output']
-            last_partial = self.layers[layer_id + 1]['partial_output']
+            if metrics is not None:
+                began = time.time()
+            layer = self.layers[layer_id]
+            weight = layer.weight
+            last_layer = self.layers[layer_id + 1]
+
+            # the error signal of every neuron in the next layer, shared by
+            # all the partial derivatives below
+            delta = activate_grad(layer.activation, last_layer.partial_output,
+                    last_layer.output, layer.scale, layer.delta)
 
             """
             Partial output for every layer except the output one is:
@@ -91,33 +299,27 @@ class FeedForwardNetwork:
                 \sum_i (\frac {\partial E} {\partial O_i^{ (l+1) }}
                     * O_i^{ (l+1) } * (1 - O_i^{ (l+1) }) * w_{ik}^{ (l) } )
             
-            But the partial output of the first layer is unnecessary,
-            thus we don't compute it.
+            That's the transposed weight times delta. But the partial output
+            of the first layer is unnecessary, thus we don't compute it.
             """
             if layer_id > 0:
-                self.layers[layer_id]['partial_output'].assign(Vector.fromIterable(
-                    sum(last_partial[i] * last_output[i] * (1 - last_output[i])
-                        * weight.item(i, k)
-                        for i in xrange(self.dim_list[layer_id + 1]))
-                    / (self.dim_list[layer_id] + 1.0)
-                    for k in xrange(self.dim_list[layer_id] )))
+                vmul_transposed(weight, delta, layer.partial_output)
 
             """
             Partial weight for every layer except the output one:
             \frac {\partial E} {\partial w_{ji}^{(l)}} = 
                 \frac {\partial E} {\partial O_j^{(l + 1)}}
                     * O_j^{(l + 1)} * (1 - O_j^{(l+1)}) * O_i^{(l)}
-            """
-            partial_weight = Matrix.fromIterable(weight.row_num, weight.col_num, (
-                    last_partial[row_id] 
-                    * last_output[row_id] * (1 - last_output[row_id])
-                    * output[col_id]
-                    / (self.dim_list[layer_id] + 1.0)
-                    for row_id in xrange(self.dim_list[layer_id + 1])
-                    for col_id in xrange(self.dim_list[layer_id])
-                    ))
 
-            self.layers[layer_id]['weight'] -= self.eta * partial_weight
+            That's the outer product of delta and the layer output, applied
+            in place as a rank-1 update, or kept in the gradient arena for
+            the optimizer.
+            """
+            layer_input = layer.output if layer_id > 0 else self._input
+            if optimizer is None:
+                ger(-self.eta, delta, layer_input, weight)
+            else:
+                outer(delta, layer_input, layer.weight_grad)
 
             """
             Partial bias is almost exact as the partial weight,
@@ -126,40 +328,283 @@ class FeedForwardNetwork:
                 \frac {\partial E}{\partial O_j^{(l + 1)}}
                     O_j^{(l + 1)} (1 - O_j^{(l+1)}) * 1
             """
-            partial_bias = Vector.fromIterable(
-                    last_partial[row_id]
-                    * last_output[row_id] * (1 - last_output[row_id]) * 1
-                    / (self.dim_list[layer_id] + 1.0)
-                    for row_id in xrange(self.dim_list[layer_id + 1])
-                    )
-            self.layers[layer_id]['bias'] -= self.eta * partial_bias
+            if optimizer is None:
+                axpy(-self.eta, delta, layer.bias)
+            else:
+                layer.bias_grad.assign(delta)
+
+            if metrics is not None:
+                metrics.backward(layer_id, time.time() - began)
 
+        if optimizer is not None:
+            self._apply_gradients(1.0)
         return loss
 
-    def train(self, generator, logger = None, limit = 100):
+    def _batch_buffers(self, row_num):
+        """
+        The matrices reused by every training batch of row_num samples:
+        outputs, partials and deltas by layer. They are allocated on first
+        use.
+        """
+        buffers = self._buffers.get(row_num)
+        if buffers is None:
+            typecode = self.parameters.typecode
+            dims = self.dim_list
+            buffers = self._buffers[row_num] = {
+                    'outputs': [None] + [Matrix(row_num, dims[l], typecode = typecode)
+                        for l in xrange(1, self.depth)],
+                    'partials': [None] + [Matrix(row_num, dims[l], typecode = typecode)
+                        for l in xrange(1, self.depth)],
+                    'deltas': [Matrix(row_num, dims[l + 1], typecode = typecode)
+                        for l in xrange(self.depth - 1)],
+                    }
+        return buffers
+
+    def _forward_batch(self, inputs, buffers = None):
+        """
+        Forward a batch of samples stacked row by row in the inputs matrix,
+        one fused matrix product, bias and activation per layer. The outputs
+        of every layer are returned as matrices, one row per sample, written
+        into the given buffers or newly allocated. The layer buffers used by
+        the single sample path are left untouched.
+        """
+        outputs = [inputs]
+        metrics = self.metrics
+        for layer_id in xrange(1, self.depth):
+            if metrics is not None:
+                began = time.time()
+            layer = self.layers[layer_id - 1]
+            outputs.append(maffine_nt(outputs[-1], layer.weight, layer.bias,
+                layer.scale, layer.activation,
+                buffers['outputs'][layer_id] if buffers else None))
+            if metrics is not None:
+                metrics.forward(layer_id - 1, time.time() - began)
+
+        return outputs
+
+    def _backward_batch(self, outputs, targets):
+        """
+        Back-propagate a batch, the gradients of every sample are summed up
+        and applied once as their average. Returns the average loss.
+        """
+        batch = targets.row_num
+        loss = self._batch_gradients(outputs, targets, self._batch_buffers(batch))[0]
+        self._apply_gradients(1.0 / batch)
+        return loss / batch
+
+    def _batch_gradients(self, outputs, targets, buffers = None):
+        """
+        Compute the partial weight and partial bias of every layer, summed
+        over the batch, into the gradient arena, without touching the
+        parameters. The intermediate results are written into the given
+        buffers, as made by _batch_buffers, or newly allocated.
+        Returns the summed loss and a list of (partial_weight, partial_bias),
+        the views of the gradient arena.
+        """
+        backend = get_backend()
+        rows = targets.row_num
+        typecode = self.parameters.typecode
+        if buffers is None:
+            buffers = {'partials': [None] * self.depth, 'deltas': [None] * (self.depth - 1)}
+
+        partial = buffers['partials'][-1]
+        if partial is None:
+            partial = Matrix(rows, targets.col_num, typecode = typecode)
+        backend.sub(outputs[-1].data, targets.data, partial.data)
+        loss = backend.dot(partial.data, partial.data)
+        self._gradient_arena()
+        gradients = [(layer.weight_grad, layer.bias_grad) for layer in self.layers[:-1]]
+
+        metrics = self.metrics
+        for layer_id in xrange(self.depth - 2, -1, -1):
+            if metrics is not None:
+                began = time.time()
+            layer = self.layers[layer_id]
+            weight = layer.weight
+
+            # the error signal of every neuron in the next layer, per sample
+            delta = activate_grad(layer.activation, partial, outputs[layer_id + 1],
+                    layer.scale, buffers['deltas'][layer_id])
+
+            # partial output of the layer for every sample
+            if layer_id > 0:
+                partial = mmul(delta, weight, buffers['partials'][layer_id])
+
+            # partial weight and bias summed over the batch
+            partial_weight, partial_bias = gradients[layer_id]
+            mmul_tn(delta, outputs[layer_id], partial_weight)
+            backend.col_sums(delta.data, rows, delta.col_num, partial_bias.data)
+
+            if metrics is not None:
+                metrics.backward(layer_id, time.time() - began)
+
+        return loss, gradients
+
+    def _apply_gradients(self, scale):
+        """
+        Update the parameters in place with the gradient arena times scale,
+        by the optimizer or by a gradient descent step of eta, in a single
+        pass over the parameter arena.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            began = time.time()
+        if self.optimizer is None:
+            get_backend().axpy(-self.eta * scale, self.gradients, self.parameters)
+        else:
+            self.optimizer.step(self.parameters, self.gradients, scale)
+        if metrics is not None:
+            metrics.update(time.time() - began)
+
+    def train(self, generator, logger = None, limit = 100, batch_size = 1):
+        """
+        Train the network with at most limit samples from the generator,
+        drawn ahead of training on a data_pipeline.prefetch thread, never
+        more than limit. With batch_size larger than 1 the samples are
+        stacked into matrices on that thread too, and the weights are
+        updated once per batch. Returns the number of samples used.
+        """
+        if batch_size > 1:
+            return self._train_batches(generator, logger, limit, batch_size)
+
         counter = 0
-        for (x, y) in generator:
+        for (x, y) in prefetch(islice(generator, limit)):
             self._forward(x)
             loss = self._backward(x, y)
+            if self.metrics is not None:
+                self.metrics.step(1, loss)
 
             if logger != None and counter % 10 == 0:
                 logger(str(counter) + "," + str(loss))
 
             counter += 1
-            if counter >= limit: break
+
+        return counter
+
+    def _train_batches(self, generator, logger, limit, batch_size):
+        typecode = self.parameters.typecode
+        return self.train_batches(prefetch((Matrix.fromRows([x for (x, y) in batch], typecode),
+            Matrix.fromRows([y for (x, y) in batch], typecode))
+            for batch in batches(generator, batch_size, limit)), logger)
+
+    def train_batches(self, batches, logger = None, limit = None):
+        """
+        Train on ready-made batches, pairs of inputs and targets matrices
+        with one sample per row, as produced by data_pipeline.BatchPipeline.
+        The weights are updated once per batch, and training stops after the
+        batch reaching limit samples. Returns the number of samples used.
+        """
+        counter = 0
+        for (inputs, targets) in batches:
+            outputs = self._forward_batch(inputs, self._batch_buffers(inputs.row_num))
+            loss = self._backward_batch(outputs, targets)
+            if self.metrics is not None:
+                self.metrics.step(inputs.row_num, loss)
+
+            if logger != None:
+                logger(str(counter) + "," + str(loss))
+
+            counter += inputs.row_num
+            if limit is not None and counter >= limit: break
+
+        return counter
+
+# the activations a layer can use, see naive_algebra.PYTHON_ACTIVATIONS
+ACTIVATIONS = ('sigmoid', 'sigmoid_lut', 'tanh', 'relu', None)
+
+def _initial_weight(row_num, col_num, typecode, normalize):
+    if normalize:
+        return Matrix.fromRandom(row_num, col_num, typecode)
+
+    bound = math.sqrt(6.0 / (row_num + col_num))
+    return Matrix.fromIterable(row_num, col_num, (random.uniform(-bound, bound)
+        for i in xrange(row_num * col_num)), typecode = typecode)
 
 def sigmoid(z):
+    if z < 0:
+        # the stable form, exp(-z) would overflow for large negative z
+        e = math.exp(z)
+        return e / (1 + e)
     return 1.0 / (1 + math.exp(-z))
 
 def vsigmoid(v):
-    return Vector.fromIterable(sigmoid(v[i]) for i in xrange(len(v)))
+    return Vector(get_backend().sigmoid(v._items()))
+
+def precision_recall(confusion):
+    """
+    Per-class precision and recall from a confusion matrix given as
+    confusion[label][prediction], 0 for a class never predicted or seen.
+    """
+    class_num = len(confusion)
+    predicted = [sum(confusion[i][j] for i in xrange(class_num)) for j in xrange(class_num)]
+    actual = [sum(row) for row in confusion]
+    precision = [confusion[j][j] * 1.0 / predicted[j] if predicted[j] else 0.0
+            for j in xrange(class_num)]
+    recall = [confusion[i][i] * 1.0 / actual[i] if actual[i] else 0.0
+            for i in xrange(class_num)]
+    return precision, recall
+
+def argmax(v):
+    """ position of the first largest item """
+    return max(xrange(len(v)), key = v.__getitem__)
+
+def batches(generator, batch_size, limit = None):
+    """
+    Group the samples from a generator into lists of batch_size samples,
+    the last one may be shorter. At most limit samples are consumed.
+    """
+    batch, counter = [], 0
+    for sample in generator:
+        batch.append(sample)
+        counter += 1
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+        if limit is not None and counter >= limit:
+            break
+
+    if batch:
+        yield batch
+
+def one_hot(labels, class_num = 10, typecode = None):
+    """ stack the one-hot vectors of a sequence of labels into a matrix """
+    targets = Matrix(len(labels), class_num, typecode = typecode)
+    for (row_id, label) in enumerate(labels):
+        targets.data[row_id * class_num + label] = 1
+    return targets
 
 def sample_wrapper(data):
     for (img, label) in izip(data[0], data[1]):
-        x = Vector(img)
-        y = Vector.fromIterable(1 if pos == label else 0 for pos in xrange(10))
+        x = img if isinstance(img, SparseVector) else Vector(img)
+        y = Vector.fromZeros(10)
+        y[label] = 1
         yield (x, y)
 
+def check_layers(typecode = 'd'):
+    """
+    Setting the weight and bias of a layer must write into the parameter
+    arena and keep the layer on it, so that training moves what the layer
+    computes with. Raise AssertionError on the first mismatch.
+    """
+    network = FeedForwardNetwork([2, 2, 2], eta = 0.5, typecode = typecode)
+    layer = network.layers[1]
+    weight, bias = layer.weight, layer.bias
+    layer.weight = Matrix(2, 2, [.40, .45, .50, .55])
+    layer.bias = Vector.fromList([.60, .60])
+    if layer.weight is not weight or layer.bias is not bias:
+        raise AssertionError('setting the weight or bias rebound the layer')
+    if network.parameters[6:] != array(typecode, [.40, .45, .50, .55, .60, .60]):
+        raise AssertionError('the weight or bias did not reach the parameter arena')
+
+    before = Matrix(2, 2, array(typecode, layer.weight.data))
+    network.train(iter([(Vector([.05, .10]), Vector([.01, .99]))]), limit = 1)
+    if layer.weight.equalTo(before):
+        raise AssertionError('training did not move the weight of the layer')
+    if network.parameters[6:10] != array(typecode, layer.weight.data):
+        raise AssertionError('the layer left the parameter arena')
+    print "%-10s ok" % ('layers ' + typecode)
+
 if __name__ == "__main__":
     print sigmoid(1)
-    pass
+    check_layers('d')
+    check_layers('f')
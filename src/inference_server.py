@@ -0,0 +1,324 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Local inference server with micro-batching.
+
+Clients connect over a Unix socket or localhost TCP and send pixel vectors,
+one request at a time per connection: a little-endian uint32 count followed
+by that many float32 pixels. The answer is the predicted class as an int32,
+-1 for a malformed request. A count other than the input size of the
+network gets -1 before its pixels are read, and the connection is closed.
+
+Every connection is served by its own thread, which hands the request to a
+single batching thread and waits. The batching thread takes the first
+waiting request, then keeps collecting for at most max_wait seconds or
+until max_batch_size requests, and runs them as one forward pass with
+predict_batch, which leaves the network state untouched. Only that thread
+ever touches the network.
+"""
+
+import sys, os, time, socket, struct, threading, Queue, SocketServer
+from array import array
+from collections import deque
+
+from naive_algebra import Matrix
+
+REQUEST_HEADER = '<I'
+RESPONSE = '<i'
+
+def percentile(values, p):
+    """ the p-th percentile of values, by the nearest rank """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+class _Request(object):
+    __slots__ = ('pixels', 'arrived', 'done', 'result')
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.arrived = time.time()
+        self.done = threading.Event()
+        self.result = -1
+
+class MicroBatcher(object):
+    """
+    Group concurrent predictions into batched forward passes.
+
+    max_batch_size: most requests in one forward pass
+    max_wait: seconds the first request of a batch waits for others
+    history: number of latest requests kept for the latency statistics
+    """
+
+    def __init__(self, network, max_batch_size = 32, max_wait = 0.002, history = 100000):
+        self.network = network
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.typecode = network.parameters.typecode
+        self._queue = Queue.Queue()
+        self._latencies = deque(maxlen = history)
+        self._batches = 0
+        self._requests = 0
+        self._started = None
+        self._thread = None
+
+    def start(self):
+        self._started = time.time()
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def predict(self, pixels):
+        """
+        The predicted class of one sample, blocks until its batch has run.
+        Safe to call from any number of threads.
+        """
+        request = _Request(pixels)
+        self._queue.put(request)
+        request.done.wait()
+        return request.result
+
+    def _run(self):
+        running = True
+        while running:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout = timeout)
+                except Queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                batch.append(request)
+
+            self._serve(batch)
+
+    def _serve(self, batch):
+        dim = self.network.dim_list[0]
+        valid = [r for r in batch if len(r.pixels) == dim]
+        if valid:
+            data = array(self.typecode)
+            for request in valid:
+                data.extend(request.pixels if request.pixels.typecode == self.typecode
+                        else array(self.typecode, request.pixels))
+            try:
+                predictions = self.network.predict_batch(Matrix(len(valid), dim, data))
+            except Exception:
+                predictions = [-1] * len(valid)
+            for (request, prediction) in zip(valid, predictions):
+                request.result = prediction
+
+        now = time.time()
+        for request in batch:
+            self._latencies.append(now - request.arrived)
+            request.done.set()
+        self._batches += 1
+        self._requests += len(batch)
+
+    def stats(self):
+        """
+        Requests and batches served, the mean batch size, the p50 and p99
+        server side latency in seconds and the throughput since start.
+        """
+        latencies = list(self._latencies)
+        elapsed = time.time() - self._started if self._started else 0.0
+        return {
+                'requests': self._requests,
+                'batches': self._batches,
+                'mean_batch': self._requests * 1.0 / self._batches if self._batches else 0.0,
+                'p50': percentile(latencies, 50),
+                'p99': percentile(latencies, 99),
+                'throughput': self._requests / elapsed if elapsed else 0.0,
+                }
+
+def _recv(sock, size):
+    """ exactly size bytes from sock, or None once the peer has closed """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+class _Handler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            header = _recv(self.request, struct.calcsize(REQUEST_HEADER))
+            if header is None:
+                break
+            count, = struct.unpack(REQUEST_HEADER, header)
+            if count != self.server.batcher.network.dim_list[0]:
+                # don't trust the size to read or allocate, give up on the client
+                self.request.sendall(struct.pack(RESPONSE, -1))
+                break
+            payload = _recv(self.request, count * 4)
+            if payload is None:
+                break
+            pixels = array('f')
+            pixels.fromstring(payload)
+            if sys.byteorder != 'little':
+                pixels.byteswap()
+            self.request.sendall(struct.pack(RESPONSE, self.server.batcher.predict(pixels)))
+
+class _TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(network, address, max_batch_size = 32, max_wait = 0.002):
+    """
+    Create a server for the network, listening on a Unix socket if address
+    is a path, or on TCP if it's a (host, port) tuple. The batching thread
+    is started, call serve_forever() to accept connections, then shutdown()
+    and server.batcher.stop().
+    """
+    if isinstance(address, basestring):
+        if os.path.exists(address):
+            os.remove(address)
+        server = _UnixServer(address, _Handler)
+    else:
+        server = _TCPServer(address, _Handler)
+    server.batcher = MicroBatcher(network, max_batch_size, max_wait)
+    server.batcher.start()
+    return server
+
+class Client(object):
+    """ a connection to the inference server """
+
+    def __init__(self, address):
+        family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def predict(self, pixels):
+        pixels = array('f', pixels)
+        if sys.byteorder != 'little':
+            pixels.byteswap()
+        self.sock.sendall(struct.pack(REQUEST_HEADER, len(pixels)) + pixels.tostring())
+        answer = _recv(self.sock, struct.calcsize(RESPONSE))
+        if answer is None:
+            raise IOError('connection closed by the server')
+        return struct.unpack(RESPONSE, answer)[0]
+
+    def close(self):
+        self.sock.close()
+
+def load_test(address, images, requests = 2000, concurrency = 16):
+    """
+    Send requests predictions from concurrency connections at once, each
+    one sending the next request as soon as it has its answer. Returns the
+    client side p50 and p99 latency in seconds, and the throughput.
+    """
+    latencies = []
+    samples = [array('f', images[i % len(images)]) for i in xrange(min(requests, len(images)))]
+    counter = iter(xrange(requests))
+    lock = threading.Lock()
+
+    def run():
+        client = Client(address)
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    break
+                start = time.time()
+                client.predict(samples[i % len(samples)])
+                latencies.append(time.time() - start)
+        finally:
+            client.close()
+
+    began = time.time()
+    threads = [threading.Thread(target = run) for i in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - began
+
+    return {'requests': len(latencies), 'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99), 'throughput': len(latencies) / wall}
+
+def _serve_process(network, address, max_batch_size, max_wait, ready, stop, results):
+    server = make_server(network, address, max_batch_size, max_wait)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    ready.set()
+    stop.wait()
+    server.shutdown()
+    server.batcher.stop()
+    server.server_close()
+    results.put(server.batcher.stats())
+
+def benchmark(network, images, requests = 2000, concurrency = 16):
+    """
+    Serve on a Unix socket from a child process, so that the clients don't
+    compete with it for the interpreter, and report several settings.
+    """
+    import tempfile, multiprocessing
+    address = os.path.join(tempfile.gettempdir(), 'inference-%d.sock' % os.getpid())
+    print "batch  wait(ms)  client p50(ms)  p99(ms)  req/s  mean batch"
+    for (max_batch_size, max_wait) in [(1, 0.0), (8, 0.001), (32, 0.002), (64, 0.005)]:
+        ready, stop = multiprocessing.Event(), multiprocessing.Event()
+        results = multiprocessing.Queue()
+        server = multiprocessing.Process(target = _serve_process, args = (network,
+            address, max_batch_size, max_wait, ready, stop, results))
+        server.start()
+        ready.wait()
+        try:
+            result = load_test(address, images, requests, concurrency)
+        finally:
+            stop.set()
+            stats = results.get()
+            server.join()
+        print "%5d  %8.1f  %14.2f  %7.2f  %5.0f  %10.1f" % (max_batch_size, max_wait * 1000,
+                result['p50'] * 1000, result['p99'] * 1000, result['throughput'],
+                stats['mean_batch'])
+    os.remove(address)
+
+if __name__ == '__main__':
+    from feedforward_network import FeedForwardNetwork
+
+    if len(sys.argv) == 4 and sys.argv[1] == 'bench':
+        import mnist_adapter
+        network = FeedForwardNetwork.load(sys.argv[2], mapped = True)
+        images = mnist_adapter.MNIST(sys.argv[3], mapped = True).load_testing()[0]
+        benchmark(network, images)
+    elif len(sys.argv) in (4, 5, 6) and sys.argv[1] == 'serve':
+        network = FeedForwardNetwork.load(sys.argv[2], mapped = True)
+        address = sys.argv[3]
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            address = (host, int(port))
+        server = make_server(network, address, *[f(arg) for (f, arg)
+            in zip((int, lambda ms: float(ms) / 1000), sys.argv[4:])])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print server.batcher.stats()
+    else:
+        print "Usage: %s serve checkpoint socket_path|host:port [max_batch_size [max_wait_ms]]" % sys.argv[0]
+        print "       %s bench checkpoint mnist_path" % sys.argv[0]
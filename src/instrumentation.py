@@ -0,0 +1,255 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Instrumentation of FeedForwardNetwork runs.
+
+A Metrics object set as network.metrics collects the wall time of the
+forward and backward pass of every layer, of the whole-model parameter
+updates and the samples trained, and calls its hooks after every training
+step. CountingBackend wraps the compute backend of naive_algebra and counts
+the calls, the floating point operations and the new arrays returned by
+every kernel.
+
+Both are off by default, and then cost one attribute test per layer:
+
+    with instrumented(network) as metrics:
+        network.train(generator, limit = 1000)
+    metrics.report()
+
+The memory figures are the arrays the kernels return when no out is given
+and the peak resident size, python 2 has no tracemalloc. The temporaries a
+kernel allocates and drops internally are not seen.
+"""
+
+import sys, time, resource
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+
+from naive_algebra import get_backend, set_backend
+
+# floating point operations per item of an activation and of its derivative
+ACTIVATION_FLOPS = {None: 0, 'sigmoid': 4, 'sigmoid_lut': 2, 'tanh': 4, 'relu': 1}
+ACTIVATION_GRAD_FLOPS = {None: 1, 'sigmoid': 4, 'tanh': 4, 'sigmoid_lut': 4, 'relu': 2}
+
+# floating point operations of every kernel, given its arguments
+KERNEL_FLOPS = {
+        'add': lambda a, b, out = None: len(a),
+        'sub': lambda a, b, out = None: len(a),
+        'scale': lambda a, number, out = None: len(a),
+        'div': lambda a, number, out = None: len(a),
+        'dot': lambda a, b: 2 * len(a),
+        'gemv': lambda a, row_num, col_num, x, out = None: 2 * row_num * col_num,
+        'gemv_t': lambda a, row_num, col_num, x, out = None: 2 * row_num * col_num,
+        'gemm': lambda a, row_num, inner_num, b, col_num, out = None:
+            2 * row_num * inner_num * col_num,
+        'gemm_nt': lambda a, row_num, inner_num, b, col_num, out = None:
+            2 * row_num * inner_num * col_num,
+        'gemm_tn': lambda a, row_num, a_col_num, b, b_col_num, out = None:
+            2 * row_num * a_col_num * b_col_num,
+        'transpose': lambda a, row_num, col_num, out = None: 0,
+        'sigmoid': lambda a, out = None: ACTIVATION_FLOPS['sigmoid'] * len(a),
+        'activate': lambda activation, a, out = None: ACTIVATION_FLOPS[activation] * len(a),
+        'activate_grad': lambda activation, partial, output, scale, out = None:
+            ACTIVATION_GRAD_FLOPS[activation] * len(output),
+        'affine': lambda a, row_num, col_num, x, b, scale, activation, out = None:
+            row_num * (2 * col_num + 2 + ACTIVATION_FLOPS[activation]),
+        'affine_nt': lambda a, row_num, inner_num, w, col_num, b, scale, activation, out = None:
+            row_num * col_num * (2 * inner_num + 2 + ACTIVATION_FLOPS[activation]),
+        'axpy': lambda alpha, x, y: 2 * len(x),
+        'outer': lambda u, v, out = None: len(u) * len(v),
+        'ger': lambda alpha, u, v, a: 2 * len(u) * len(v),
+        'col_sums': lambda a, row_num, col_num, out = None: row_num * col_num,
+        'gemv_sparse': lambda a, row_num, col_num, indices, values, out = None:
+            2 * row_num * len(indices),
+        'affine_sparse': lambda a, row_num, col_num, indices, values, b, scale, activation,
+            out = None: row_num * (2 * len(indices) + 2 + ACTIVATION_FLOPS[activation]),
+        'ger_sparse': lambda alpha, u, indices, values, a, col_num: 2 * len(u) * len(indices),
+        'momentum': lambda p, g, v, scale, rate, mu, nesterov: (7 if nesterov else 5) * len(p),
+        'adam': lambda p, g, m, v, scale, rate, beta1, beta2, epsilon, step: 13 * len(p),
+        'elementwise': lambda program, leaves, constants, activation, out = None:
+            (_operations(program) + ACTIVATION_FLOPS[activation]) * len(leaves[0]),
+        }
+
+def _operations(program):
+    """ the operations of an element-wise program, per item """
+    if isinstance(program, int):
+        return 0
+    op, left, right = program
+    return 1 + _operations(left) + (_operations(right) if op in ('add', 'sub') else 0)
+
+class CountingBackend(object):
+    """
+    A compute backend counting the work of another one: calls, floating
+    point operations, and new arrays returned because no out was given, with
+    their bytes, by kernel name. Kernels missing from KERNEL_FLOPS are
+    passed through uncounted.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.calls = defaultdict(int)
+        self.flops = defaultdict(int)
+        self.returned_arrays = defaultdict(int)
+        self.returned_bytes = defaultdict(int)
+
+    def __getattr__(self, name):
+        kernel = getattr(self.backend, name)
+        flops = KERNEL_FLOPS.get(name)
+        if flops is None:
+            return kernel
+
+        def counted(*args, **kwargs):
+            result = kernel(*args, **kwargs)
+            self.calls[name] += 1
+            self.flops[name] += flops(*args, **kwargs)
+            if isinstance(result, array) and not any(result is arg
+                    for arg in args + tuple(kwargs.values())):
+                self.returned_arrays[name] += 1
+                self.returned_bytes[name] += len(result) * result.itemsize
+            return result
+
+        # found directly from now on, without going through __getattr__
+        self.__dict__[name] = counted
+        return counted
+
+class Metrics(object):
+    """
+    Timings of a network run, by layer, layer l being the weight and bias
+    between the outputs l and l + 1.
+
+    hooks: callables called as hook(metrics, samples, loss) after every
+        training step, samples being the size of the step
+    """
+
+    def __init__(self, layer_num, hooks = None):
+        self.forward_seconds = [0.0] * layer_num
+        self.backward_seconds = [0.0] * layer_num
+        self.update_seconds = 0.0
+        self.samples = 0
+        self.steps = 0
+        self.loss = None
+        self.hooks = list(hooks or [])
+        self.counter = None
+        self.started = None
+        self.seconds = 0.0
+        self.peak_rss = None
+
+    def forward(self, layer_id, seconds):
+        self.forward_seconds[layer_id] += seconds
+
+    def backward(self, layer_id, seconds):
+        self.backward_seconds[layer_id] += seconds
+
+    def update(self, seconds):
+        """ a parameter update of all the layers at once """
+        self.update_seconds += seconds
+
+    def step(self, samples, loss):
+        self.samples += samples
+        self.steps += 1
+        self.loss = loss
+        for hook in self.hooks:
+            hook(self, samples, loss)
+
+    def start(self):
+        self.started = time.time()
+
+    def stop(self):
+        self.seconds += time.time() - self.started
+        self.started = None
+        # kilobytes on linux
+        self.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def elapsed(self):
+        if self.started is None:
+            return self.seconds
+        return self.seconds + time.time() - self.started
+
+    def samples_per_second(self):
+        elapsed = self.elapsed()
+        return self.samples / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        result = {
+                'samples': self.samples,
+                'steps': self.steps,
+                'seconds': self.elapsed(),
+                'samples_per_second': self.samples_per_second(),
+                'forward_seconds': list(self.forward_seconds),
+                'backward_seconds': list(self.backward_seconds),
+                'update_seconds': self.update_seconds,
+                'peak_rss': self.peak_rss,
+                }
+        if self.counter is not None:
+            result['kernels'] = dict((name, {
+                'calls': self.counter.calls[name],
+                'flops': self.counter.flops[name],
+                'returned_arrays': self.counter.returned_arrays[name],
+                'returned_bytes': self.counter.returned_bytes[name],
+                }) for name in self.counter.calls)
+        return result
+
+    def report(self, out = sys.stdout):
+        elapsed = self.elapsed()
+        out.write("%d samples in %.2fs, %.1f samples/s\n" % (self.samples, elapsed,
+            self.samples_per_second()))
+        out.write("layer  forward(s)  backward(s)  share\n")
+        for (layer_id, (f, b)) in enumerate(zip(self.forward_seconds, self.backward_seconds)):
+            out.write("%5d  %10.3f  %11.3f  %4.0f%%\n" % (layer_id, f, b,
+                (f + b) / elapsed * 100 if elapsed else 0.0))
+        if self.update_seconds:
+            out.write("update%24.3f  %4.0f%%\n" % (self.update_seconds,
+                self.update_seconds / elapsed * 100 if elapsed else 0.0))
+
+        if self.counter is not None:
+            counter = self.counter
+            out.write("kernel            calls      MFLOP  MFLOP/s  arrays  arrays MB\n")
+            for name in sorted(counter.calls, key = lambda k: -counter.flops[k]):
+                out.write("%-14s %8d %10.2f %8.1f %7d %10.2f\n" % (name, counter.calls[name],
+                    counter.flops[name] / 1e6,
+                    counter.flops[name] / 1e6 / elapsed if elapsed else 0.0,
+                    counter.returned_arrays[name], counter.returned_bytes[name] / 1e6))
+
+        if self.peak_rss is not None:
+            out.write("peak resident size %.1f MB\n" % (self.peak_rss / 1e6))
+
+@contextmanager
+def instrumented(network, count_ops = True, hooks = None):
+    """
+    Collect the metrics of everything the network runs within the block,
+    counting the kernels too if count_ops is True. The previous metrics and
+    backend are restored when leaving.
+    """
+    metrics = Metrics(network.depth - 1, hooks)
+    previous_metrics = network.metrics
+    network.metrics = metrics
+    previous_backend = None
+    if count_ops:
+        metrics.counter = CountingBackend(get_backend())
+        previous_backend = set_backend(metrics.counter)
+
+    metrics.start()
+    try:
+        yield metrics
+    finally:
+        metrics.stop()
+        network.metrics = previous_metrics
+        if previous_backend is not None:
+            set_backend(previous_backend)
+
+if __name__ == '__main__':
+    import random
+    from naive_algebra import Vector
+    from feedforward_network import FeedForwardNetwork
+
+    random.seed(0)
+    samples = [(Vector.fromRandom(784), Vector.fromList([0] * 9 + [1])) for i in xrange(200)]
+    for batch_size in (1, 20):
+        network = FeedForwardNetwork([784, 30, 10])
+        with instrumented(network) as metrics:
+            network.train(iter(samples), limit = 200, batch_size = batch_size)
+        print "batch size %d" % batch_size
+        metrics.report()
@@ -1,8 +1,10 @@
 #!/usr/bin/env python2
 
-import sys
+import sys, os
 import mnist_adapter
 import feedforward_network
+import parallel_evaluation
+import budgeted_training
 from itertools import izip
 
 import datetime
@@ -10,43 +12,53 @@ import datetime
 def puttime(msg):
     print datetime.datetime.now().strftime('%H:%M:%S ') + str(msg)
 
-def main(mnist_path):
+def main(mnist_path, cache_dir = None, checkpoint_path = None):
+    """
+    Train a network and evaluate it on the test set. With a checkpoint path,
+    the network is loaded from it if it exists, or saved to it once trained.
+    """
     puttime('start loading')
 
-    loader = mnist_adapter.MNIST(mnist_path)
-    training_data = loader.load_training()
+    loader = mnist_adapter.MNIST(mnist_path, mapped = True, cache_dir = cache_dir)
     testing_data = loader.load_testing()
 
-    input_size = len(training_data[0][0])
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        network = feedforward_network.FeedForwardNetwork.load(checkpoint_path, mapped = True)
+        puttime('loaded ' + checkpoint_path)
+    else:
+        # trained sample by sample, on the non-zero pixels only
+        training_data = mnist_adapter.MNIST(mnist_path, mapped = True,
+                cache_dir = cache_dir, sparse = True).load_training()
+        input_size = len(training_data[0][0])
+
+        # the deep stack only learns with tanh and a scaled initialization,
+        # with the normalized sigmoid it stays at chance level
+        network = feedforward_network.FeedForwardNetwork(
+                dim_list = [input_size, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10],
+                eta = 0.01, activation = 'tanh', normalize = False
+                )
 
-    network = feedforward_network.FeedForwardNetwork(
-            dim_list = [input_size, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10],
-            eta = 0.1
-            )
+        # start training, on at most 20000 samples, stopping early once the
+        # held-out accuracy stalls
+        puttime('start training')
+        trainer = budgeted_training.BudgetedTrainer(network, patience = 3,
+                every = 2000, limit = 20000)
+        result = trainer.train(training_data, logger = puttime)
+        budgeted_training.report(result)
 
-    # start training
-    puttime('start training')
-    for i in xrange(2):
-        generator = feedforward_network.sample_wrapper(training_data)
-        network.train(generator, puttime, limit = 10000)
+        if checkpoint_path:
+            network.save(checkpoint_path)
 
     # start testing
     puttime('start testing')
-    generator = feedforward_network.sample_wrapper(testing_data)
-    succ, total = 0, 0
-    for (x, y) in generator:
-        out = network.inference(x)
-        print "final", out, "label", y
-        succ += (1 if out == y else 0)
-        total += 1
-        if total >= 50: break
-
+    result = parallel_evaluation.evaluate_parallel(network,
+            testing_data[0], testing_data[1])
     puttime('end testing')
-    print "Prec = %.4f" % (succ * 1.0 / total)
+    parallel_evaluation.report(result)
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        main(sys.argv[1])
+    if len(sys.argv) in (2, 3, 4):
+        main(*sys.argv[1:])
     else:
-        print "Usage: %s mnist_path" % sys.argv[0]
+        print "Usage: %s mnist_path [cache_dir [checkpoint]]" % sys.argv[0]
 
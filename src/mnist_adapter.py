@@ -10,13 +10,30 @@ https://github.com/sorki/python-mnist
 """
 
 import os
+import sys
+import mmap
 import struct
+import hashlib
 from array import array
+from itertools import imap, repeat
+from operator import truediv
+
+from naive_algebra import SparseVector
 
 
 class MNIST(object):
-    def __init__(self, path='.'):
+    def __init__(self, path='.', mapped=False, cache_dir=None, sparse=False):
+        """
+        With mapped=True the image files are memory-mapped instead of read
+        and normalized up front, see load_mapped. With a cache_dir the
+        normalized datasets are kept in binary caches there, see load_cached.
+        With sparse=True the images are returned as SparseImages, every one
+        a SparseVector of its non-zero pixels.
+        """
         self.path = path
+        self.mapped = mapped
+        self.cache_dir = cache_dir
+        self.sparse = sparse
 
         self.test_img_fname = 't10k-images-idx3-ubyte'
         self.test_lbl_fname = 't10k-labels-idx1-ubyte'
@@ -31,8 +48,10 @@ class MNIST(object):
         self.train_labels = []
 
     def load_testing(self):
-        ims, labels = self.load(os.path.join(self.path, self.test_img_fname),
+        ims, labels = self._loader()(os.path.join(self.path, self.test_img_fname),
                                 os.path.join(self.path, self.test_lbl_fname))
+        if self.sparse:
+            ims = SparseImages(ims)
 
         self.test_images = ims
         self.test_labels = labels
@@ -40,14 +59,22 @@ class MNIST(object):
         return ims, labels
 
     def load_training(self):
-        ims, labels = self.load(os.path.join(self.path, self.train_img_fname),
+        ims, labels = self._loader()(os.path.join(self.path, self.train_img_fname),
                                 os.path.join(self.path, self.train_lbl_fname))
+        if self.sparse:
+            ims = SparseImages(ims)
 
         self.train_images = ims
         self.train_labels = labels
 
         return ims, labels
 
+    def _loader(self):
+        if self.cache_dir is not None:
+            return lambda path_img, path_lbl: self.load_cached(
+                path_img, path_lbl, self.cache_dir)
+        return self.load_mapped if self.mapped else self.load
+
     @classmethod
     def load(cls, path_img, path_lbl):
         with open(path_lbl, 'rb') as file:
@@ -80,6 +107,53 @@ class MNIST(object):
 
         return images, labels
 
+    @classmethod
+    def load_mapped(cls, path_img, path_lbl):
+        """
+        Memory-map the image file instead of reading it, the images are
+        returned as a MappedImages sequence which normalizes the pixels
+        only when a sample is consumed. The headers are checked as in load.
+        """
+        with open(path_lbl, 'rb') as file:
+            magic, size = struct.unpack(">II", file.read(8))
+            if magic != 2049:
+                raise ValueError('Magic number mismatch, expected 2049,'
+                                 'got {}'.format(magic))
+
+            labels = array("B", file.read())
+
+        with open(path_img, 'rb') as file:
+            magic, size, rows, cols = struct.unpack(">IIII", file.read(16))
+            if magic != 2051:
+                raise ValueError('Magic number mismatch, expected 2051,'
+                                 'got {}'.format(magic))
+
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(mapping) < 16 + size * rows * cols:
+            raise ValueError('Image file is truncated, expected {} images'
+                             .format(size))
+
+        return MappedImages(mapping, 16, size, rows * cols), labels
+
+    @classmethod
+    def load_cached(cls, path_img, path_lbl, cache_dir):
+        """
+        Load the normalized images, as float32, and the labels from a binary
+        cache in cache_dir. The cache is built from the IDX files on the first
+        call, and rebuilt whenever they change.
+        """
+        cache_path = os.path.join(cache_dir, os.path.basename(path_img) + '.cache')
+        sources = (path_img, path_lbl)
+        cached = _read_cache(cache_path, sources)
+        if cached is not None:
+            return cached
+
+        images, labels = cls.load_mapped(path_img, path_lbl)
+        block = images.normalized(0, len(images), 'f')
+        _write_cache(cache_path, sources, images.pixels, labels, block)
+        return CachedImages(block, 0, len(images), images.pixels), labels
+
     @classmethod
     def display(cls, img, width=28, threshold=200 / 255.0):
         render = ''
@@ -91,3 +165,214 @@ class MNIST(object):
             else:
                 render += '.'
         return render
+
+
+class ImageSequence(object):
+    """
+    A read-only sequence of size images of the given number of pixels,
+    starting at item offset of some flat storage.
+
+    Indexing and iteration return one image normalized into [0, 1] as an
+    array('d'), contiguous slices share the storage, and normalized(start,
+    stop) converts a whole block of images in bulk.
+    """
+
+    def __init__(self, offset, size, pixels):
+        self.offset = offset
+        self.size = size
+        self.pixels = pixels
+
+    def __len__(self):
+        return self.size
+
+    def _position(self, i):
+        if i < 0:
+            i += self.size
+        if i < 0 or self.size <= i:
+            raise IndexError('image index out of range')
+        return self.offset + i * self.pixels
+
+    def _range(self, start, stop):
+        """ position of the first item and number of images of a block """
+        start, stop, step = slice(start, stop).indices(self.size)
+        return self.offset + start * self.pixels, max(stop - start, 0)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError('only contiguous slices are supported')
+            begin, size = self._range(key.start, key.stop)
+            return self._sub(begin, size)
+
+        self._position(key)
+        return self.normalized(key, key + 1 if key != -1 else None)
+
+    def __iter__(self):
+        for i in xrange(self.size):
+            yield self.normalized(i, i + 1)
+
+    def _sub(self, offset, size):
+        raise NotImplementedError
+
+    def normalized(self, start, stop=None, typecode='d'):
+        raise NotImplementedError
+
+
+class MappedImages(ImageSequence):
+    """
+    Images over a memory-mapped IDX file, the pixels are normalized only
+    when they are consumed. raw(i) is a zero-copy buffer on the bytes of
+    one image.
+    """
+
+    def __init__(self, mapping, offset, size, pixels):
+        ImageSequence.__init__(self, offset, size, pixels)
+        self.mapping = mapping
+
+    def raw(self, i):
+        return buffer(self.mapping, self._position(i), self.pixels)
+
+    def _sub(self, offset, size):
+        return MappedImages(self.mapping, offset, size, self.pixels)
+
+    def normalized(self, start, stop=None, typecode='d'):
+        """
+        Pixels of the images from start to stop divided by 255.0, as one
+        flat array of the given typecode.
+        """
+        begin, size = self._range(start, stop)
+        pixels = array('B', self.mapping[begin:begin + size * self.pixels])
+        return array(typecode, imap(truediv, pixels, repeat(255.0)))
+
+
+class CachedImages(ImageSequence):
+    """
+    Images already normalized, held in one flat array('f') as loaded from
+    a dataset cache.
+    """
+
+    def __init__(self, block, offset, size, pixels):
+        ImageSequence.__init__(self, offset, size, pixels)
+        self.block = block
+
+    def _sub(self, offset, size):
+        return CachedImages(self.block, offset, size, self.pixels)
+
+    def normalized(self, start, stop=None, typecode='d'):
+        begin, size = self._range(start, stop)
+        pixels = self.block[begin:begin + size * self.pixels]
+        return pixels if typecode == 'f' else array(typecode, pixels)
+
+
+class SparseImages(object):
+    """
+    A read-only sequence over the images of another one, indexing and
+    iteration return the images as SparseVector, about 80% of the MNIST
+    pixels being zero. Contiguous slices stay sparse.
+    """
+
+    def __init__(self, images, typecode='d'):
+        self.images = images
+        self.typecode = typecode
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return SparseImages(self.images[key], self.typecode)
+        return SparseVector.fromDense(self.images[key], self.typecode)
+
+    def __iter__(self):
+        for image in self.images:
+            yield SparseVector.fromDense(image, self.typecode)
+
+
+# Layout of a dataset cache file: the header, a key for each source file,
+# the labels as bytes, then the normalized images as float32.
+CACHE_MAGIC = 'MNISTCACHE'
+CACHE_VERSION = 1
+CACHE_HEADER = '<10sIIIc'
+CACHE_SOURCE = '<Qd16s'
+
+
+def _digest(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), ''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _read_cache(cache_path, sources):
+    """
+    Return (images, labels) from a cache file, or None if it's missing,
+    damaged or out of date. A source file is taken as unchanged if its
+    size and mtime are the recorded ones, or if only the mtime differs but
+    its content still has the recorded hash, then the new mtime is recorded
+    so that the next load doesn't hash it again.
+    """
+    try:
+        file = open(cache_path, 'rb')
+    except IOError:
+        return None
+
+    with file:
+        try:
+            magic, version, size, pixels, byteorder = struct.unpack(
+                CACHE_HEADER, file.read(struct.calcsize(CACHE_HEADER)))
+            if (magic, version, byteorder) != (CACHE_MAGIC, CACHE_VERSION, sys.byteorder[0]):
+                return None
+
+            touched = []
+            for source in sources:
+                position = file.tell()
+                length, mtime, digest = struct.unpack(
+                    CACHE_SOURCE, file.read(struct.calcsize(CACHE_SOURCE)))
+                stat = os.stat(source)
+                if stat.st_size != length:
+                    return None
+                if stat.st_mtime != mtime:
+                    if _digest(source) != digest:
+                        return None
+                    touched.append((position, struct.pack(CACHE_SOURCE, length,
+                                                          stat.st_mtime, digest)))
+
+            labels = array('B')
+            labels.fromfile(file, size)
+            block = array('f')
+            block.fromfile(file, size * pixels)
+        except (struct.error, EOFError, OSError):
+            return None
+
+    if touched:
+        # the key is updated in place, a cache that can't be written is
+        # still good to read
+        try:
+            with open(cache_path, 'r+b') as file:
+                for (position, key) in touched:
+                    file.seek(position)
+                    file.write(key)
+        except IOError:
+            pass
+
+    return CachedImages(block, 0, size, pixels), labels
+
+
+def _write_cache(cache_path, sources, pixels, labels, block):
+    directory = os.path.dirname(cache_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # write aside and rename, so that a reader never sees half a file
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(struct.pack(CACHE_HEADER, CACHE_MAGIC, CACHE_VERSION,
+                               len(labels), pixels, sys.byteorder[0]))
+        for source in sources:
+            stat = os.stat(source)
+            file.write(struct.pack(CACHE_SOURCE, stat.st_size, stat.st_mtime,
+                                   _digest(source)))
+        labels.tofile(file)
+        block.tofile(file)
+    os.rename(temp_path, cache_path)
@@ -1,34 +1,522 @@
 #!/usr/bin/env python2
 # coding: utf-8
 
-import random, copy
+import random, copy, math, os, ctypes
+from array import array
+from itertools import imap, izip, repeat
+from operator import add, sub, mul, truediv, itemgetter
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Storage type of the buffers, 'd' for double and 'f' for single precision.
+DEFAULT_TYPECODE = 'd'
+TYPECODES = ('d', 'f')
+
+def _buffer(data, typecode = None):
+    """
+    Return a typed array for data, reuse it directly if it's already an array
+    of the desired type, so that no copy is made.
+    """
+    if typecode is None:
+        typecode = getattr(data, 'typecode', DEFAULT_TYPECODE)
+        if typecode not in TYPECODES:
+            typecode = DEFAULT_TYPECODE
+
+    if typecode not in TYPECODES:
+        raise ValueError('Unsupported typecode %r' % typecode)
+
+    if isinstance(data, (array, ArenaView)) and data.typecode == typecode:
+        return data
+
+    return array(typecode, data)
+
+def _zeros(length, typecode = None):
+    return array(typecode or DEFAULT_TYPECODE, [0.0]) * length
+
+def _store(result, out):
+    """ copy a freshly computed array into out if given """
+    if out is None or out is result:
+        return result
+
+    if isinstance(out, array):
+        out[:] = result
+    else:
+        out.assign(result)
+    return out
+
+def _array(buf):
+    """
+    buf itself if it's a typed array, or a typed array copy of an arena
+    view, made with one memcpy: slicing the view would box every item.
+    """
+    if isinstance(buf, array):
+        return buf
+
+    copy = array(buf.typecode)
+    copy.fromstring(buffer(buf))
+    return copy
+
+def _result(out, length, like):
+    """ the typed array to compute into: out itself, or a new one for no out or a view """
+    if isinstance(out, array):
+        return out
+    return _zeros(length, like.typecode if out is None else out.typecode)
+
+class ArenaView(object):
+    """
+    Base of the ctypes arrays made by arena_view, which share the memory of
+    a slice of a typed array, the arena. They stand for the typed arrays
+    Vector and Matrix are stored in, and every kernel accepts them.
+    """
+    __slots__ = ()
+
+    def tolist(self):
+        return self[:]
+
+    def buffer_info(self):
+        return ctypes.addressof(self), len(self)
+
+    def assign(self, src):
+        """ copy the typed array src of the same type and length with one memmove """
+        if len(src) != len(self) or src.typecode != self.typecode:
+            raise ValueError('source does not fit the arena view')
+        ctypes.memmove(ctypes.addressof(self), src.buffer_info()[0], len(self) * self.itemsize)
+
+# element type of the arena views, by typecode
+CTYPES = {'d': ctypes.c_double, 'f': ctypes.c_float, 'b': ctypes.c_byte}
+_view_types = {}
+
+def view_type(typecode, length):
+    """ the ArenaView type of length items of the given typecode, made once """
+    key = (typecode, length)
+    result = _view_types.get(key)
+    if result is None:
+        result = _view_types[key] = type('ArenaView_%s%d' % key, (ArenaView, ctypes.Array),
+                {'_type_': CTYPES[typecode], '_length_': length,
+                    'typecode': typecode, 'itemsize': ctypes.sizeof(CTYPES[typecode])})
+    return result
+
+def arena_view(arena, offset, length):
+    """
+    A view of length items of the typed array arena from offset on, sharing
+    its memory. Python 2 arrays don't know about their views, thus the
+    arena must never be resized while viewed.
+    """
+    return view_type(arena.typecode, length).from_buffer(arena, offset * arena.itemsize)
+
+# Tile size of the matrix product, the number of rows and columns of the
+# output computed against the same slices of the operands.
+GEMM_BLOCK = 64
 
-class Vector:
+class PythonBackend(object):
     """
-    Vector class uses python list as its internal structure.
-    
-    Implemented operations like vector plus, multiplication by a number and 
+    The reference compute backend, every kernel is a loop of python
+    builtins over the typed arrays, thus no dependency is needed.
+
+    Kernels work on flat buffers, matrices are stored row by row. A kernel
+    with an out parameter writes the result into out and returns it, or
+    returns a new array if out is None.
+    """
+    name = 'python'
+
+    def add(self, a, b, out = None):
+        tc = a.typecode if out is None else out.typecode
+        return _store(array(tc, imap(add, a, b)), out)
+
+    def sub(self, a, b, out = None):
+        tc = a.typecode if out is None else out.typecode
+        return _store(array(tc, imap(sub, a, b)), out)
+
+    def scale(self, a, number, out = None):
+        tc = a.typecode if out is None else out.typecode
+        return _store(array(tc, imap(mul, a, repeat(number))), out)
+
+    def div(self, a, number, out = None):
+        tc = a.typecode if out is None else out.typecode
+        return _store(array(tc, imap(truediv, a, repeat(number))), out)
+
+    def dot(self, a, b):
+        return sum(imap(mul, a, b))
+
+    def gemv(self, a, row_num, col_num, x, out = None):
+        """ a * x, for a of row_num by col_num """
+        tc = a.typecode if out is None else out.typecode
+        a, x = _array(a), x.tolist()
+        # every row is read straight from the matrix buffer
+        return _store(array(tc, [sum(map(mul, a[r * col_num:(r + 1) * col_num], x))
+            for r in xrange(row_num)]), out)
+
+    def gemv_t(self, a, row_num, col_num, x, out = None):
+        """ a^T * x, for a of row_num by col_num """
+        tc = a.typecode if out is None else out.typecode
+        a, x = _array(a), x.tolist()
+        # every column is taken with one strided slice of the buffer
+        return _store(array(tc, [sum(map(mul, a[c::col_num], x))
+            for c in xrange(col_num)]), out)
+
+    def ger(self, alpha, u, v, a):
+        """
+        The rank-1 update a += alpha * u * v^T in place, for a of len(u) by
+        len(v), one slice write per row.
+        """
+        col_num = len(v)
+        v = v.tolist()
+        items = _array(a)
+        for (r, p) in enumerate(u):
+            begin = r * col_num
+            items[begin:begin + col_num] = array(a.typecode,
+                    map(add, items[begin:begin + col_num], imap(mul, v, repeat(alpha * p))))
+        return _store(items, a)
+
+    def gemm(self, a, row_num, inner_num, b, col_num, out = None):
+        """ a * b, for a of row_num by inner_num and b of inner_num by col_num """
+        result = _result(out, row_num * col_num, a)
+
+        # lay the columns of the right operand out contiguously, only once
+        b = _array(b)
+        cols = [b[c::col_num].tolist() for c in xrange(col_num)]
+        self._gemm_nt(_array(a), row_num, inner_num, cols, result)
+        return _store(result, out)
+
+    def gemm_nt(self, a, row_num, inner_num, b, col_num, out = None):
+        """ a * b^T, for a of row_num by inner_num and b of col_num by inner_num """
+        result = _result(out, row_num * col_num, a)
+
+        b = _array(b)
+        rows = [b[r * inner_num:(r + 1) * inner_num].tolist() for r in xrange(col_num)]
+        self._gemm_nt(_array(a), row_num, inner_num, rows, result)
+        return _store(result, out)
+
+    def _gemm_nt(self, a, row_num, inner_num, cols, out):
+        """
+        Compute out = A * B into the flat buffer out, where A is the row_num
+        by inner_num matrix stored row by row in a, and cols holds the columns
+        of B, each one a contiguous list of length inner_num.
+
+        The output is processed tile by tile, every dot product reads two
+        contiguous lists and every tile row is stored with one slice write.
+        Operands are unpacked into lists once per tile, since iterating a
+        list of floats is cheaper than boxing every array item again for
+        each cell.
+        """
+        col_num = len(cols)
+        tc = out.typecode
+        for r0 in xrange(0, row_num, GEMM_BLOCK):
+            r1 = min(r0 + GEMM_BLOCK, row_num)
+            rows = [a[r * inner_num:(r + 1) * inner_num].tolist() for r in xrange(r0, r1)]
+            for c0 in xrange(0, col_num, GEMM_BLOCK):
+                tile = cols[c0:c0 + GEMM_BLOCK]
+                base = r0 * col_num + c0
+                for row in rows:
+                    out[base:base + len(tile)] = array(tc,
+                            [sum(map(mul, row, col)) for col in tile])
+                    base += col_num
+
+    def transpose(self, a, row_num, col_num, out = None):
+        """ the col_num by row_num transpose of a """
+        result = _result(out, row_num * col_num, a)
+
+        a = _array(a)
+        for col_id in xrange(col_num):
+            result[col_id * row_num:(col_id + 1) * row_num] = a[col_id::col_num]
+
+        return _store(result, out)
+
+    def sigmoid(self, a, out = None):
+        return self.activate('sigmoid', a, out)
+
+    def activate(self, activation, a, out = None):
+        """ apply the named element-wise activation """
+        tc = a.typecode if out is None else out.typecode
+        return _store(array(tc, PYTHON_ACTIVATIONS[activation][0](a)), out)
+
+    def activate_grad(self, activation, partial, output, scale, out = None):
+        """
+        partial * f'(z) * scale, where output = f(z) for the named activation
+        """
+        tc = output.typecode if out is None else out.typecode
+        return _store(array(tc,
+            PYTHON_ACTIVATIONS[activation][1](partial, output, scale)), out)
+
+    def affine(self, a, row_num, col_num, x, b, scale, activation, out = None):
+        """ activation((a * x + b) * scale) in one pass, a of row_num by col_num """
+        tc = a.typecode if out is None else out.typecode
+        a, x = _array(a), x.tolist()
+        z = [(sum(map(mul, a[r * col_num:(r + 1) * col_num], x)) + b[r]) * scale
+                for r in xrange(row_num)]
+        return _store(array(tc, PYTHON_ACTIVATIONS[activation][0](z)), out)
+
+    def affine_nt(self, a, row_num, inner_num, w, col_num, b, scale, activation, out = None):
+        """
+        activation((a * w^T + b) * scale), with the bias of length col_num
+        added to every row, a of row_num by inner_num and w of col_num by
+        inner_num
+        """
+        out = self.gemm_nt(a, row_num, inner_num, w, col_num, out)
+        bias = b.tolist() * row_num
+        out[:] = array(out.typecode, PYTHON_ACTIVATIONS[activation][0](
+            [(z + c) * scale for (z, c) in izip(out, bias)]))
+        return out
+
+    def axpy(self, alpha, x, y):
+        """ y += alpha * x, in place """
+        return _store(array(y.typecode, imap(add, _array(y), imap(mul, _array(x),
+            repeat(alpha)))), y)
+
+    def outer(self, u, v, out = None):
+        """ the len(u) by len(v) matrix u * v^T """
+        tc = u.typecode if out is None else out.typecode
+        v = v.tolist()
+        return _store(array(tc, [p * q for p in u for q in v]), out)
+
+    def gemm_tn(self, a, row_num, a_col_num, b, b_col_num, out = None):
+        """ a^T * b, for a of row_num by a_col_num and b of row_num by b_col_num """
+        return self.gemm_nt(self.transpose(a, row_num, a_col_num), a_col_num, row_num,
+                self.transpose(b, row_num, b_col_num), b_col_num, out)
+
+    def col_sums(self, a, row_num, col_num, out = None):
+        tc = a.typecode if out is None else out.typecode
+        a = _array(a)
+        return _store(array(tc, [sum(a[c::col_num]) for c in xrange(col_num)]), out)
+
+    def gemv_sparse(self, a, row_num, col_num, indices, values, out = None):
+        """
+        a * x for a sparse x, given by the positions and the values of its
+        non-zero items, only the matching columns of a are read.
+        """
+        return self.affine_sparse(a, row_num, col_num, indices, values,
+                repeat(0.0, row_num), 1.0, None, out)
+
+    def affine_sparse(self, a, row_num, col_num, indices, values, b, scale, activation, out = None):
+        """ activation((a * x + b) * scale) for a sparse x, as gemv_sparse """
+        tc = a.typecode if out is None else out.typecode
+        a, values = _array(a), values.tolist()
+        if len(indices) > 1:
+            # every row is sliced out, then its non-zero columns picked in C
+            gather = itemgetter(*indices)
+            z = [(sum(map(mul, gather(a[r * col_num:(r + 1) * col_num]), values)) + p) * scale
+                    for (r, p) in izip(xrange(row_num), b)]
+        elif indices:
+            i, v = indices[0], values[0]
+            z = [(a[r * col_num + i] * v + p) * scale for (r, p) in izip(xrange(row_num), b)]
+        else:
+            z = [p * scale for p in b]
+        return _store(array(tc, PYTHON_ACTIVATIONS[activation][0](z)), out)
+
+    def ger_sparse(self, alpha, u, indices, values, a, col_num):
+        """
+        The rank-1 update a += alpha * u * x^T in place for a sparse x, only
+        the non-zero columns of x are touched.
+        """
+        pairs = zip(indices, values)
+        items = _array(a)
+        for (r, p) in enumerate(u):
+            begin = r * col_num
+            p *= alpha
+            for (i, v) in pairs:
+                items[begin + i] += p * v
+        return _store(items, a)
+
+    def momentum(self, p, g, v, scale, rate, mu, nesterov):
+        """
+        One momentum step in place for the gradient g * scale: the velocity
+        v = mu * v + g * scale, then p -= rate * v, or for nesterov
+        p -= rate * (g * scale + mu * v).
+        """
+        g = [x * scale for x in _array(g)]
+        velocity = [mu * a + b for (a, b) in izip(v, g)]
+        v[:] = array(v.typecode, velocity)
+        if nesterov:
+            velocity = [b + mu * a for (a, b) in izip(velocity, g)]
+        return _store(array(p.typecode, [x - rate * a for (x, a) in izip(p, velocity)]), p)
+
+    def adam(self, p, g, m, v, scale, rate, beta1, beta2, epsilon, step):
+        """
+        One Adam step in place for the gradient g * scale, with the first
+        and second moment estimates m and v, step counting from 1.
+        """
+        g = [x * scale for x in _array(g)]
+        moments = [beta1 * a + (1 - beta1) * b for (a, b) in izip(m, g)]
+        squares = [beta2 * a + (1 - beta2) * b * b for (a, b) in izip(v, g)]
+        m[:] = array(m.typecode, moments)
+        v[:] = array(v.typecode, squares)
+        # the bias corrections of the moments, both started at zero
+        c1, c2 = 1 - beta1 ** step, 1 - beta2 ** step
+        sqrt = math.sqrt
+        return _store(array(p.typecode, [x - rate * (a / c1) / (sqrt(b / c2) + epsilon)
+            for (x, a, b) in izip(p, moments, squares)]), p)
+
+    def elementwise(self, program, leaves, constants, activation, out = None):
+        """
+        Evaluate an element-wise program over buffers of the same length in
+        a single pass, then the named activation. The program is a tree of
+        leaf positions and of ('add', l, r), ('sub', l, r), ('scale', e, c)
+        and ('div', e, c) nodes, c being the position of a number in
+        constants.
+        """
+        tc = leaves[0].typecode if out is None else out.typecode
+        function = _elementwise_function(program, len(leaves), len(constants))
+        items = function(*(tuple(constants) + tuple(_array(leaf) for leaf in leaves)))
+        if activation is not None:
+            items = PYTHON_ACTIVATIONS[activation][0](items)
+        return _store(array(tc, items), out)
+
+# the operators of the element-wise programs
+ELEMENTWISE_OPERATORS = {'add': '+', 'sub': '-', 'scale': '*', 'div': '/'}
+_elementwise_functions = {}
+
+def _elementwise_function(program, leaf_num, constant_num):
+    """
+    A program compiled into one list comprehension over the zipped leaves,
+    the constants and the leaves being its arguments, cached by program
+    shape thus the same expression with other numbers is compiled once.
+    """
+    key = (program, leaf_num, constant_num)
+    function = _elementwise_functions.get(key)
+    if function is None:
+        def source(node):
+            if isinstance(node, int):
+                return 'x%d' % node
+            op, left, right = node
+            right = source(right) if op in ('add', 'sub') else 'c%d' % right
+            return '(%s %s %s)' % (source(left), ELEMENTWISE_OPERATORS[op], right)
+
+        leaves = ['a%d' % i for i in xrange(leaf_num)]
+        function = eval('lambda %s: [%s for (%s,) in izip(%s)]' % (
+            ', '.join(['c%d' % i for i in xrange(constant_num)] + leaves), source(program),
+            ', '.join('x%d' % i for i in xrange(leaf_num)), ', '.join(leaves)),
+            {'izip': izip})
+        _elementwise_functions[key] = function
+    return function
+
+def _sigmoid(z):
+    exp = math.exp
+    try:
+        return [1.0 / (1 + exp(-v)) for v in z]
+    except OverflowError:
+        # exp(-v) overflows for v below about -709, where the equivalent
+        # form with exp(v) is used instead, the fast path costs nothing more
+        return [1.0 / (1 + exp(-v)) if v >= 0 else exp(v) / (1 + exp(v)) for v in z]
+
+def _sigmoid_grad(partial, output, scale):
+    return [p * o * (1 - o) * scale for (p, o) in izip(partial, output)]
+
+# The sigmoid sampled every 1 / SIGMOID_LUT_STEPS over [-SIGMOID_LUT_RANGE,
+# SIGMOID_LUT_RANGE], read at the nearest lower sample, saturated outside.
+# The error is below 1e-3. It's slower than math.exp in pure python, but
+# faster than numpy.exp on the numpy backend.
+SIGMOID_LUT_RANGE = 16
+SIGMOID_LUT_STEPS = 256
+SIGMOID_LUT = [1.0 / (1 + math.exp(-(float(i) / SIGMOID_LUT_STEPS - SIGMOID_LUT_RANGE)))
+        for i in xrange(2 * SIGMOID_LUT_RANGE * SIGMOID_LUT_STEPS + 1)]
+
+def _sigmoid_lut(z):
+    table, steps, bound = SIGMOID_LUT, SIGMOID_LUT_STEPS, SIGMOID_LUT_RANGE
+    offset = bound * steps
+    return [table[int(v * steps + offset)] if -bound < v < bound
+            else (1.0 if v > 0 else 0.0) for v in z]
+
+def _tanh(z):
+    tanh = math.tanh
+    return [tanh(v) for v in z]
+
+def _tanh_grad(partial, output, scale):
+    return [p * (1 - o * o) * scale for (p, o) in izip(partial, output)]
+
+def _relu(z):
+    return [v if v > 0 else 0.0 for v in z]
+
+def _relu_grad(partial, output, scale):
+    return [p * scale if o > 0 else 0.0 for (p, o) in izip(partial, output)]
+
+def _identity_grad(partial, output, scale):
+    return [p * scale for p in partial]
+
+# Element-wise activations of the python backend by name, each one as a pair
+# of functions over sequences: the activation, and its derivative given the
+# partial of the output and the output itself.
+PYTHON_ACTIVATIONS = {
+        None: (list, _identity_grad),
+        'sigmoid': (_sigmoid, _sigmoid_grad),
+        'sigmoid_lut': (_sigmoid_lut, _sigmoid_grad),
+        'tanh': (_tanh, _tanh_grad),
+        'relu': (_relu, _relu_grad),
+        }
+
+def _create_backend(name):
+    if name == 'python':
+        return PythonBackend()
+
+    if name == 'numpy':
+        # imported on demand, numpy is an optional dependency
+        from numpy_backend import NumpyBackend
+        return NumpyBackend()
+
+    if name == 'parallel':
+        from parallel_backend import ParallelBackend
+        return ParallelBackend()
+
+    raise ValueError('Unknown backend %r' % name)
+
+_backend = _create_backend(os.environ.get('NAIVE_ALGEBRA_BACKEND', 'python'))
+
+def get_backend():
+    return _backend
+
+def set_backend(backend):
+    """
+    Select the compute backend of Vector and Matrix, given by name, 'python',
+    'numpy' or 'parallel', or as a backend object. Returns the previous
+    backend.
+    ImportError is raised when numpy is asked for but not installed.
+    """
+    global _backend
+    previous = _backend
+    _backend = _create_backend(backend) if isinstance(backend, basestring) else backend
+    return previous
+
+class Vector(object):
+    """
+    Vector class uses a typed array as its internal structure, which keeps
+    the numbers unboxed in one contiguous block of memory.
+
+    Implemented operations like vector plus, multiplication by a number and
     dot product.
     """
-    def __init__(self, datalist):
-        self.data = datalist
+    __slots__ = ('data',)
+
+    def __init__(self, datalist, typecode = None):
+        self.data = _buffer(datalist, typecode)
 
     @classmethod
-    def fromList(cls, datalist):
-        return Vector(datalist)
+    def fromList(cls, datalist, typecode = None):
+        return Vector(datalist, typecode)
 
     @classmethod
-    def fromIterable(cls, iterator):
-        return Vector(list(iterator))
+    def fromIterable(cls, iterator, typecode = None):
+        return Vector(array(typecode or DEFAULT_TYPECODE, iterator))
 
     @classmethod
-    def fromRandom(cls, length):
+    def fromRandom(cls, length, typecode = None):
         """ generate a vector of given length with all random float num in [0, 1) """
-        return Vector([random.random() for i in xrange(length)])
+        return Vector(array(typecode or DEFAULT_TYPECODE,
+            [random.random() for i in xrange(length)]))
+
+    @classmethod
+    def fromZeros(cls, length, typecode = None):
+        """ generate a vector of given length filled with zeros """
+        return Vector(_zeros(length, typecode))
+
+    @property
+    def typecode(self):
+        return self.data.typecode
 
     def __len__(self):
         return len(self.data)
 
+    def __iter__(self):
+        return iter(self.data)
+
     def __getitem__(self, key):
         return self.data[key]
 
@@ -43,67 +531,61 @@ class Vector:
         return self.notEqualTo(other, 0)
 
     def __str__(self):
-        return str(self.data)
+        return str(self.data.tolist())
 
     def equalTo(self, other, threshold = 0):
         return (len(self) == len(other)
-                and all(abs(self.data[i] - other.data[i]) <= threshold
-                    for i in xrange(len(self.data))))
+                and all(abs(x - y) <= threshold
+                    for x, y in izip(self.data, other._items())))
 
     def notEqualTo(self, other, threshold = 0):
-        return (len(self) != len(other)
-                or any(abs(self.data[i] - other.data[i]) > threshold
-                    for i in xrange(len(self.data))))
+        return not self.equalTo(other, threshold)
 
-    def __add__(self, another):
-        """ overload + operator """
-        if another.__class__.__name__ != self.__class__.__name__:
+    def _items(self):
+        return self.data
+
+    def _check(self, another):
+        if not isinstance(another, (Vector, VectorView)):
             raise TypeError('Another is not Vector')
 
         if len(self) != len(another):
             raise ValueError('Unequal length of vectors')
 
-        return Vector([self.data[i] + another.data[i] for i in xrange(len(self))])
+    def __add__(self, another):
+        """ overload + operator """
+        if _lazy or isinstance(another, Expression):
+            return Expression.combine('add', self, another)
+        self._check(another)
+        return Vector(_backend.add(self.data, another._items()))
 
     def __iadd__(self, another):
         """ overload += operator """
-        if another.__class__.__name__ != self.__class__.__name__:
-            raise TypeError('Another is not Vector')
-
-        if len(self) != len(another):
-            raise ValueError('Unequal length of vectors')
-
-        for i in xrange(len(self)):
-            self.data[i] += another.data[i]
-
+        if isinstance(another, Expression):
+            return Expression.combine('add', self, another).evaluate(self)
+        self._check(another)
+        _backend.add(self.data, another._items(), self.data)
         return self
 
     def __sub__(self, another):
         """ overload - operator """
-        if another.__class__.__name__ != self.__class__.__name__:
-            raise TypeError('Another is not Vector')
-
-        if len(self) != len(another):
-            raise ValueError('Unequal length of vectors')
-
-        return Vector([self.data[i] - another.data[i] for i in xrange(len(self))])
+        if _lazy or isinstance(another, Expression):
+            return Expression.combine('sub', self, another)
+        self._check(another)
+        return Vector(_backend.sub(self.data, another._items()))
 
     def __isub__(self, another):
         """ overload -= operator """
-        if another.__class__.__name__ != self.__class__.__name__:
-            raise TypeError('Another is not Vector')
-
-        if len(self) != len(another):
-            raise ValueError('Unequal length of vectors')
-
-        for i in xrange(len(self)):
-            self.data[i] -= another.data[i]
-
+        if isinstance(another, Expression):
+            return Expression.combine('sub', self, another).evaluate(self)
+        self._check(another)
+        _backend.sub(self.data, another._items(), self.data)
         return self
 
     def __mul__(self, number):
         """ overload * operator, multiplied by a number """
-        return Vector([self.data[i] * number for i in xrange(len(self))])
+        if _lazy:
+            return Expression.scaled('scale', self, number)
+        return Vector(_backend.scale(self.data, number))
 
     def __rmul__(self, number):
         """ overload * operator, multiplied by a number on the left """
@@ -111,14 +593,14 @@ class Vector:
 
     def __imul__(self, number):
         """ overload *= operator, multiplied by a number """
-        for i in xrange(len(self)):
-            self.data[i] *= number
-
+        _backend.scale(self.data, number, self.data)
         return self
 
     def __div__(self, number):
         """ overload / operator, multiplied by a number """
-        return Vector([self.data[i] / number for i in xrange(len(self))])
+        if _lazy:
+            return Expression.scaled('div', self, number)
+        return Vector(_backend.div(self.data, number))
 
     def __rdiv__(self, number):
         """ overload / operator, multiplied by a number on the left """
@@ -126,9 +608,7 @@ class Vector:
 
     def __idiv__(self, number):
         """ overload /= operator, multiplied by a number """
-        for i in xrange(len(self)):
-            self.data[i] /= number
-
+        _backend.div(self.data, number, self.data)
         return self
 
     def append(self, num):
@@ -141,16 +621,18 @@ class Vector:
 
     @classmethod
     def dot_prod(cls, one, another):
-        if one.__class__.__name__ != 'Vector' or one.__class__.__name__ != another.__class__.__name__:
+        one, another = _value(one), _value(another)
+        if (not isinstance(one, (Vector, VectorView))
+                or not isinstance(another, (Vector, VectorView))):
             raise TypeError('Type is not Vector')
 
         if len(one) != len(another):
             raise ValueError('Unequal length of vectors')
 
-        return sum(one.data[i] * another.data[i] for i in xrange(len(one)))
+        return _backend.dot(one._items(), another._items())
 
     def __copy__(self):
-        return Vector(copy.copy(self.data))
+        return Vector(_array(self.data)[:])
 
     def assign(self, vec):
         '''
@@ -159,50 +641,293 @@ class Vector:
         if len(self) != len(vec):
             raise ValueError('Unequal length of vectors')
 
-        for i in xrange(len(vec)):
-            self.data[i] = vec[i]
+        if isinstance(vec, Expression):
+            vec.evaluate(self)
+            return
+
+        src = vec._items() if isinstance(vec, (Vector, VectorView)) else vec
+        if not isinstance(src, array) or src.typecode != self.data.typecode:
+            src = array(self.data.typecode, src)
+
+        self.data[:] = src
+
+class VectorView(object):
+    """
+    A vector living inside the storage of a matrix, the i-th item is kept at
+    data[offset + i * stride].  Making a view copies nothing, and writes
+    through a view update the matrix it comes from.
+    """
+    __slots__ = ('data', 'offset', 'stride', 'length')
+
+    def __init__(self, data, offset, stride, length):
+        self.data = data
+        self.offset = offset
+        self.stride = stride
+        self.length = length
+
+    @property
+    def typecode(self):
+        return self.data.typecode
+
+    def _slice(self):
+        return slice(self.offset, self.offset + self.stride * self.length, self.stride)
+
+    def _items(self):
+        """ read the viewed items in one strided pass over the parent buffer """
+        items = self.data[self._slice()]
+        # slicing an arena view gives a list
+        return items if isinstance(items, array) else array(self.typecode, items)
+
+    def _index(self, key):
+        if key < 0:
+            key += self.length
+        if key < 0 or self.length <= key:
+            raise IndexError('view index out of range')
+        return self.offset + key * self.stride
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._items()[key]
+        return self.data[self._index(key)]
+
+    def __setitem__(self, key, value):
+        self.data[self._index(key)] = value
+        return self
+
+    def __eq__(self, other):
+        return self.equalTo(other, 0)
+
+    def __ne__(self, other):
+        return self.notEqualTo(other, 0)
+
+    def __str__(self):
+        return str(self.tolist())
+
+    def equalTo(self, other, threshold = 0):
+        return (len(self) == len(other)
+                and all(abs(x - y) <= threshold
+                    for x, y in izip(self._items(), other._items())))
+
+    def notEqualTo(self, other, threshold = 0):
+        return not self.equalTo(other, threshold)
+
+    def _check(self, another):
+        if not isinstance(another, (Vector, VectorView)):
+            raise TypeError('Another is not Vector')
+
+        if len(self) != len(another):
+            raise ValueError('Unequal length of vectors')
+
+    def __add__(self, another):
+        if _lazy or isinstance(another, Expression):
+            return Expression.combine('add', self, another)
+        return self.copy().__iadd__(another)
+
+    def __iadd__(self, another):
+        """ overload += operator, the parent storage is updated """
+        if isinstance(another, Expression):
+            return Expression.combine('add', self, another).evaluate(self)
+        self._check(another)
+        self.data[self._slice()] = _backend.add(self._items(), another._items())
+        return self
+
+    def __sub__(self, another):
+        if _lazy or isinstance(another, Expression):
+            return Expression.combine('sub', self, another)
+        return self.copy().__isub__(another)
+
+    def __isub__(self, another):
+        """ overload -= operator, the parent storage is updated """
+        if isinstance(another, Expression):
+            return Expression.combine('sub', self, another).evaluate(self)
+        self._check(another)
+        self.data[self._slice()] = _backend.sub(self._items(), another._items())
+        return self
+
+    def __mul__(self, number):
+        if _lazy:
+            return Expression.scaled('scale', self, number)
+        return self.copy().__imul__(number)
+
+    def __rmul__(self, number):
+        return self.__mul__(number)
+
+    def __imul__(self, number):
+        """ overload *= operator, the parent storage is updated """
+        self.data[self._slice()] = _backend.scale(self._items(), number)
+        return self
+
+    def __div__(self, number):
+        if _lazy:
+            return Expression.scaled('div', self, number)
+        return self.copy().__idiv__(number)
+
+    def __idiv__(self, number):
+        """ overload /= operator, the parent storage is updated """
+        self.data[self._slice()] = _backend.div(self._items(), number)
+        return self
+
+    def assign(self, vec):
+        """ write the values of vec into the viewed items """
+        if len(self) != len(vec):
+            raise ValueError('Unequal length of vectors')
+
+        if isinstance(vec, Expression):
+            vec.evaluate(self)
+            return
+
+        src = vec._items() if isinstance(vec, (Vector, VectorView)) else vec
+        if not isinstance(src, array) or src.typecode != self.data.typecode:
+            src = array(self.data.typecode, src)
+
+        self.data[self._slice()] = src
+
+    def tolist(self):
+        return self._items().tolist()
+
+    def copy(self):
+        """ detach the view into a new Vector """
+        return Vector(self._items())
+
+    def __copy__(self):
+        return self.copy()
+
+class SparseVector(object):
+    """
+    A vector of mostly zeros, stored as the sorted positions of its non-zero
+    items and their values. The products of naive_algebra taking one, vmul,
+    vaffine and ger, only touch the non-zero items; everywhere else it reads
+    as the dense vector.
+    """
+    __slots__ = ('length', 'indices', 'values')
+
+    def __init__(self, length, indices, values, typecode = None):
+        if len(indices) != len(values):
+            raise ValueError('Unequal numbers of positions and values')
+
+        self.length = length
+        self.indices = indices if isinstance(indices, array) and indices.typecode == 'i' \
+                else array('i', indices)
+        self.values = _buffer(values, typecode)
+
+    @classmethod
+    def fromDense(cls, data, typecode = None):
+        """ the sparse form of a vector or a sequence of numbers """
+        if isinstance(data, (Vector, VectorView)):
+            data = data._items()
+        indices = [i for (i, x) in enumerate(data) if x]
+        return SparseVector(len(data), indices,
+                array(typecode or getattr(data, 'typecode', DEFAULT_TYPECODE),
+                    [data[i] for i in indices]))
+
+    @property
+    def typecode(self):
+        return self.values.typecode
+
+    def __len__(self):
+        return self.length
+
+    def nnz(self):
+        """ the number of non-zero items """
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if key < 0:
+            key += self.length
+        if key < 0 or self.length <= key:
+            raise IndexError('vector index out of range')
+        pos = bisect_left(self.indices, key)
+        if pos < len(self.indices) and self.indices[pos] == key:
+            return self.values[pos]
+        return 0.0
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __str__(self):
+        return str(self.tolist())
+
+    def _items(self):
+        """ the dense array """
+        data = _zeros(self.length, self.values.typecode)
+        for (i, x) in izip(self.indices, self.values):
+            data[i] = x
+        return data
+
+    def tolist(self):
+        return self._items().tolist()
+
+    def todense(self):
+        return Vector(self._items())
 
 def dot_prod(one, another):
     return Vector.dot_prod(one, another)
 
-class Matrix:
+class Matrix(object):
     """
-    Matrix uses a single list as its internal structure
+    Matrix uses a single typed array as its internal structure, row by row.
     By default it will be initialized as a matrix full of zeros
     """
-    row_num = 0
-    col_num = 0
-    data = []
+    __slots__ = ('row_num', 'col_num', 'data')
 
-    def __init__(self, row_num, col_num, data = None, bycol = False):
+    def __init__(self, row_num, col_num, data = None, bycol = False, typecode = None):
         """
         """
         if bycol:
             raise NotImplementedError('init by row only for now')
 
         if data is None:
-            self.data = [ 0 for i in xrange(row_num * col_num) ] # use one line list to store
+            self.data = _zeros(row_num * col_num, typecode) # use one array to store
         else:
             if len(data) != row_num * col_num:
                 raise ValueError('input data does not fit the desired matrix')
 
-            self.data = data
+            self.data = _buffer(data, typecode)
 
         self.row_num = row_num
         self.col_num = col_num
 
     @classmethod
-    def fromRandom(cls, row_num, col_num):
+    def fromRandom(cls, row_num, col_num, typecode = None):
         """
         Generate a matrix with given column and row number,
         which is filled with all random floating numbers from [0, 1)
         """
+        return Matrix(row_num, col_num, array(typecode or DEFAULT_TYPECODE,
+                [random.random() for i in xrange(row_num * col_num) ]))
+
+    @classmethod
+    def fromIterable(self, row_num, col_num, dataiter, bycol = False, typecode = None):
         return Matrix(row_num, col_num,
-                [random.random() for i in xrange(row_num * col_num) ])
+                array(typecode or DEFAULT_TYPECODE, dataiter), bycol)
 
     @classmethod
-    def fromIterable(self, row_num, col_num, dataiter, bycol = False):
-        return Matrix(row_num, col_num, list(dataiter))
+    def fromRows(cls, rows, typecode = None):
+        """
+        Stack a non-empty sequence of vectors, or plain sequences of numbers,
+        of the same length into a matrix, one per row.
+        """
+        col_num = len(rows[0])
+        data = array(typecode or getattr(rows[0], 'typecode', DEFAULT_TYPECODE))
+        for row in rows:
+            if len(row) != col_num:
+                raise ValueError('Unequal length of rows')
+            items = row._items() if isinstance(row, (Vector, VectorView, SparseVector)) else row
+            if not isinstance(items, array) or items.typecode != data.typecode:
+                items = array(data.typecode, items)
+            data.extend(items)
+
+        return Matrix(len(rows), col_num, data)
+
+    @property
+    def typecode(self):
+        return self.data.typecode
 
     def __eq__(self, other):
         return self.equalTo(other, 0)
@@ -210,43 +935,55 @@ class Matrix:
     def __ne__(self, other):
         return self.notEqualTo(other, 0)
 
+    def __copy__(self):
+        return Matrix(self.row_num, self.col_num, _array(self.data)[:])
+
     def equalTo(self, other, threshold = 0):
         return (self.row_num == other.row_num and self.col_num == other.col_num
-                and all(abs(self.data[i] - other.data[i]) <= threshold
-                    for i in xrange(len(self.data))))
+                and all(abs(x - y) <= threshold
+                    for x, y in izip(self.data, other.data)))
 
     def notEqualTo(self, other, threshold = 0):
-        return (self.row_num != other.row_num or self.col_num != other.col_num
-                or any(abs(self.data[i] - other.data[i]) > threshold
-                    for i in xrange(len(self.data))))
-
-    def __add__(self, other):
-        return Matrix(self.row_num, self.col_num, data = list(
-            self.data[i] + other.data[i] for i in xrange(len(self.data))
-            ))
+        return not self.equalTo(other, threshold)
 
-    def __iadd__(self, other):
-        if self.row_num != other.row_num or other.col_num != other.col_num:
+    def _check(self, other):
+        if self.row_num != other.row_num or self.col_num != other.col_num:
             raise ValueError('two matrices are not in the same size')
 
-        for i in xrange(len(self.data)):
-            self.data[i] += other.data[i]
+    def __add__(self, other):
+        if _lazy or isinstance(other, Expression):
+            return Expression.combine('add', self, other)
+        self._check(other)
+        return Matrix(self.row_num, self.col_num, _backend.add(self.data, other.data))
 
+    def __iadd__(self, other):
+        if isinstance(other, Expression):
+            return Expression.combine('add', self, other).evaluate(self)
+        self._check(other)
+        _backend.add(self.data, other.data, self.data)
         return self
 
     def __sub__(self, other):
-        return Matrix(self.row_num, self.col_num, data = list(
-            self.data[i] - other.data[i] for i in xrange(len(self.data))
-            ))
+        if _lazy or isinstance(other, Expression):
+            return Expression.combine('sub', self, other)
+        self._check(other)
+        return Matrix(self.row_num, self.col_num, _backend.sub(self.data, other.data))
 
     def __isub__(self, other):
-        if self.row_num != other.row_num or other.col_num != other.col_num:
-            raise ValueError('two matrices are not in the same size')
+        if isinstance(other, Expression):
+            return Expression.combine('sub', self, other).evaluate(self)
+        self._check(other)
+        _backend.sub(self.data, other.data, self.data)
+        return self
 
-        for i in xrange(len(self.data)):
-            self.data[i] -= other.data[i]
+    def assign(self, other):
+        """ write the values of another matrix, or of an expression, into this one """
+        if isinstance(other, Expression):
+            other.evaluate(self)
+            return
 
-        return self
+        self._check(other)
+        _store(_buffer(_array(other.data), self.data.typecode), self.data)
 
     def item(self, row_id, col_id):
         if row_id < 0 or self.row_num <= row_id:
@@ -275,7 +1012,7 @@ class Matrix:
         if row_id < 0 or self.row_num <= row_id:
             raise ValueError('Not a valid row id')
 
-        return Vector.fromIterable(self.data[i] for i in xrange(row_id * self.col_num, (row_id + 1) * self.col_num))
+        return Vector(self.data[row_id * self.col_num:(row_id + 1) * self.col_num])
 
     def col(self, col_id):
         """
@@ -284,11 +1021,32 @@ class Matrix:
         if col_id < 0 or self.col_num <= col_id:
             raise ValueError('Not a valid col id')
 
-        return Vector.fromIterable(self.data[row_id * self.col_num + col_id] for row_id in xrange(self.row_num))
+        return Vector(self.data[col_id::self.col_num])
+
+    def row_view(self, row_id):
+        """
+        Return a view on the row, given a zero-based row id, nothing is copied
+        """
+        if row_id < 0 or self.row_num <= row_id:
+            raise ValueError('Not a valid row id')
+
+        return VectorView(self.data, row_id * self.col_num, 1, self.col_num)
+
+    def col_view(self, col_id):
+        """
+        Return a view on the column, given a zero-based column id, nothing
+        is copied
+        """
+        if col_id < 0 or self.col_num <= col_id:
+            raise ValueError('Not a valid col id')
+
+        return VectorView(self.data, col_id, self.col_num, self.row_num)
 
     def __mul__(self, number):
         """ overload * operator, multiplied by a number """
-        return Matrix(self.row_num, self.col_num, [x * number for x in self.data])
+        if _lazy:
+            return Expression.scaled('scale', self, number)
+        return Matrix(self.row_num, self.col_num, _backend.scale(self.data, number))
 
     def __rmul__(self, number):
         """ overload * operator, multiplied by a number """
@@ -296,14 +1054,14 @@ class Matrix:
 
     def __imul__(self, number):
         """ overload *= operator, multiplied by a number """
-        for i in self.col_num * self.row_num:
-            self.data[i] *= number
-
+        _backend.scale(self.data, number, self.data)
         return self
 
     def __div__(self, number):
         """ overload / operator, multiplied by a number """
-        return Matrix(self.row_num, self.col_num, [x / number for x in self.data])
+        if _lazy:
+            return Expression.scaled('div', self, number)
+        return Matrix(self.row_num, self.col_num, _backend.div(self.data, number))
 
     def __rdiv__(self, number):
         """ overload / operator, multiplied by a number """
@@ -311,39 +1069,539 @@ class Matrix:
 
     def __idiv__(self, number):
         """ overload /= operator, multiplied by a number """
-        for i in self.col_num * self.row_num:
-            self.data[i] /= number
-
+        _backend.div(self.data, number, self.data)
         return self
 
     @classmethod
-    def mul(cls, one, other):
+    def mul(cls, one, other, out = None):
+        """
+        Matrix product one * other, written into out if a matrix of the
+        right size is given, otherwise into a new matrix.
+        """
+        one, other = _value(one), _value(other)
         if one.__class__.__name__ != 'Matrix' or one.__class__.__name__ != other.__class__.__name__:
             raise TypeError('Both objects should be Matrix')
 
         if one.col_num != other.row_num:
             raise ValueError('Unequal column number and row number')
 
-        return Matrix(one.row_num, other.col_num,
-                list(dot_prod(one.row(row_id), other.col(col_id))
-                    for row_id in xrange(one.row_num)
-                    for col_id in xrange(other.col_num)))
+        out = _product_out(out, one, other, one.row_num, other.col_num)
+
+        _backend.gemm(one.data, one.row_num, one.col_num,
+                other.data, other.col_num, out.data)
+        return out
+
+    def transpose(self):
+        """
+        Return the transposed matrix as a new one
+        """
+        return Matrix(self.col_num, self.row_num,
+                _backend.transpose(self.data, self.row_num, self.col_num))
+
+def _product_out(out, one, other, row_num, col_num):
+    """ check or allocate the output matrix of a product """
+    if out is None:
+        return Matrix(row_num, col_num, typecode = one.data.typecode)
+
+    if out.row_num != row_num or out.col_num != col_num:
+        raise ValueError('output matrix does not fit the product')
+
+    if out is one or out is other:
+        raise ValueError('output matrix must not be an operand')
 
-def mmul(one, another):
-    return Matrix.mul(one, another)
+    return out
 
-def vmul(m, vec):
+def mmul(one, another, out = None):
+    return Matrix.mul(one, another, out)
+
+def mmul_tn(one, another, out = None):
+    """
+    Multiply the transpose of a matrix with another one, one^T * another.
     """
-    Multiply a matrix with a vector on the right, output a vector again
+    one, another = _value(one), _value(another)
+    if one.__class__.__name__ != 'Matrix' or one.__class__.__name__ != another.__class__.__name__:
+        raise TypeError('Both objects should be Matrix')
+
+    if one.row_num != another.row_num:
+        raise ValueError('Unequal row numbers')
+
+    out = _product_out(out, one, another, one.col_num, another.col_num)
+    _backend.gemm_tn(one.data, one.row_num, one.col_num,
+            another.data, another.col_num, out.data)
+    return out
+
+def mmul_nt(one, another, out = None):
     """
-    if m.__class__.__name__ != 'Matrix' or vec.__class__.__name__ != 'Vector':
+    Multiply a matrix with the transpose of another one, one * another^T.
+    Both operands are read row by row, so it's the cheapest product form.
+    """
+    one, another = _value(one), _value(another)
+    if one.__class__.__name__ != 'Matrix' or one.__class__.__name__ != another.__class__.__name__:
+        raise TypeError('Both objects should be Matrix')
+
+    if one.col_num != another.col_num:
+        raise ValueError('Unequal column numbers')
+
+    out = _product_out(out, one, another, one.row_num, another.row_num)
+    _backend.gemm_nt(one.data, one.row_num, one.col_num,
+            another.data, another.row_num, out.data)
+    return out
+
+def vmul(m, vec, out = None):
+    """
+    Multiply a matrix with a vector on the right, output a vector again,
+    which is written into out if given.
+    """
+    if m.__class__.__name__ != 'Matrix' or not isinstance(vec,
+            (Vector, VectorView, SparseVector, Expression)):
         raise TypeError('Matrix and Vector is required to do multiplication')
 
     if m.col_num != len(vec):
         raise ValueError('Unequal column number and vector length')
 
-    return Vector.fromIterable(dot_prod(m.row(row_id), vec)
-            for row_id in xrange(m.row_num))
+    if out is None and (_lazy or isinstance(vec, Expression)):
+        return Expression('vmul', (m, vec), m.row_num, None, m.data.typecode)
+
+    if out is None:
+        out = Vector.fromZeros(m.row_num, m.data.typecode)
+    elif len(out) != m.row_num:
+        raise ValueError('output vector does not fit the product')
+
+    if isinstance(vec, SparseVector):
+        _backend.gemv_sparse(m.data, m.row_num, m.col_num, vec.indices, vec.values, out.data)
+    else:
+        _backend.gemv(m.data, m.row_num, m.col_num, vec._items(), out.data)
+    return out
+
+def vmul_transposed(m, vec, out = None):
+    """
+    Multiply the transpose of a matrix with a vector, m^T * vec, without
+    building the transpose, written into out if given.
+    """
+    m, vec = _value(m), _value(vec)
+    if m.__class__.__name__ != 'Matrix' or not isinstance(vec, (Vector, VectorView)):
+        raise TypeError('Matrix and Vector is required to do multiplication')
+
+    if m.row_num != len(vec):
+        raise ValueError('Unequal row number and vector length')
+
+    if out is None:
+        out = Vector.fromZeros(m.col_num, m.data.typecode)
+    elif len(out) != m.col_num:
+        raise ValueError('output vector does not fit the product')
+
+    _backend.gemv_t(m.data, m.row_num, m.col_num, vec._items(), out.data)
+    return out
+
+def ger(alpha, u, v, m):
+    """
+    Rank-1 update of a matrix in place, m += alpha * u * v^T, thus
+    W -= eta * u v^T is ger(-eta, u, v, W). Returns m.
+    """
+    u, v = _value(u), _value(v)
+    if m.__class__.__name__ != 'Matrix':
+        raise TypeError('Matrix is required to do the update')
+
+    if m.row_num != len(u) or m.col_num != len(v):
+        raise ValueError('Vectors do not fit the matrix')
+
+    if isinstance(v, SparseVector):
+        _backend.ger_sparse(alpha, u._items(), v.indices, v.values, m.data, m.col_num)
+    else:
+        _backend.ger(alpha, u._items(), v._items(), m.data)
+    return m
+
+def _vector_out(out, length, typecode):
+    if out is None:
+        return Vector.fromZeros(length, typecode)
+
+    if len(out) != length:
+        raise ValueError('output vector does not fit the result')
+
+    return out
+
+def vaffine(m, vec, bias, scale = 1.0, activation = None, out = None):
+    """
+    Fused activation((m * vec + bias) * scale), computed in one pass and
+    written into out if given. The activation is given by name, None for
+    the identity.
+    """
+    vec, bias = _value(vec), _value(bias)
+    if m.col_num != len(vec) or m.row_num != len(bias):
+        raise ValueError('Matrix, vector and bias do not fit')
+
+    out = _vector_out(out, m.row_num, m.data.typecode)
+    if isinstance(vec, SparseVector):
+        _backend.affine_sparse(m.data, m.row_num, m.col_num, vec.indices, vec.values,
+                bias._items(), scale, activation, out.data)
+    else:
+        _backend.affine(m.data, m.row_num, m.col_num, vec._items(), bias._items(),
+                scale, activation, out.data)
+    return out
+
+def maffine_nt(inputs, m, bias, scale = 1.0, activation = None, out = None):
+    """
+    Fused activation((inputs * m^T + bias) * scale) for a batch of inputs,
+    one per row, the bias being added to every row.
+    """
+    inputs, bias = _value(inputs), _value(bias)
+    if inputs.col_num != m.col_num or m.row_num != len(bias):
+        raise ValueError('Inputs, matrix and bias do not fit')
+
+    out = _product_out(out, inputs, m, inputs.row_num, m.row_num)
+    _backend.affine_nt(inputs.data, inputs.row_num, inputs.col_num,
+            m.data, m.row_num, bias._items(), scale, activation, out.data)
+    return out
+
+def activate_grad(activation, partial, output, scale = 1.0, out = None):
+    """
+    Back-propagate through an element-wise activation: the partial of its
+    output times the derivative, expressed with the output, times scale.
+    Works on two vectors or two matrices of the same size.
+    """
+    if len(partial.data) != len(output.data):
+        raise ValueError('Unequal sizes')
+
+    if isinstance(output, Matrix):
+        if out is None:
+            out = Matrix(output.row_num, output.col_num, typecode = output.data.typecode)
+    else:
+        out = _vector_out(out, len(output), output.typecode)
+    _backend.activate_grad(activation, partial.data, output.data, scale, out.data)
+    return out
+
+def axpy(alpha, x, y):
+    """
+    y += alpha * x in place, for two vectors or two matrices of the same
+    size, W -= eta * G being axpy(-eta, G, W).
+    """
+    x = _value(x)
+    if len(x.data) != len(y.data):
+        raise ValueError('Unequal sizes')
+
+    _backend.axpy(alpha, x.data, y.data)
+    return y
+
+def outer(u, v, out = None):
+    """
+    The outer product u * v^T of two vectors, a len(u) by len(v) matrix,
+    written into out if given.
+    """
+    u, v = _value(u), _value(v)
+    if out is None:
+        out = Matrix(len(u), len(v), typecode = u.typecode)
+    elif out.row_num != len(u) or out.col_num != len(v):
+        raise ValueError('output matrix does not fit the product')
+
+    _backend.outer(u._items(), v._items(), out.data)
+    return out
+
+def activate(activation, v, out = None):
+    """
+    The named element-wise activation of a vector or a matrix, written
+    into out if given.
+    """
+    if out is None and (_lazy or isinstance(v, Expression)):
+        row_num, col_num = _shape(v)
+        return Expression('activate', (activation, v), row_num, col_num, v.typecode)
+
+    if isinstance(v, Expression):
+        v = v.evaluate()
+    if isinstance(v, Matrix):
+        if out is None:
+            out = Matrix(v.row_num, v.col_num, typecode = v.typecode)
+        elif (out.row_num, out.col_num) != (v.row_num, v.col_num):
+            raise ValueError('output matrix does not fit the result')
+        _backend.activate(activation, v.data, out.data)
+        return out
+
+    if isinstance(out, VectorView):
+        out.assign(_backend.activate(activation, v._items()))
+        return out
+    out = _vector_out(out, len(v), v.typecode)
+    _backend.activate(activation, v._items(), out.data)
+    return out
+
+# Lazy mode, off by default, see set_lazy.
+_lazy = False
+
+def set_lazy(enabled):
+    """
+    Turn the lazy mode on or off, returns the previous mode. In lazy mode
+    the +, - and * / by a number of Vector, VectorView and Matrix, vmul and
+    activate build an Expression instead of computing their result.
+    """
+    global _lazy
+    previous = _lazy
+    _lazy = bool(enabled)
+    return previous
+
+@contextmanager
+def lazy(enabled = True):
+    """ run a block in lazy mode, or not, and restore the previous mode """
+    previous = set_lazy(enabled)
+    try:
+        yield
+    finally:
+        set_lazy(previous)
+
+def _shape(x):
+    """ (row_num, col_num) of a matrix, (length, None) of a vector """
+    if isinstance(x, (Matrix, Expression)):
+        return (x.row_num, x.col_num)
+    return (len(x), None)
+
+def _items(x):
+    """ the flat buffer of the items of a vector, a matrix or an expression """
+    return x._items() if isinstance(x, VectorView) else x.data
+
+def _value(x):
+    """ x, or its value if it's an expression, for the functions reading operands eagerly """
+    return x.evaluate() if isinstance(x, Expression) else x
+
+def _shares(out, x):
+    """ whether writing into out may change x before it's read """
+    return x is out or (not isinstance(x, Expression) and getattr(x, 'data', None) is out.data)
+
+class Expression(object):
+    """
+    A vector or matrix expression, not computed yet. The operators build
+    it in lazy mode, and it's evaluated as a whole when its value is
+    needed: by evaluate, by assign, by an in-place operator, by iterating
+    over it, or by passing it to a function that is not lazy. Nothing is
+    cached, every read computes it again from the current operands, thus
+    it can't be indexed, index its evaluate() instead. The whole tree runs
+    in as few fused passes as it takes: activation((vmul(m, x) + b) * scale) as one affine kernel,
+    y + x * alpha written into y as one axpy, and any other tree of
+    element-wise operations as a single loop without temporaries.
+
+        with lazy():
+            layer.output.assign(activate('tanh', vmul(weight, x) + bias))
+            weight -= partial_weight * eta
+    """
+    __slots__ = ('op', 'args', 'row_num', 'col_num', 'typecode')
+
+    def __init__(self, op, args, row_num, col_num, typecode):
+        self.op = op
+        self.args = args
+        self.row_num = row_num
+        self.col_num = col_num
+        self.typecode = typecode
+
+    @classmethod
+    def combine(cls, op, one, another):
+        """ the element-wise 'add' or 'sub' of two operands of the same shape """
+        if not isinstance(another, (Vector, VectorView, Matrix, Expression)):
+            raise TypeError('Another is not Vector nor Matrix')
+
+        if _shape(one) != _shape(another):
+            raise ValueError('Operands are not in the same size')
+
+        row_num, col_num = _shape(one)
+        return cls(op, (one, another), row_num, col_num, one.typecode)
+
+    @classmethod
+    def scaled(cls, op, one, number):
+        """ one multiplied, op 'scale', or divided, op 'div', by a number """
+        row_num, col_num = _shape(one)
+        return cls(op, (one, number), row_num, col_num, one.typecode)
+
+    def __add__(self, another):
+        return Expression.combine('add', self, another)
+
+    def __sub__(self, another):
+        return Expression.combine('sub', self, another)
+
+    def __mul__(self, number):
+        return Expression.scaled('scale', self, number)
+
+    def __rmul__(self, number):
+        return self.__mul__(number)
+
+    def __div__(self, number):
+        return Expression.scaled('div', self, number)
+
+    def __len__(self):
+        return self.row_num if self.col_num is None else self.row_num * self.col_num
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __getitem__(self, key):
+        # every item would evaluate the whole tree again
+        raise TypeError('an expression is not indexable, index its evaluate()')
+
+    def __eq__(self, other):
+        return self.evaluate() == other
+
+    def __ne__(self, other):
+        return self.evaluate() != other
+
+    def __str__(self):
+        return str(self.evaluate())
+
+    def equalTo(self, other, threshold = 0):
+        return self.evaluate().equalTo(other, threshold)
+
+    def notEqualTo(self, other, threshold = 0):
+        return not self.equalTo(other, threshold)
+
+    def _items(self):
+        return self.evaluate().data
+
+    @property
+    def data(self):
+        return self.evaluate().data
+
+    def tolist(self):
+        return self._items().tolist()
+
+    def evaluate(self, out = None):
+        """
+        The value of the expression, as a new Vector or Matrix, or written
+        into out, a vector or matrix of the same shape, which is returned.
+        """
+        if out is None:
+            return self._evaluate(None)
+
+        if _shape(out) != (self.row_num, self.col_num):
+            raise ValueError('output does not fit the expression')
+
+        if isinstance(out, VectorView):
+            out.assign(self._evaluate(None))
+            return out
+        return self._evaluate(out)
+
+    def _evaluate(self, out):
+        # the products and kernels called here must compute, not build
+        # expressions again
+        with lazy(False):
+            result = self._affine(out)
+            if result is None:
+                result = self._axpy(out)
+            if result is None:
+                result = self._elementwise(out)
+        return result
+
+    def _affine(self, out):
+        """ activation((vmul(m, x) + b) * scale) as one affine kernel, or None """
+        node, activation, scale = self, None, 1.0
+        if node.op == 'activate':
+            activation, node = node.args
+            if not isinstance(node, Expression):
+                return None
+        if node.op == 'scale' and isinstance(node.args[0], Expression):
+            node, scale = node.args
+
+        if node.op == 'vmul':
+            (m, vec), bias = node.args, None
+        elif node.op == 'add':
+            for (product, bias) in (node.args, node.args[::-1]):
+                if isinstance(product, Expression) and product.op == 'vmul':
+                    m, vec = product.args
+                    break
+            else:
+                return None
+        else:
+            return None
+
+        vec = vec.evaluate() if isinstance(vec, Expression) else vec
+        if bias is None and scale == 1.0 and activation is None:
+            product = lambda out: vmul(m, vec, out)
+        else:
+            if bias is None:
+                bias = Vector.fromZeros(m.row_num, m.data.typecode)
+            elif isinstance(bias, Expression):
+                bias = bias.evaluate()
+            product = lambda out: vaffine(m, vec, bias, scale, activation, out)
+
+        if out is not None and (_shares(out, vec) or (bias is not None and _shares(out, bias))):
+            out.assign(product(None))
+            return out
+        return product(out)
+
+    def _axpy(self, out):
+        """ out + x * alpha, or out - x * alpha, written into out as one axpy, or None """
+        if out is None or self.op not in ('add', 'sub'):
+            return None
+
+        one, another = self.args
+        if another is out and self.op == 'add':
+            one, another = another, one
+        if one is not out:
+            return None
+
+        alpha = 1.0
+        if isinstance(another, Expression):
+            if another.op != 'scale' or isinstance(another.args[0], Expression):
+                return None
+            another, alpha = another.args
+        _backend.axpy(alpha if self.op == 'add' else -alpha, _items(another), out.data)
+        return out
+
+    def _elementwise(self, out):
+        """ any other tree of element-wise operations, in a single pass """
+        leaves, constants = [], []
+        def flatten(node):
+            if not isinstance(node, Expression) or node.op in ('vmul', 'activate'):
+                # a leaf, the same operand being read once
+                for (i, leaf) in enumerate(leaves):
+                    if leaf is node:
+                        return i
+                leaves.append(node)
+                return len(leaves) - 1
+
+            one, another = node.args
+            if node.op in ('add', 'sub'):
+                return (node.op, flatten(one), flatten(another))
+            constants.append(another)
+            position = len(constants) - 1
+            return (node.op, flatten(one), position)
+
+        node, activation = self, None
+        if node.op == 'activate':
+            activation, node = node.args
+        program = flatten(node)
+        buffers = [_items(leaf) for leaf in leaves]
+
+        target = None if out is None else out.data
+        if program == 0:
+            result = _backend.activate(activation, buffers[0], target)
+        else:
+            result = _backend.elementwise(program, buffers, constants, activation, target)
+        if out is not None:
+            return out
+        if self.col_num is None:
+            return Vector(result)
+        return Matrix(self.row_num, self.col_num, result)
+
+def check_views(typecode = 'd'):
+    """
+    In-place arithmetic on row and column views of a matrix stored in an
+    arena view must write through to the arena. Raise AssertionError on
+    the first mismatch.
+    """
+    arena = array(typecode, xrange(16))
+    weight = Matrix(3, 4, arena_view(arena, 2, 12))
+    expected = Matrix(3, 4, arena[2:14])
+
+    row = weight.row_view(1)
+    row *= 2.0
+    row /= 4.0
+    col = weight.col_view(2)
+    col += Vector.fromList([1, 2, 3], typecode)
+    col -= Vector.fromList([0.5, 0.5, 0.5], typecode)
+    for c in xrange(expected.col_num):
+        expected.set(1, c, expected.item(1, c) * 2.0 / 4.0)
+    for r in xrange(expected.row_num):
+        expected.set(r, 2, expected.item(r, 2) + (r + 1) - 0.5)
+
+    if not weight.equalTo(expected, 1e-6):
+        raise AssertionError('view arithmetic did not write through the matrix')
+    if (arena[2:14] != _array(weight.data)
+            or arena[:2] + arena[14:] != array(typecode, [0, 1, 14, 15])):
+        raise AssertionError('view arithmetic did not reach the arena')
+    print "%-10s ok" % ('views ' + typecode)
 
 if __name__ == "__main__":
     v = Vector([1, 2, 3])
@@ -389,6 +1647,9 @@ if __name__ == "__main__":
     print m.row(1).data
     print m.col(1).data
 
+    check_views('d')
+    check_views('f')
+
     print "mmul"
     m = Matrix(3, 3, data = [1, 2, 3, 4, 5, 6, 7, 8, 9])
     m2 = Matrix(3, 2, data = [1, 2, 2, 1, 2, 1])
@@ -425,5 +1686,15 @@ if __name__ == "__main__":
     m -= m2
     print m.data
 
-
-
+    print "lazy"
+    v = Vector([1, 2])
+    m = Matrix(2, 2, data = [1, 2, 3, 4])
+    b = Vector([1, 20])
+    with lazy():
+        e = v + v
+        print dot_prod(e, v), mmul(m * 2, m).data
+        print vmul(m, v).evaluate(), dot_prod(vmul(m, v), v)
+        print activate('relu', vmul(m, v) * 2 - b), v - vmul(m, v) * 0.5
+        print vmul(m, v).evaluate()[0], max(vmul(m, v))
+        v[0] = 3
+        print e
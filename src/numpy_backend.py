@@ -0,0 +1,387 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Compute backend of naive_algebra built on NumPy.
+
+The typed arrays of Vector and Matrix are wrapped with numpy.frombuffer, so
+the kernels run vectorized over the very same memory without any copy.
+Select it with naive_algebra.set_backend('numpy'), or by setting the
+environment variable NAIVE_ALGEBRA_BACKEND=numpy.
+
+Running this file checks the kernels against the pure python backend.
+"""
+
+import numpy
+from naive_algebra import _zeros, SIGMOID_LUT, SIGMOID_LUT_RANGE, SIGMOID_LUT_STEPS
+
+# int8 for the weights of quantized models
+DTYPES = {'d': numpy.float64, 'f': numpy.float32, 'b': numpy.int8}
+
+def _view(buf, row_num = None, col_num = None):
+    """ a numpy array sharing the memory of buf, a matrix if shape is given """
+    v = numpy.frombuffer(buf, dtype = DTYPES[buf.typecode])
+    if row_num is not None:
+        v = v.reshape(row_num, col_num)
+    return v
+
+def _indices(indices):
+    """ the positions of a SparseVector as a numpy index array """
+    return numpy.frombuffer(indices, dtype = numpy.intc)
+
+def _out(out, length, like):
+    return _zeros(length, like.typecode) if out is None else out
+
+class NumpyBackend(object):
+    """
+    Vectorized backend, with the same kernels as naive_algebra.PythonBackend.
+    """
+    name = 'numpy'
+
+    def add(self, a, b, out = None):
+        out = _out(out, len(a), a)
+        numpy.add(_view(a), _view(b), out = _view(out))
+        return out
+
+    def sub(self, a, b, out = None):
+        out = _out(out, len(a), a)
+        numpy.subtract(_view(a), _view(b), out = _view(out))
+        return out
+
+    def scale(self, a, number, out = None):
+        out = _out(out, len(a), a)
+        numpy.multiply(_view(a), number, out = _view(out))
+        return out
+
+    def div(self, a, number, out = None):
+        out = _out(out, len(a), a)
+        numpy.true_divide(_view(a), number, out = _view(out))
+        return out
+
+    def dot(self, a, b):
+        return float(numpy.dot(_view(a), _view(b)))
+
+    def gemv(self, a, row_num, col_num, x, out = None):
+        out = _out(out, row_num, a)
+        _view(out)[:] = numpy.dot(_view(a, row_num, col_num), _view(x))
+        return out
+
+    def gemv_t(self, a, row_num, col_num, x, out = None):
+        out = _out(out, col_num, a)
+        numpy.dot(_view(x), _view(a, row_num, col_num), out = _view(out))
+        return out
+
+    def ger(self, alpha, u, v, a):
+        m = _view(a, len(u), len(v))
+        m += numpy.outer(alpha * _view(u), _view(v))
+        return a
+
+    def gemm(self, a, row_num, inner_num, b, col_num, out = None):
+        out = _out(out, row_num * col_num, a)
+        _view(out, row_num, col_num)[:] = numpy.dot(
+                _view(a, row_num, inner_num), _view(b, inner_num, col_num))
+        return out
+
+    def gemm_nt(self, a, row_num, inner_num, b, col_num, out = None):
+        out = _out(out, row_num * col_num, a)
+        _view(out, row_num, col_num)[:] = numpy.dot(
+                _view(a, row_num, inner_num), _view(b, col_num, inner_num).T)
+        return out
+
+    def transpose(self, a, row_num, col_num, out = None):
+        out = _out(out, row_num * col_num, a)
+        _view(out, col_num, row_num)[:] = _view(a, row_num, col_num).T
+        return out
+
+    def sigmoid(self, a, out = None):
+        return self.activate('sigmoid', a, out)
+
+    def activate(self, activation, a, out = None):
+        out = _out(out, len(a), a)
+        v = _view(out)
+        if out is not a:
+            v[:] = _view(a)
+        NUMPY_ACTIVATIONS[activation][0](v)
+        return out
+
+    def activate_grad(self, activation, partial, output, scale, out = None):
+        out = _out(out, len(output), output)
+        NUMPY_ACTIVATIONS[activation][1](_view(partial), _view(output), scale, _view(out))
+        return out
+
+    def affine(self, a, row_num, col_num, x, b, scale, activation, out = None):
+        out = _out(out, row_num, a)
+        v = _view(out)
+        numpy.dot(_view(a, row_num, col_num), _view(x), out = v)
+        v += _view(b)
+        v *= scale
+        NUMPY_ACTIVATIONS[activation][0](v)
+        return out
+
+    def affine_nt(self, a, row_num, inner_num, w, col_num, b, scale, activation, out = None):
+        out = _out(out, row_num * col_num, a)
+        v = _view(out, row_num, col_num)
+        numpy.dot(_view(a, row_num, inner_num), _view(w, col_num, inner_num).T, out = v)
+        v += _view(b)
+        v *= scale
+        NUMPY_ACTIVATIONS[activation][0](v)
+        return out
+
+    def axpy(self, alpha, x, y):
+        v = _view(y)
+        v += alpha * _view(x)
+        return y
+
+    def outer(self, u, v, out = None):
+        out = _out(out, len(u) * len(v), u)
+        numpy.outer(_view(u), _view(v), out = _view(out, len(u), len(v)))
+        return out
+
+    def gemm_tn(self, a, row_num, a_col_num, b, b_col_num, out = None):
+        out = _out(out, a_col_num * b_col_num, a)
+        _view(out, a_col_num, b_col_num)[:] = numpy.dot(
+                _view(a, row_num, a_col_num).T, _view(b, row_num, b_col_num))
+        return out
+
+    def gemv_sparse(self, a, row_num, col_num, indices, values, out = None):
+        out = _out(out, row_num, a)
+        numpy.dot(_view(a, row_num, col_num)[:, _indices(indices)], _view(values),
+                out = _view(out))
+        return out
+
+    def affine_sparse(self, a, row_num, col_num, indices, values, b, scale, activation, out = None):
+        out = self.gemv_sparse(a, row_num, col_num, indices, values, out)
+        v = _view(out)
+        v += _view(b)
+        v *= scale
+        NUMPY_ACTIVATIONS[activation][0](v)
+        return out
+
+    def ger_sparse(self, alpha, u, indices, values, a, col_num):
+        m = _view(a, len(u), col_num)
+        columns = _indices(indices)
+        # the positions are unique, thus the fancy indexed update is safe
+        m[:, columns] += numpy.outer(alpha * _view(u), _view(values))
+        return a
+
+    def momentum(self, p, g, v, scale, rate, mu, nesterov):
+        grad, velocity = _view(g) * scale, _view(v)
+        velocity *= mu
+        velocity += grad
+        if nesterov:
+            grad += mu * velocity
+            _view(p)[:] -= rate * grad
+        else:
+            _view(p)[:] -= rate * velocity
+        return p
+
+    def adam(self, p, g, m, v, scale, rate, beta1, beta2, epsilon, step):
+        grad, moments, squares = _view(g) * scale, _view(m), _view(v)
+        moments *= beta1
+        moments += (1 - beta1) * grad
+        squares *= beta2
+        grad *= grad
+        squares += (1 - beta2) * grad
+        c1, c2 = 1 - beta1 ** step, 1 - beta2 ** step
+        _view(p)[:] -= rate * (moments / c1) / (numpy.sqrt(squares / c2) + epsilon)
+        return p
+
+    def elementwise(self, program, leaves, constants, activation, out = None):
+        out = _out(out, len(leaves[0]), leaves[0])
+        views = [_view(leaf) for leaf in leaves]
+        def run(node):
+            if isinstance(node, int):
+                return views[node]
+            op, left, right = node
+            if op == 'add':
+                return run(left) + run(right)
+            if op == 'sub':
+                return run(left) - run(right)
+            if op == 'scale':
+                return run(left) * constants[right]
+            return run(left) / constants[right]
+
+        v = _view(out)
+        v[:] = run(program)
+        NUMPY_ACTIVATIONS[activation][0](v)
+        return out
+
+    def col_sums(self, a, row_num, col_num, out = None):
+        out = _out(out, col_num, a)
+        _view(a, row_num, col_num).sum(axis = 0, out = _view(out))
+        return out
+
+def _sigmoid(v):
+    """
+    The sigmoid of v, in place. It's computed from e = exp(-|v|), which
+    never overflows, as 1 / (1 + e) for v >= 0 and e / (1 + e) otherwise.
+    """
+    numerator = numpy.where(v >= 0, 1.0, 0.0).astype(v.dtype)
+    numpy.absolute(v, out = v)
+    numpy.negative(v, out = v)
+    numpy.exp(v, out = v)
+    numpy.maximum(numerator, v, out = numerator)
+    v += 1
+    numpy.divide(numerator, v, out = v)
+
+def _sigmoid_grad(partial, output, scale, out):
+    numpy.multiply(partial, output, out = out)
+    out *= 1 - output
+    out *= scale
+
+_lut = {}
+
+def _sigmoid_lut(v):
+    """ the sigmoid of v read from naive_algebra.SIGMOID_LUT, in place """
+    table = _lut.get(v.dtype)
+    if table is None:
+        table = _lut[v.dtype] = numpy.array(SIGMOID_LUT, dtype = v.dtype)
+    v *= SIGMOID_LUT_STEPS
+    v += SIGMOID_LUT_RANGE * SIGMOID_LUT_STEPS
+    numpy.clip(v, 0, len(table) - 1, out = v)
+    numpy.take(table, v.astype(numpy.intp), out = v)
+
+def _tanh_grad(partial, output, scale, out):
+    numpy.multiply(output, output, out = out)
+    numpy.subtract(1, out, out = out)
+    out *= partial
+    out *= scale
+
+def _relu_grad(partial, output, scale, out):
+    numpy.multiply(partial, output > 0, out = out)
+    out *= scale
+
+def _identity_grad(partial, output, scale, out):
+    numpy.multiply(partial, scale, out = out)
+
+# in place versions of naive_algebra.PYTHON_ACTIVATIONS
+NUMPY_ACTIVATIONS = {
+        None: (lambda v: None, _identity_grad),
+        'sigmoid': (_sigmoid, _sigmoid_grad),
+        'sigmoid_lut': (_sigmoid_lut, _sigmoid_grad),
+        'tanh': (lambda v: numpy.tanh(v, out = v), _tanh_grad),
+        'relu': (lambda v: numpy.maximum(v, 0, out = v), _relu_grad),
+        }
+
+def check_parity(threshold = 1e-9, seed = 1):
+    """
+    Run every kernel of both backends on the same random operands and
+    compare the results, raise AssertionError on the first mismatch.
+    """
+    import random
+    from array import array
+    from naive_algebra import PythonBackend
+
+    rnd = random.Random(seed)
+    def rand(length):
+        return array('d', [rnd.uniform(-3, 3) for i in xrange(length)])
+
+    ref, vec = PythonBackend(), NumpyBackend()
+    def same(name, x, y):
+        if isinstance(x, float):
+            x, y = [x], [y]
+        if len(x) != len(y) or any(abs(p - q) > threshold for p, q in zip(x, y)):
+            raise AssertionError('%s differs between backends' % name)
+        print '%-10s ok' % name
+
+    for (n, k, m) in [(1, 1, 1), (3, 5, 2), (10, 784, 10), (70, 33, 65)]:
+        a, b, bt, x = rand(n * k), rand(k * m), rand(m * k), rand(k)
+        same('gemm', ref.gemm(a, n, k, b, m), vec.gemm(a, n, k, b, m))
+        same('gemm_nt', ref.gemm_nt(a, n, k, bt, m), vec.gemm_nt(a, n, k, bt, m))
+        same('gemv', ref.gemv(a, n, k, x), vec.gemv(a, n, k, x))
+        u = rand(n)
+        same('gemv_t', ref.gemv_t(a, n, k, u), vec.gemv_t(a, n, k, u))
+        same('ger', ref.ger(-0.5, u, x, a[:]), vec.ger(-0.5, u, x, a[:]))
+        same('transpose', ref.transpose(a, n, k), vec.transpose(a, n, k))
+
+        w, bias, y = rand(m * k), rand(m), rand(n * m)
+        same('gemm_tn', ref.gemm_tn(a, n, k, y, m), vec.gemm_tn(a, n, k, y, m))
+        same('affine', ref.affine(bt, m, k, x, bias, 0.5, 'sigmoid'),
+                vec.affine(bt, m, k, x, bias, 0.5, 'sigmoid'))
+        same('affine_nt', ref.affine_nt(a, n, k, w, m, bias, 0.5, 'sigmoid'),
+                vec.affine_nt(a, n, k, w, m, bias, 0.5, 'sigmoid'))
+        same('col_sums', ref.col_sums(a, n, k), vec.col_sums(a, n, k))
+        same('outer', ref.outer(x, bias), vec.outer(x, bias))
+        for nnz in sorted(set([0, 1, k // 3])):
+            idx = array('i', sorted(rnd.sample(xrange(k), nnz)))
+            vals = rand(nnz)
+            same('gemv_sp', ref.gemv_sparse(a, n, k, idx, vals),
+                    vec.gemv_sparse(a, n, k, idx, vals))
+            same('affine_sp', ref.affine_sparse(a, n, k, idx, vals, u, 0.5, 'tanh'),
+                    vec.affine_sparse(a, n, k, idx, vals, u, 0.5, 'tanh'))
+            same('ger_sp', ref.ger_sparse(-0.5, u, idx, vals, a[:], k),
+                    vec.ger_sparse(-0.5, u, idx, vals, a[:], k))
+
+    a, b = rand(100), rand(100)
+    same('add', ref.add(a, b), vec.add(a, b))
+    same('sub', ref.sub(a, b), vec.sub(a, b))
+    same('scale', ref.scale(a, 0.3), vec.scale(a, 0.3))
+    same('div', ref.div(a, 7.0), vec.div(a, 7.0))
+    same('dot', ref.dot(a, b), vec.dot(a, b))
+    same('sigmoid', ref.sigmoid(a), vec.sigmoid(a))
+
+    for activation in (None, 'sigmoid', 'sigmoid_lut', 'tanh', 'relu'):
+        same('activate', ref.activate(activation, a), vec.activate(activation, a))
+        same('act_grad', ref.activate_grad(activation, a, b, 0.1),
+                vec.activate_grad(activation, a, b, 0.1))
+
+    c = rand(100)
+    program = ('sub', ('add', 0, ('scale', 1, 0)), ('div', ('sub', 2, 0), 1))
+    for activation in (None, 'tanh'):
+        same('elementwise', ref.elementwise(program, [a, b, c], [0.5, 3.0], activation),
+                vec.elementwise(program, [a, b, c], [0.5, 3.0], activation))
+
+    out = a[:]
+    vec.add(out, b, out)
+    same('add(out)', ref.add(a, b), out)
+
+    out = b[:]
+    vec.axpy(-0.5, a, out)
+    same('axpy', ref.axpy(-0.5, a, b[:]), out)
+
+    velocity = rand(100)
+    for nesterov in (False, True):
+        states = [(a[:], velocity[:]) for backend in (ref, vec)]
+        for ((p, v), backend) in zip(states, (ref, vec)):
+            for step in xrange(3):
+                backend.momentum(p, b, v, 0.5, 0.1, 0.9, nesterov)
+        same('momentum', states[0][0], states[1][0])
+        same('velocity', states[0][1], states[1][1])
+
+    moments, squares = rand(100), array('d', [x * x for x in b])
+    states = [(a[:], moments[:], squares[:]) for backend in (ref, vec)]
+    for ((p, m, v), backend) in zip(states, (ref, vec)):
+        for step in xrange(1, 4):
+            backend.adam(p, b, m, v, 0.5, 0.01, 0.9, 0.999, 1e-8, step)
+    same('adam', states[0][0], states[1][0])
+    same('adam_m', states[0][1], states[1][1])
+    same('adam_v', states[0][2], states[1][2])
+
+def check_network_parity(threshold = 1e-9):
+    """
+    Train the same small network on both backends and compare the weights.
+    """
+    import random
+    import naive_algebra
+    from naive_algebra import Vector
+    from feedforward_network import FeedForwardNetwork
+
+    samples = [(Vector.fromRandom(20), Vector.fromList([1, 0, 0])) for i in xrange(30)]
+    weights = []
+    for name in ('python', 'numpy'):
+        previous = naive_algebra.set_backend(name)
+        random.seed(7)
+        network = FeedForwardNetwork([20, 8, 3], eta = 0.5)
+        network.train(iter(samples), None, limit = 10)
+        network.train(iter(samples), None, limit = 30, batch_size = 4)
+        weights.append([layer.weight for layer in network.layers[:-1]])
+        naive_algebra.set_backend(previous)
+
+    for (w1, w2) in zip(*weights):
+        if not w1.equalTo(w2, threshold):
+            raise AssertionError('network weights differ between backends')
+    print '%-10s ok' % 'network'
+
+if __name__ == '__main__':
+    check_parity()
+    check_network_parity()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Optimizers of FeedForwardNetwork, the rule turning gradients into a
+parameter update, decoupled from how the gradients are computed.
+
+An optimizer works on the parameter and gradient arenas of the network as
+two flat buffers. Its state, the velocity of momentum or the moment
+estimates of Adam, is kept in buffers of the same layout, updated in place
+together with the parameters by one fused kernel per step.
+
+The learning rate is a number, or a schedule: a callable giving the rate of
+every step, counting from 1, such as step_decay or cosine_decay.
+
+    network = FeedForwardNetwork(dim_list, optimizer = Adam(0.001))
+
+Running this file compares the wall time every optimizer takes to reach a
+target test accuracy:
+
+    optimizers.py mnist_path [target [seconds]]
+"""
+
+import sys, math, time, random
+
+from naive_algebra import get_backend, _zeros
+
+class Optimizer(object):
+    """
+    The base of the optimizers. step updates the parameters in place with
+    the gradients times scale, which turns summed batch gradients into
+    their average.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.steps = 0
+
+    def rate_at(self, step):
+        """ the learning rate of the given step """
+        return self.rate(step) if callable(self.rate) else self.rate
+
+    def step(self, parameters, gradients, scale = 1.0):
+        self.steps += 1
+        self._update(parameters, gradients, scale, self.rate_at(self.steps))
+
+    def reset(self):
+        """ forget the steps taken and the state, to train another network """
+        self.steps = 0
+
+    def _update(self, parameters, gradients, scale, rate):
+        raise NotImplementedError()
+
+class SGD(Optimizer):
+    """ plain gradient descent, p -= rate * g """
+
+    def __init__(self, rate = 0.1):
+        Optimizer.__init__(self, rate)
+
+    def _update(self, parameters, gradients, scale, rate):
+        get_backend().axpy(-rate * scale, gradients, parameters)
+
+class Momentum(Optimizer):
+    """
+    Gradient descent with momentum, the heavy ball or with nesterov=True
+    the Nesterov variant:
+        v = momentum * v + g
+        p -= rate * v, or p -= rate * (g + momentum * v)
+    """
+
+    def __init__(self, rate = 0.01, momentum = 0.9, nesterov = False):
+        Optimizer.__init__(self, rate)
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.velocity = None
+
+    def reset(self):
+        Optimizer.reset(self)
+        self.velocity = None
+
+    def _update(self, parameters, gradients, scale, rate):
+        if self.velocity is None or len(self.velocity) != len(parameters):
+            self.velocity = _zeros(len(parameters), parameters.typecode)
+        get_backend().momentum(parameters, gradients, self.velocity, scale, rate,
+                self.momentum, self.nesterov)
+
+class Adam(Optimizer):
+    """
+    Adam, every parameter gets its own step size from running estimates of
+    the mean and the variance of its gradient, corrected for their start at
+    zero.
+    """
+
+    def __init__(self, rate = 0.001, beta1 = 0.9, beta2 = 0.999, epsilon = 1e-8):
+        Optimizer.__init__(self, rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.moments = None
+        self.squares = None
+
+    def reset(self):
+        Optimizer.reset(self)
+        self.moments = self.squares = None
+
+    def _update(self, parameters, gradients, scale, rate):
+        if self.moments is None or len(self.moments) != len(parameters):
+            self.moments = _zeros(len(parameters), parameters.typecode)
+            self.squares = _zeros(len(parameters), parameters.typecode)
+        get_backend().adam(parameters, gradients, self.moments, self.squares, scale, rate,
+                self.beta1, self.beta2, self.epsilon, self.steps)
+
+def step_decay(rate, factor = 0.5, every = 1000):
+    """ the rate multiplied by factor every given number of steps """
+    return lambda step: rate * factor ** ((step - 1) // every)
+
+def exponential_decay(rate, decay = 0.96, every = 1000):
+    """ the rate multiplied by decay every given number of steps, smoothly """
+    return lambda step: rate * decay ** ((step - 1) / float(every))
+
+def cosine_decay(rate, total, minimum = 0.0):
+    """ from rate down to minimum along half a cosine over total steps, then minimum """
+    def schedule(step):
+        progress = min(1.0, (step - 1) / float(total))
+        return minimum + (rate - minimum) * 0.5 * (1 + math.cos(math.pi * progress))
+    return schedule
+
+def warmup(schedule, steps):
+    """ a linear ramp up to the rate of schedule, a number or a schedule, over steps """
+    def ramped(step):
+        rate = schedule(step) if callable(schedule) else schedule
+        return rate * min(1.0, step / float(steps))
+    return ramped
+
+def time_to_accuracy(make_network, training, testing, target, budget = 60.0,
+        batch_size = 20, every = 1000):
+    """
+    Train a network made by make_network on training, evaluating on testing
+    after every given number of samples, until the test accuracy reaches
+    target or budget seconds are spent training. Returns the training
+    seconds to the target, None if missed, and the best accuracy.
+    """
+    from feedforward_network import sample_wrapper
+
+    network = make_network()
+    best, seconds = 0.0, 0.0
+    while seconds < budget:
+        # one shuffled pass over the training set, cut into rounds
+        order = range(len(training[1]))
+        random.shuffle(order)
+        images, labels = [training[0][i] for i in order], [training[1][i] for i in order]
+        for start in xrange(0, len(labels), every):
+            began = time.time()
+            network.train(sample_wrapper((images[start:start + every],
+                labels[start:start + every])), limit = every, batch_size = batch_size)
+            seconds += time.time() - began
+
+            accuracy = network.evaluate(*testing)[0]
+            best = max(best, accuracy)
+            if accuracy >= target:
+                return seconds, best
+            if seconds >= budget:
+                break
+    return None, best
+
+def main(mnist_path, target = 0.9, budget = 60.0):
+    """ time the deep network of main.py to a target accuracy with every optimizer """
+    import mnist_adapter
+    from feedforward_network import FeedForwardNetwork
+
+    loader = mnist_adapter.MNIST(mnist_path)
+    training, testing = loader.load_training(), loader.load_testing()
+    dim_list = [len(training[0][0])] + [10] * 10
+    configs = [
+            ('sgd', lambda: None),
+            ('momentum', lambda: Momentum(0.01)),
+            ('nesterov', lambda: Momentum(0.01, nesterov = True)),
+            ('adam', lambda: Adam(0.001)),
+            ('adam+cosine', lambda: Adam(cosine_decay(0.002, 5000, 0.0001))),
+            ]
+
+    print "optimizer    seconds to %.2f  best accuracy" % target
+    for (name, make_optimizer) in configs:
+        random.seed(0)
+        seconds, best = time_to_accuracy(lambda: FeedForwardNetwork(dim_list, eta = 0.01,
+            activation = 'tanh', normalize = False, optimizer = make_optimizer()),
+            training, testing, target, budget)
+        print "%-12s %15s  %13.4f" % (name, '%.1f' % seconds if seconds is not None
+                else 'missed', best)
+
+if __name__ == '__main__':
+    if len(sys.argv) in (2, 3, 4):
+        main(sys.argv[1], *[float(arg) for arg in sys.argv[2:]])
+    else:
+        print "Usage: %s mnist_path [target [seconds]]" % sys.argv[0]
@@ -0,0 +1,251 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Compute backend of naive_algebra running the large products on a pool of
+processes.
+
+ParallelBackend wraps a serial backend, python by default, and splits the
+output rows of its matrix products, gemv, gemm, gemm_nt and the fused
+affine and affine_nt, across worker processes. Thus Matrix.mul, vmul,
+vaffine and the batched forward pass of the network all use every core.
+
+The operands are copied into a shared memory segment the workers inherit
+through fork, with one memmove each, and every worker computes its block
+of rows straight into the shared result. Only the kernel name, the sizes
+and the offsets into the segment go through the pipes, nothing is pickled
+by value. Products smaller than the threshold, where handing them to the
+workers costs more than it saves, and all the other kernels run serially.
+Select it with naive_algebra.set_backend('parallel'), or by setting the
+environment variable NAIVE_ALGEBRA_BACKEND=parallel.
+
+Running this file times the products serially and on the pool across
+sizes, to find where the crossover sits on the machine:
+
+    parallel_backend.py [workers [repeat [python|numpy]]]
+"""
+
+import sys, os, time, ctypes, traceback
+import multiprocessing
+from collections import namedtuple
+
+from naive_algebra import _create_backend, _zeros, view_type, CTYPES
+
+# multiply-adds of a product below which it runs serially, by serial
+# backend. A parallel call costs about 0.3ms more, the time of some 3000
+# multiply-adds in pure python, thus the pool pays off from about twice
+# that on two cores or more. With numpy, copying the operands takes as long
+# as a matrix-vector product, only large matrix products are worth it.
+THRESHOLDS = {'python': 1 << 13, 'numpy': 1 << 23}
+# alignment of the operands in the shared segment, a cache line
+ALIGNMENT = 64
+# speedup a product must reach on the pool to count as a win in crossover,
+# above the noise of the timings
+MARGIN = 1.1
+
+# a buffer of the shared segment, as sent to the workers: its typecode,
+# byte offset and length
+Shared = namedtuple('Shared', ('typecode', 'offset', 'length'))
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _worker(backend, segment, conn):
+    def view(arg):
+        if not isinstance(arg, Shared):
+            return arg
+        return view_type(arg.typecode, arg.length).from_buffer(segment, arg.offset)
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+
+        name, args = task
+        try:
+            getattr(backend, name)(*[view(arg) for arg in args])
+            conn.send(None)
+        except Exception:
+            conn.send(traceback.format_exc())
+
+class ParallelBackend(object):
+    """
+    A compute backend running the products of another one, given by name
+    or as a backend object, over workers processes, one per core by
+    default. The pool is started by the first product of threshold
+    multiply-adds or more, and grown with the operands.
+    """
+    name = 'parallel'
+
+    def __init__(self, backend = 'python', workers = None, threshold = None):
+        self.backend = _create_backend(backend) if isinstance(backend, basestring) else backend
+        self.workers = workers or multiprocessing.cpu_count()
+        self.threshold = THRESHOLDS.get(self.backend.name, 0) if threshold is None else threshold
+        self.segment = None
+        self.pool = []
+        self.pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def start(self, capacity):
+        """ (re)start the workers on a shared segment of capacity bytes """
+        self.close()
+        self.segment = multiprocessing.RawArray(ctypes.c_char, capacity)
+        for w in xrange(self.workers):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target = _worker,
+                    args = (self.backend, self.segment, child))
+            proc.daemon = True
+            proc.start()
+            self.pool.append((proc, parent))
+        self.pid = os.getpid()
+
+    def close(self):
+        """ stop the workers, the next large product starts them again """
+        if self.pid == os.getpid():
+            for (proc, conn) in self.pool:
+                conn.send(None)
+                proc.join()
+        self.pool = []
+        self.segment = None
+        self.pid = None
+
+    def _run(self, name, row_num, work, operands, out, out_width, make_args):
+        """
+        Run the kernel name on row blocks of the output in parallel, or
+        serially if it's too small. operands are (buffer, width) pairs, the
+        buffer being split by rows of width items, or shared whole for a
+        width of None. make_args builds the kernel arguments of a block of
+        rows from the Shared blocks of the operands and of the output.
+        """
+        if (work < self.threshold or row_num < 2 or self.workers < 2
+                or any(not hasattr(buf, 'buffer_info') or buf.typecode not in CTYPES
+                    for (buf, width) in operands + [(out, None)] if buf is not None)):
+            return getattr(self.backend, name)(*make_args(row_num,
+                *([buf for (buf, width) in operands] + [out])))
+
+        like = operands[0][0]
+        result = out if out is not None else _zeros(row_num * out_width, like.typecode)
+        buffers = operands + [(result, out_width)]
+        offsets, size = [], 0
+        for (buf, width) in buffers:
+            offsets.append(size)
+            size = _aligned(size + len(buf) * buf.itemsize)
+
+        if self.pid != os.getpid():
+            # never started, or started by the process this one was forked from
+            self.start(size)
+        elif len(self.segment) < size:
+            self.start(max(size, 2 * len(self.segment)))
+        base = ctypes.addressof(self.segment)
+        for ((buf, width), offset) in zip(operands, offsets):
+            ctypes.memmove(base + offset, buf.buffer_info()[0], len(buf) * buf.itemsize)
+
+        # the blocks of rows, as even as they get
+        count = min(self.workers, row_num)
+        bounds = [row_num * i // count for i in xrange(count + 1)]
+        for (w, (start, stop)) in enumerate(zip(bounds, bounds[1:])):
+            blocks = [Shared(buf.typecode, offset, len(buf)) if width is None
+                    else Shared(buf.typecode, offset + start * width * buf.itemsize,
+                        (stop - start) * width)
+                    for ((buf, width), offset) in zip(buffers, offsets)]
+            self.pool[w][1].send((name, make_args(stop - start, *blocks)))
+
+        errors = [conn.recv() for (proc, conn) in self.pool[:count]]
+        for error in errors:
+            if error is not None:
+                raise RuntimeError('parallel %s failed, %s' % (name, error))
+
+        ctypes.memmove(result.buffer_info()[0], base + offsets[-1], len(result) * result.itemsize)
+        return result
+
+    def gemv(self, a, row_num, col_num, x, out = None):
+        return self._run('gemv', row_num, row_num * col_num, [(a, col_num), (x, None)],
+                out, 1, lambda rows, a, x, out: (a, rows, col_num, x, out))
+
+    def gemm(self, a, row_num, inner_num, b, col_num, out = None):
+        return self._run('gemm', row_num, row_num * inner_num * col_num,
+                [(a, inner_num), (b, None)], out, col_num,
+                lambda rows, a, b, out: (a, rows, inner_num, b, col_num, out))
+
+    def gemm_nt(self, a, row_num, inner_num, b, col_num, out = None):
+        return self._run('gemm_nt', row_num, row_num * inner_num * col_num,
+                [(a, inner_num), (b, None)], out, col_num,
+                lambda rows, a, b, out: (a, rows, inner_num, b, col_num, out))
+
+    def affine(self, a, row_num, col_num, x, b, scale, activation, out = None):
+        return self._run('affine', row_num, row_num * col_num,
+                [(a, col_num), (x, None), (b, 1)], out, 1,
+                lambda rows, a, x, b, out: (a, rows, col_num, x, b, scale, activation, out))
+
+    def affine_nt(self, a, row_num, inner_num, w, col_num, b, scale, activation, out = None):
+        return self._run('affine_nt', row_num, row_num * inner_num * col_num,
+                [(a, inner_num), (w, None), (b, None)], out, col_num,
+                lambda rows, a, w, b, out: (a, rows, inner_num, w, col_num, b, scale,
+                    activation, out))
+
+def crossover(workers = None, repeat = 5, backend = 'python', out = sys.stdout):
+    """
+    Time gemv and gemm serially and in parallel over growing sizes, each
+    the best of repeat runs, check both agree, and report the smallest
+    product from which the pool is faster by MARGIN for every larger one.
+    """
+    from naive_algebra import Matrix, Vector, vmul, mmul, set_backend
+
+    serial = _create_backend(backend)
+    parallel = ParallelBackend(serial, workers, threshold = 0)
+    cases = []
+    for n in (100, 200, 300, 500, 800, 1000):
+        m, x = Matrix.fromRandom(n, n), Vector.fromRandom(n)
+        cases.append(('vmul %dx%d' % (n, n), n * n, lambda m = m, x = x: vmul(m, x)))
+    for (rows, n) in ((10, 100), (100, 100), (100, 300), (100, 784)):
+        a, b = Matrix.fromRandom(rows, 784), Matrix.fromRandom(784, n)
+        cases.append(('mul %dx784x%d' % (rows, n), rows * 784 * n,
+            lambda a = a, b = b: mmul(a, b)))
+
+    out.write("%d workers, %s backend\n" % (parallel.workers, serial.name))
+    out.write("%-16s %12s %12s %12s %8s\n" % ('product', 'multiply-add', 'serial',
+        'parallel', 'speedup'))
+    wins = []
+    previous = set_backend(serial)
+    try:
+        for (name, work, func) in cases:
+            timings, results = [], []
+            for selected in (serial, parallel):
+                set_backend(selected)
+                results.append(func())
+                best = float('inf')
+                for i in xrange(repeat):
+                    start = time.time()
+                    func()
+                    best = min(best, time.time() - start)
+                timings.append(best)
+
+            if not results[0].equalTo(results[1], 1e-9):
+                raise AssertionError('%s differs between serial and parallel' % name)
+            speedup = timings[0] / timings[1]
+            wins.append((work, speedup >= MARGIN))
+            out.write("%-16s %12d %10.2fms %10.2fms %7.2fx\n" % (name, work,
+                timings[0] * 1000, timings[1] * 1000, speedup))
+    finally:
+        set_backend(previous)
+        parallel.close()
+
+    fastest = None
+    for (work, win) in sorted(wins, reverse = True):
+        if not win:
+            break
+        fastest = work
+    if fastest is None:
+        out.write("the pool never wins here\n")
+    else:
+        out.write("crossover at about %d multiply-adds, the threshold is %d\n" % (fastest,
+            THRESHOLDS.get(serial.name, 0)))
+    return fastest
+
+if __name__ == '__main__':
+    if len(sys.argv) > 4:
+        print "Usage: %s [workers [repeat [python|numpy]]]" % sys.argv[0]
+        sys.exit(1)
+    crossover(*[int(arg) for arg in sys.argv[1:3]] + sys.argv[3:])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Score a labelled set with a process pool.
+
+The trained weights are copied once into shared memory, a read-only
+snapshot from which every worker builds its own network. The set is split
+into chunks of consecutive samples, every chunk is scored independently and
+only the confusion matrices are sent back to be merged.
+"""
+
+import sys, time
+import multiprocessing
+
+from feedforward_network import FeedForwardNetwork, precision_recall
+from parallel_training import parameter_count, _copy
+
+# state of a worker process, set up once by _init_worker
+_network = None
+_data = None
+
+def _init_worker(dim_list, typecode, activations, normalize, weights, data):
+    global _network, _data
+    _network = FeedForwardNetwork(dim_list, typecode = typecode,
+            activation = activations, normalize = normalize)
+    _copy(_network.parameters, weights, False)
+    _data = data
+
+def _score(chunk):
+    start, stop = chunk
+    began = time.time()
+    images, labels = _data
+    accuracy, confusion = _network.evaluate(images[start:stop], labels[start:stop])
+    return confusion, time.time() - began
+
+def evaluate_parallel(network, images, labels, workers = None, chunk_size = 1000):
+    """
+    Evaluate the network on the whole set with a pool of workers, one per
+    cpu by default. Returns a dict with the accuracy, the confusion matrix,
+    per-class precision and recall, the wall time and the summed time spent
+    in the workers.
+    """
+    typecode = network.parameters.typecode
+    weights = multiprocessing.RawArray(typecode, parameter_count(network))
+    _copy(network.parameters, weights, True)
+
+    began = time.time()
+    chunks = [(start, min(start + chunk_size, len(labels)))
+            for start in xrange(0, len(labels), chunk_size)]
+    pool = multiprocessing.Pool(workers, _init_worker,
+            (network.dim_list, typecode, network.activations(), network.normalize,
+                weights, (images, labels)))
+    try:
+        scores = pool.map(_score, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    class_num = network.dim_list[-1]
+    confusion = [[0] * class_num for i in xrange(class_num)]
+    for (part, seconds) in scores:
+        for (row, part_row) in zip(confusion, part):
+            row[:] = [x + y for (x, y) in zip(row, part_row)]
+
+    total = sum(sum(row) for row in confusion)
+    precision, recall = precision_recall(confusion)
+    wall = time.time() - began
+    return {
+            'accuracy': sum(confusion[i][i] for i in xrange(class_num)) * 1.0 / total if total else 0.0,
+            'confusion': confusion,
+            'precision': precision,
+            'recall': recall,
+            'samples': total,
+            'seconds': wall,
+            'worker_seconds': sum(seconds for (part, seconds) in scores),
+            }
+
+def report(result, out = sys.stdout):
+    out.write("class  precision  recall\n")
+    for (label, (p, r)) in enumerate(zip(result['precision'], result['recall'])):
+        out.write("%5d  %9.4f  %6.4f\n" % (label, p, r))
+    out.write("%d samples in %.2fs (%.2fs in workers), Prec = %.4f\n" % (
+        result['samples'], result['seconds'], result['worker_seconds'], result['accuracy']))
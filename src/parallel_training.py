@@ -0,0 +1,175 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Data-parallel training of a FeedForwardNetwork over a pool of processes.
+
+Every round each worker takes its own shard of consecutive samples, computes
+the gradients against the current weights, and the parent averages them
+into one gradient descent step, as if the whole round were one mini-batch.
+
+The weights and the per-worker gradients are kept in shared memory, thus a
+sync moves raw bytes only and nothing is pickled but the shard boundaries.
+Both are laid out as the parameter and gradient arenas of the network, and
+every copy, sum and update is one pass over a single buffer. The dataset
+reaches the workers through fork, it's never sent either.
+"""
+
+import sys, time, ctypes, traceback, Queue
+import multiprocessing
+
+from naive_algebra import Matrix, get_backend, _zeros
+from feedforward_network import FeedForwardNetwork, one_hot
+
+def parameter_count(network):
+    return len(network.parameters)
+
+def _copy(buf, shared, to_shared):
+    """ memcpy between an arena and a shared array of the same size """
+    address, length = buf.buffer_info()
+    if to_shared:
+        ctypes.memmove(ctypes.addressof(shared), address, length * buf.itemsize)
+    else:
+        ctypes.memmove(address, ctypes.addressof(shared), length * buf.itemsize)
+
+def _worker(dim_list, typecode, activations, normalize, data, weights, gradient,
+        tasks, results):
+    try:
+        network = FeedForwardNetwork(dim_list, typecode = typecode,
+                activation = activations, normalize = normalize)
+        images, labels = data
+        class_num = dim_list[-1]
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            start, stop = task
+            _copy(network.parameters, weights, False)
+            inputs = Matrix.fromRows(images[start:stop], typecode)
+            targets = one_hot(labels[start:stop], class_num, typecode)
+            buffers = network._batch_buffers(stop - start)
+            loss = network._batch_gradients(
+                    network._forward_batch(inputs, buffers), targets, buffers)[0]
+            _copy(network.gradients, gradient, True)
+            results.put(('done', (stop - start, loss)))
+    except Exception:
+        # the parent waits on results, tell it instead of dying silently
+        results.put(('error', traceback.format_exc()))
+
+def _result(results, procs, timeout = 1.0):
+    """
+    The next result of the workers, waiting for it, RuntimeError if a
+    worker failed, or died without a word, killed or crashed.
+    """
+    while True:
+        try:
+            kind, item = results.get(timeout = timeout)
+        except Queue.Empty:
+            dead = [proc for proc in procs if not proc.is_alive()]
+            if dead and results.empty():
+                raise RuntimeError('training worker %d died with exit code %s' % (
+                    dead[0].pid, dead[0].exitcode))
+            continue
+        if kind == 'error':
+            raise RuntimeError('training worker failed, ' + item)
+        return item
+
+class ParallelTrainer(object):
+    """
+    Train a network on several processes, with synchronous gradient
+    averaging. Every round all the workers handle batch_size samples each,
+    and the weights are updated once with the averaged gradients.
+    """
+
+    def __init__(self, network, workers = 4, batch_size = 10):
+        self.network = network
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def train(self, data, logger = None, limit = None):
+        """
+        Train on data, a tuple of images and labels as returned by the
+        MNIST loader, with at most limit samples. Returns the number of
+        samples used.
+        """
+        network = self.network
+        typecode = network.parameters.typecode
+        count = parameter_count(network)
+        weights = multiprocessing.RawArray(typecode, count)
+        gradients = [multiprocessing.RawArray(typecode, count) for w in xrange(self.workers)]
+        results = multiprocessing.Queue()
+        tasks = [multiprocessing.Queue() for w in xrange(self.workers)]
+        procs = [multiprocessing.Process(target = _worker,
+            args = (network.dim_list, typecode, network.activations(), network.normalize,
+                data, weights, gradients[w], tasks[w], results))
+            for w in xrange(self.workers)]
+        for proc in procs:
+            proc.daemon = True
+            proc.start()
+
+        total = len(data[1]) if limit is None else min(limit, len(data[1]))
+        summed = network._gradient_arena()
+        received = _zeros(len(summed), typecode)
+        counter = 0
+        try:
+            while counter < total:
+                _copy(network.parameters, weights, True)
+                shards = []
+                for w in xrange(self.workers):
+                    start = counter + w * self.batch_size
+                    stop = min(start + self.batch_size, total)
+                    if start < stop:
+                        tasks[w].put((start, stop))
+                        shards.append(w)
+
+                samples, loss = 0, 0.0
+                for w in shards:
+                    n, l = _result(results, procs)
+                    samples += n
+                    loss += l
+
+                # every worker wrote into its own slot, sum them up into
+                # the gradient arena and take one step
+                backend = get_backend()
+                for (i, w) in enumerate(shards):
+                    _copy(summed if i == 0 else received, gradients[w], False)
+                    if i > 0:
+                        backend.add(summed, received, summed)
+                network._apply_gradients(1.0 / samples)
+
+                if logger != None:
+                    logger(str(counter) + "," + str(loss / samples))
+
+                counter += samples
+        finally:
+            for queue in tasks:
+                queue.put(None)
+            for proc in procs:
+                proc.join()
+
+        return counter
+
+def main(mnist_path, samples = 2000):
+    """ report the throughput and scaling efficiency on MNIST """
+    import mnist_adapter
+    data = mnist_adapter.MNIST(mnist_path).load_training()
+    dim_list = [len(data[0][0]), 10, 10, 10, 10, 10, 10, 10, 10, 10, 10]
+
+    base = None
+    print "workers  samples/sec  speedup  efficiency"
+    for workers in (1, 2, 4, 8):
+        network = FeedForwardNetwork(dim_list, eta = 0.1)
+        trainer = ParallelTrainer(network, workers, batch_size = 10)
+        start = time.time()
+        count = trainer.train(data, limit = samples)
+        rate = count / (time.time() - start)
+        base = base or rate
+        print "%7d  %11.1f  %6.2fx  %9.1f%%" % (workers, rate, rate / base,
+                rate / base / workers * 100)
+
+if __name__ == '__main__':
+    if len(sys.argv) in (2, 3):
+        main(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
+    else:
+        print "Usage: %s mnist_path [samples]" % sys.argv[0]
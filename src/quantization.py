@@ -0,0 +1,359 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Reduced precision inference models of a trained FeedForwardNetwork.
+
+quantize exports the weights of a network as float32, float16 or int8, the
+biases staying float32, into a QuantizedNetwork that only predicts. An int8
+layer keeps a scale and a zero point, mapping the range of its weights, zero
+included, on [-128, 127]:
+
+    weight ~ quant_scale * (q - zero_point)
+
+and runs on the int8 values directly, folding the scale and the zero point
+into the bias, the scale of the activation and a rank-1 correction:
+
+    x * weight^T = quant_scale * (x * q^T - zero_point * sum(x))
+
+Neither python nor BLAS compute in half precision, thus a float16 model is
+compact on disk only, its weights are widened to float32 once when built.
+Every model computes in float32.
+
+Running this file compares the accuracy, size and speed of every precision
+against the full precision network:
+
+    quantization.py checkpoint mnist_path
+"""
+
+import sys, os, time, struct, math
+from array import array
+from itertools import izip, imap
+
+from naive_algebra import Matrix, Vector, get_backend
+from feedforward_network import argmax, batches
+from checkpoint import ACTIVATION_CODES, _aligned
+
+PRECISIONS = ('float32', 'float16', 'int8')
+# typecode of the stored weights of every precision, float16 as raw bits
+STORAGE_TYPECODES = {'float32': 'f', 'float16': 'H', 'int8': 'b'}
+COMPUTE_TYPECODE = 'f'
+
+QUANTIZED_MAGIC = 'FFNNQUANTZ'
+QUANTIZED_VERSION = 1
+# magic, version, byte order, precision index and depth
+QUANTIZED_HEADER = '<10sIcBI'
+# activation code, scale, quant_scale and zero_point of every layer
+QUANTIZED_LAYER = '<Bddi'
+
+def half_bits(x):
+    """
+    The bits of x as an IEEE 754 half precision float, rounded to the
+    nearest even, out of range values becoming infinite.
+    """
+    f, = struct.unpack('<I', struct.pack('<f', x))
+    sign = (f >> 16) & 0x8000
+    exponent = ((f >> 23) & 0xff) - 127 + 15
+    mantissa = f & 0x7fffff
+
+    if exponent == 0xff - 127 + 15:
+        # infinite or not a number
+        return sign | 0x7c00 | (0x200 if mantissa else 0)
+    if exponent >= 0x1f:
+        return sign | 0x7c00
+    if exponent <= 0:
+        # subnormal, or zero below the smallest one
+        if exponent < -10:
+            return sign
+        mantissa |= 0x800000
+        shift = 14 - exponent
+        half = mantissa >> shift
+        rest, middle = mantissa & ((1 << shift) - 1), 1 << (shift - 1)
+    else:
+        half = (exponent << 10) | (mantissa >> 13)
+        rest, middle = mantissa & 0x1fff, 0x1000
+
+    # a carry out of the mantissa rightly moves to the next exponent
+    if rest > middle or (rest == middle and half & 1):
+        half += 1
+    return sign | half
+
+def half_value(bits):
+    """ the float of the half precision bits """
+    sign = -1.0 if bits & 0x8000 else 1.0
+    exponent, mantissa = (bits >> 10) & 0x1f, bits & 0x3ff
+    if exponent == 0:
+        return sign * math.ldexp(mantissa, -24)
+    if exponent == 0x1f:
+        return sign * float('inf') if not mantissa else float('nan')
+    return sign * math.ldexp(mantissa | 0x400, exponent - 25)
+
+def int8_parameters(data):
+    """ the scale and zero point mapping the range of data, zero included, on [-128, 127] """
+    low, high = min(min(data), 0.0), max(max(data), 0.0)
+    scale = (high - low) / 255.0 or 1.0
+    zero_point = int(round(-128 - low / scale))
+    return scale, max(-128, min(127, zero_point))
+
+class QuantizedLayer(object):
+    """
+    The weight of row_num by col_num and the bias of one layer, weight in
+    the storage typecode of the precision and bias in float32.
+    """
+    __slots__ = ('row_num', 'col_num', 'weight', 'bias', 'scale', 'activation',
+            'quant_scale', 'zero_point', '_weight', '_bias', '_ones')
+
+    def __init__(self, row_num, col_num, weight, bias, scale, activation,
+            quant_scale = 1.0, zero_point = 0):
+        self.row_num = row_num
+        self.col_num = col_num
+        self.weight = weight
+        self.bias = bias
+        self.scale = scale
+        self.activation = activation
+        self.quant_scale = quant_scale
+        self.zero_point = zero_point
+
+        # what the kernels run on: the weights, widened if stored in half
+        # precision, and the bias divided by the quantization scale
+        if weight.typecode == 'H':
+            self._weight = array(COMPUTE_TYPECODE, imap(half_value, weight))
+        else:
+            self._weight = weight
+        self._bias = array(COMPUTE_TYPECODE, [b / quant_scale for b in bias])
+        self._ones = (array(COMPUTE_TYPECODE, [1.0]) * col_num,
+                array(COMPUTE_TYPECODE, [1.0]) * row_num)
+
+    def forward(self, inputs, out):
+        """ the outputs of the layer for the rows of inputs, into out """
+        backend = get_backend()
+        args = (inputs.data, inputs.row_num, self.col_num, self._weight, self.row_num, self._bias)
+        if not self.zero_point:
+            return backend.affine_nt(*args + (self.scale * self.quant_scale,
+                self.activation, out.data))
+
+        backend.affine_nt(*args + (1.0, None, out.data))
+        sums = backend.gemv(inputs.data, inputs.row_num, self.col_num, self._ones[0])
+        backend.ger(-self.zero_point, sums, self._ones[1], out.data)
+        backend.scale(out.data, self.scale * self.quant_scale, out.data)
+        return backend.activate(self.activation, out.data, out.data)
+
+    def nbytes(self):
+        return (len(self.weight) * self.weight.itemsize
+                + len(self.bias) * self.bias.itemsize)
+
+class QuantizedNetwork(object):
+    """
+    An inference only network with weights in reduced precision, see
+    quantize. It predicts like FeedForwardNetwork, without touching any
+    state, thus from any number of threads.
+    """
+
+    def __init__(self, dim_list, precision, layers):
+        if precision not in PRECISIONS:
+            raise ValueError('unknown precision %r, expected one of %s'
+                    % (precision, ', '.join(PRECISIONS)))
+        self.dim_list = list(dim_list)
+        self.precision = precision
+        self.layers = layers
+
+    def predict_batch(self, samples):
+        """
+        Predict the classes of a block of samples, given as a matrix with
+        one sample per row or as a sequence of vectors. Returns the argmax
+        position of the output for every sample.
+        """
+        if not isinstance(samples, Matrix):
+            samples = Matrix.fromRows(samples, COMPUTE_TYPECODE)
+        elif samples.data.typecode != COMPUTE_TYPECODE:
+            samples = Matrix(samples.row_num, samples.col_num, samples.data, typecode = COMPUTE_TYPECODE)
+
+        for layer in self.layers:
+            output = Matrix(samples.row_num, layer.row_num, typecode = COMPUTE_TYPECODE)
+            layer.forward(samples, output)
+            samples = output
+        return [argmax(samples.row_view(row_id)) for row_id in xrange(samples.row_num)]
+
+    def inference(self, vector):
+        """ the prediction of one sample, one-hot encoded like FeedForwardNetwork.inference """
+        rtn = Vector.fromZeros(self.dim_list[-1])
+        rtn[self.predict_batch([vector])[0]] = 1
+        return rtn
+
+    def evaluate(self, images, labels, batch_size = 100):
+        """
+        Evaluate the model on a whole labelled set, batch by batch.
+        Returns the accuracy and the confusion matrix as a list of lists,
+        confusion[label][prediction] counting the samples.
+        """
+        class_num = self.dim_list[-1]
+        confusion = [[0] * class_num for i in xrange(class_num)]
+        correct, total = 0, 0
+        for batch in batches(izip(images, labels), batch_size):
+            predictions = self.predict_batch([img for (img, label) in batch])
+            for ((img, label), pred) in izip(batch, predictions):
+                confusion[label][pred] += 1
+                correct += (1 if label == pred else 0)
+            total += len(batch)
+
+        return (correct * 1.0 / total if total else 0.0), confusion
+
+    def nbytes(self):
+        """ bytes of the stored weights and biases """
+        return sum(layer.nbytes() for layer in self.layers)
+
+    def save(self, path):
+        """
+        Write the model into a file laid out like a checkpoint: a header,
+        the settings of every layer, then the weight and the bias of every
+        layer as raw blocks aligned on 8 bytes.
+        """
+        head = (struct.pack(QUANTIZED_HEADER, QUANTIZED_MAGIC, QUANTIZED_VERSION,
+            sys.byteorder[0], PRECISIONS.index(self.precision), len(self.dim_list))
+            + struct.pack('<%dI' % len(self.dim_list), *self.dim_list)
+            + ''.join(struct.pack(QUANTIZED_LAYER, ACTIVATION_CODES.index(layer.activation),
+                layer.scale, layer.quant_scale, layer.zero_point) for layer in self.layers))
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(head)
+            for layer in self.layers:
+                for buf in (layer.weight, layer.bias):
+                    file.write('\0' * (_aligned(file.tell()) - file.tell()))
+                    buf.tofile(file)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ read a model written by save, ValueError is raised if the file is not one """
+        with open(path, 'rb') as file:
+            try:
+                magic, version, byteorder, precision, depth = struct.unpack(QUANTIZED_HEADER,
+                        file.read(struct.calcsize(QUANTIZED_HEADER)))
+                if magic != QUANTIZED_MAGIC:
+                    raise ValueError('not a quantized model file')
+                if version != QUANTIZED_VERSION:
+                    raise ValueError('unsupported quantized model version %d' % version)
+                if byteorder != sys.byteorder[0]:
+                    raise ValueError('quantized model written with another byte order')
+                precision = PRECISIONS[precision]
+                dim_list = list(struct.unpack('<%dI' % depth, file.read(depth * 4)))
+                size = struct.calcsize(QUANTIZED_LAYER)
+                settings = [struct.unpack(QUANTIZED_LAYER, file.read(size))
+                        for i in xrange(depth - 1)]
+
+                layers = []
+                for ((rows, cols), (code, scale, quant_scale, zero_point)) in izip(
+                        zip(dim_list[1:], dim_list[:-1]), settings):
+                    blocks = []
+                    for (typecode, length) in ((STORAGE_TYPECODES[precision], rows * cols),
+                            (COMPUTE_TYPECODE, rows)):
+                        file.seek(_aligned(file.tell()))
+                        buf = array(typecode)
+                        buf.fromfile(file, length)
+                        blocks.append(buf)
+                    layers.append(QuantizedLayer(rows, cols, blocks[0], blocks[1], scale,
+                        ACTIVATION_CODES[code], quant_scale, zero_point))
+            except (struct.error, EOFError):
+                raise ValueError('truncated quantized model file')
+            except IndexError:
+                raise ValueError('unknown setting in quantized model file')
+
+        return cls(dim_list, precision, layers)
+
+def quantize(network, precision = 'int8'):
+    """
+    Export the weights and biases of a trained network into a
+    QuantizedNetwork of the given precision, one of PRECISIONS.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision %r, expected one of %s'
+                % (precision, ', '.join(PRECISIONS)))
+
+    layers = []
+    for layer in network.layers[:-1]:
+        weight = layer.weight
+        data = weight.data
+        quant_scale, zero_point = 1.0, 0
+        if precision == 'float32':
+            stored = array('f', data)
+        elif precision == 'float16':
+            stored = array('H', imap(half_bits, data))
+        else:
+            quant_scale, zero_point = int8_parameters(data)
+            stored = array('b', [max(-128, min(127, int(round(w / quant_scale)) + zero_point))
+                for w in data])
+        layers.append(QuantizedLayer(weight.row_num, weight.col_num, stored,
+            array(COMPUTE_TYPECODE, layer.bias.data), layer.scale,
+            layer.activation, quant_scale, zero_point))
+
+    return QuantizedNetwork(network.dim_list, precision, layers)
+
+def network_bytes(network):
+    """ bytes of the weights and biases of a FeedForwardNetwork """
+    return len(network.parameters) * network.parameters.itemsize
+
+def compare(network, images, labels, precisions = PRECISIONS, out = sys.stdout):
+    """
+    Evaluate the network and its model in every precision on a labelled
+    set, print their size, accuracy, accuracy delta and speed, and return
+    the accuracy by precision, 'full' being the network itself.
+    """
+    typecode = network.parameters.typecode
+    models = [('full', network, network_bytes(network))]
+    for precision in precisions:
+        model = quantize(network, precision)
+        models.append((precision, model, model.nbytes()))
+
+    accuracies = {}
+    out.write("precision      bytes  accuracy    delta  us/sample\n")
+    for (name, model, nbytes) in models:
+        start = time.time()
+        accuracy = model.evaluate(images, labels)[0]
+        seconds = time.time() - start
+        accuracies[name] = accuracy
+        out.write("%-9s %10d  %8.4f  %+7.4f  %9.1f\n" % (
+            name if name != 'full' else 'full(%s)' % typecode, nbytes, accuracy,
+            accuracy - accuracies['full'], seconds / max(1, len(labels)) * 1e6))
+    return accuracies
+
+def check_round_trip(path, dim_list = (20, 8, 3)):
+    """
+    Quantize a network in every precision, save and load the model back,
+    and compare the predictions, raise AssertionError on a mismatch.
+    """
+    from feedforward_network import FeedForwardNetwork
+
+    network = FeedForwardNetwork(list(dim_list), activation = ['relu'] * (len(dim_list) - 2)
+            + ['sigmoid'], normalize = False)
+    samples = Matrix.fromRandom(50, dim_list[0])
+    for value in (0.0, 1.0, -2.5, 1e-6, 65504.0, 1e6, 3.14159):
+        if abs(half_value(half_bits(value)) - value) > max(abs(value) / 1024, 2 ** -24) \
+                and value <= 65504:
+            raise AssertionError('float16 conversion of %r' % value)
+
+    expected = network.predict_batch(samples)
+    for precision in PRECISIONS:
+        model = quantize(network, precision)
+        model.save(path)
+        loaded = QuantizedNetwork.load(path)
+        predictions = loaded.predict_batch(samples)
+        if predictions != model.predict_batch(samples):
+            raise AssertionError('predictions differ after loading')
+        agreement = sum(1 for (p, e) in izip(predictions, expected) if p == e)
+        print "%-8s ok, %d/%d predictions as the full network" % (precision, agreement,
+                len(expected))
+    os.remove(path)
+
+if __name__ == '__main__':
+    import tempfile
+    if len(sys.argv) == 3:
+        import mnist_adapter
+        from feedforward_network import FeedForwardNetwork
+        network = FeedForwardNetwork.load(sys.argv[1], mapped = True)
+        images, labels = mnist_adapter.MNIST(sys.argv[2], mapped = True).load_testing()
+        compare(network, images, labels)
+    elif len(sys.argv) == 1:
+        check_round_trip(os.path.join(tempfile.gettempdir(), 'quantized-%d.bin' % os.getpid()))
+    else:
+        print "Usage: %s [checkpoint mnist_path]" % sys.argv[0]
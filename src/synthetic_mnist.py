@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# coding: utf-8
+
+"""
+Generate a synthetic dataset in the IDX format of MNIST.
+
+Every class gets a random blob template, every image is the template of its
+label at a small random shift, with noise added: mostly dark pixels with a
+few bright strokes, like the digits, and the same for the same seed. The
+files get the names MNIST loads, thus a generated directory can be passed
+anywhere an mnist_path is expected, when no real dataset is at hand.
+
+Usage: synthetic_mnist.py directory [train_size [test_size]]
+"""
+
+import sys, os, struct, random
+from array import array
+
+def _templates(rnd, class_num, rows, cols):
+    templates = []
+    for label in xrange(class_num):
+        image = [0] * (rows * cols)
+        for blob in xrange(4):
+            cy, cx = rnd.randint(4, rows - 5), rnd.randint(4, cols - 5)
+            for y in xrange(cy - 3, cy + 4):
+                for x in xrange(cx - 3, cx + 4):
+                    image[y * cols + x] = 255
+        templates.append(image)
+    return templates
+
+def _write_set(path_img, path_lbl, size, rnd, templates, rows, cols):
+    pixels = rows * cols
+    # a pool of noise, read at random offsets instead of drawn pixel by pixel
+    noise = [rnd.randint(0, 63) for i in xrange(pixels * 4)]
+    labels = array('B', [rnd.randrange(len(templates)) for i in xrange(size)])
+
+    with open(path_lbl, 'wb') as file:
+        file.write(struct.pack('>II', 2049, size))
+        labels.tofile(file)
+
+    with open(path_img, 'wb') as file:
+        file.write(struct.pack('>IIII', 2051, size, rows, cols))
+        for label in labels:
+            template = templates[label]
+            shift = rnd.randint(-2, 2) * cols + rnd.randint(-2, 2)
+            start = rnd.randrange(len(noise) - pixels)
+            # rotate the flat image, a shift of whole rows and a few columns
+            shifted = template[shift:] + template[:shift]
+            array('B', [min(255, p + n) for (p, n)
+                in zip(shifted, noise[start:start + pixels])]).tofile(file)
+
+def generate(directory, train_size = 2000, test_size = 500, rows = 28, cols = 28,
+        class_num = 10, seed = 0):
+    """
+    Write the training and testing sets into directory, the same files for
+    the same arguments.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    rnd = random.Random(seed)
+    templates = _templates(rnd, class_num, rows, cols)
+    _write_set(os.path.join(directory, 'train-images-idx3-ubyte'),
+            os.path.join(directory, 'train-labels-idx1-ubyte'),
+            train_size, rnd, templates, rows, cols)
+    _write_set(os.path.join(directory, 't10k-images-idx3-ubyte'),
+            os.path.join(directory, 't10k-labels-idx1-ubyte'),
+            test_size, rnd, templates, rows, cols)
+    return directory
+
+if __name__ == '__main__':
+    if len(sys.argv) in (2, 3, 4):
+        generate(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
+    else:
+        print "Usage: %s directory [train_size [test_size]]" % sys.argv[0]